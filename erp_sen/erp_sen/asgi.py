@@ -3,6 +3,15 @@ ASGI config for erp_sen project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Despliegue ASGI (los endpoints async de gestion_clientes/vistas_async.py, /api/...,
+solo rinden más que bajo WSGI con un servidor ASGI), por ejemplo:
+
+    uvicorn erp_sen.asgi:application --workers 2
+    gunicorn erp_sen.asgi:application -k uvicorn.workers.UvicornWorker -w 2
+
+Passenger sigue sirviendo WSGI (passenger_wsgi.py); el proxy puede enviar solo /api/ al
+proceso ASGI. Comparación local por proceso: manage.py prueba_carga_async.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -56,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gestion_clientes.middleware.PerfilConsultasMiddleware',  # solo si PERFIL_CONSULTAS
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # ← AÑADIR AQUÍ
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -66,6 +67,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Perfil de consultas SQL por petición (encabezados X-Consultas-* y logger
+# 'gestion_clientes.consultas'); WARNING si se pasa del umbral o hay consultas repetidas
+PERFIL_CONSULTAS = env_bool('PERFIL_CONSULTAS', False)
+PERFIL_CONSULTAS_UMBRAL = int(os.getenv('PERFIL_CONSULTAS_UMBRAL', '30'))
+
 # WhiteNoise: compresión + hashes para cache busting
 STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
 
@@ -111,6 +117,41 @@ DATABASES = {
     }
 }
 
+# Cache
+# Por defecto memoria local (por proceso). Con varios workers conviene un backend
+# compartido, p.ej. DJANGO_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# y DJANGO_CACHE_LOCATION=redis://127.0.0.1:6379/1
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', 'erp-sen'),
+    }
+}
+if CACHES['default']['BACKEND'].endswith('LocMemCache'):
+    # El default (300 entradas) se queda corto con páginas CxC y marcas por contrato/cuota
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv('DJANGO_CACHE_MAX_ENTRIES', '20000'))}
+
+# Segundos que viven los catálogos (Nivel, Horario, Sede) en cache. Las señales los
+# invalidan al guardar/borrar; el TTL acota lo que otro proceso con locmem puede ver viejo.
+CATALOGOS_CACHE_TTL = int(os.getenv('CATALOGOS_CACHE_TTL', '300'))
+
+# Segundos que vive cada página del listado CxC en cache. No afecta la frescura (la clave
+# lleva la versión de datos de la sede); solo limita la memoria usada por páginas viejas.
+CXC_CACHE_TTL = int(os.getenv('CXC_CACHE_TTL', '600'))
+
+# Máximo de filas de la exportación XLSX del CxC. El libro se arma completo antes de enviar
+# el primer byte (a diferencia del CSV, que va en streaming): más filas arriesgan el timeout
+# de Passenger, así que por encima de este límite se pide usar CSV o filtrar.
+CXC_XLSX_MAX_FILAS = int(os.getenv('CXC_XLSX_MAX_FILAS', '20000'))
+
+# Páginas del listado CxC en cache. Las versiones de datos viven en la cache, así que solo es
+# seguro con un backend compartido por todos los workers (Redis, Memcached): con memoria
+# local un pago en un worker no invalida las páginas de los demás. Por defecto, activo solo
+# si el backend no es LocMemCache; CXC_CACHE_PAGINAS=1/0 lo fuerza.
+CXC_CACHE_PAGINAS = os.getenv(
+    'CXC_CACHE_PAGINAS', '0' if CACHES['default']['BACKEND'].endswith('LocMemCache') else '1'
+) == '1'
+
 LOGIN_URL = '/'
 LOGIN_REDIRECT_URL = '/inicio/'
 
@@ -31,6 +31,7 @@
   const cfg = document.getElementById('cxc-config');
   const URL_APLICAR  = cfg?.dataset.aplicarUrl  || '';
   const URL_ELIMINAR = cfg?.dataset.eliminarUrl || '';
+  const URL_LOTE     = cfg?.dataset.loteUrl || '';
   const HOY_DEFAULT  = cfg?.dataset.hoy || '';
 
   const modalEl = document.getElementById('modalPago');
@@ -65,72 +66,120 @@
     return '$ ' + n.toLocaleString('es-CO');
   }
 
+  // Mismo formato que el filtro moneda_puntos de la tabla ($1.234.567)
+  function formatPuntos(n) {
+    return '$' + Math.round(Number(n || 0)).toLocaleString('es-CO', { useGrouping: 'always' });
+  }
+
+  // Actualiza en sitio las filas del listado con el estado devuelto por el servidor
+  // (aplicar/eliminar pago) en vez de recargar la página completa.
+  function actualizarFilas(filas) {
+    (filas || []).forEach(f => {
+      const tr = document.querySelector(`tr[data-fila="${f.cuota_id}"]`);
+      if (!tr) return;  // la cuota no está en esta página
+      const celda = (campo, texto) => {
+        const td = tr.querySelector(`[data-campo="${campo}"]`);
+        if (td) td.textContent = texto;
+      };
+      const pagado = Number(f.valor_pagado || 0);
+      const saldo = Number(f.saldo || 0);
+      celda('estado', f.estado);
+      celda('pagado', pagado ? formatPuntos(pagado) : '—');
+      celda('saldo', saldo ? formatPuntos(saldo) : '$0');
+      celda('fecha', f.ultimo_pago_fecha);
+      celda('medio', f.ultimo_pago_medio || '—');
+      celda('factura', f.ultimo_pago_factura || '—');
+      celda('referencia', f.ultimo_pago_referencia || '—');
+      celda('obs', f.ultimo_pago_obs);
+      tr.classList.toggle('table-danger', !!f.vencida_roja);
+      const btn = tr.querySelector('.btn-aplicar-pago');
+      if (btn) btn.dataset.pagado = f.valor_pagado;
+    });
+  }
+
+  // Historiales precargados de la página (historial_pagos_lote): el modal abre al instante
+  // y luego se revalida con aplicar_pago GET (normalmente un 304 barato).
+  const precargados = new Map();
+
+  // Versión del contrato que se ve en el modal; se envía con aplicar/eliminar y el servidor
+  // responde 409 (version_obsoleta) si otro usuario cambió los pagos entretanto.
+  let versionContrato = null;
+
+  function pintarHistorial(data) {
+    versionContrato = (data.version_contrato ?? null);
+    if (!data.pagos || data.pagos.length === 0) {
+      tbodyHist.innerHTML = '<tr><td colspan="8" class="text-muted">Sin pagos.</td></tr>';
+    } else {
+      tbodyHist.innerHTML = data.pagos.map((p, i) => {
+        const valor = formatCOP(p.valor_pagado);
+        const medio = p.forma_pago || '—';
+        const fac   = p.numero_factura || '—';
+        const ref   = p.referencia || '—';
+        const obs   = p.observacion || '';
+        return `<tr>
+          <td>${i + 1}</td>
+          <td>${p.fecha_pago}</td>
+          <td>${valor}</td>
+          <td>${medio}</td>
+          <td>${fac}</td>
+          <td>${ref}</td>
+          <td>${obs}</td>
+          <td class="text-center">
+            <button type="button"
+                    class="btn btn-sm btn-outline-danger btn-del-pago"
+                    data-id="${p.id}">
+              Eliminar
+            </button>
+          </td>
+        </tr>`;
+      }).join('');
+    }
+
+    // ---- Previas con saldo / habilitar valor ----
+    const saldoActual = Number((fSaldoTxt.value || '0').replace(/[^0-9]/g, '')) || 0;
+    const previas = Array.isArray(data.previas_pendientes) ? data.previas_pendientes : [];
+    if (previas.length > 0) {
+      previasBody.innerHTML = previas.map(p => {
+        return `<tr>
+          <td class="text-center">${p.numero}</td>
+          <td>${p.vence}</td>
+          <td>${formatCOP(p.saldo)}</td>
+        </tr>`;
+      }).join('');
+
+      const sumaPrevias = previas.reduce((acc, it) => acc + Number(it.saldo || 0), 0);
+      const capacidadTotal = saldoActual + sumaPrevias;
+
+      // HABILITAR input de valor para distribuir
+      fValorPay.disabled = false;
+      fValorPay.max = '';
+      fAyuda.textContent = `Puedes pagar hasta ${formatCOP(capacidadTotal)} si eliges distribución automática.`;
+      previasWrap.classList.remove('d-none');
+    } else {
+      // Si no hay previas, habilitar sólo si hay saldo en la actual
+      fValorPay.disabled = (saldoActual <= 0);
+      fValorPay.max = saldoActual || '';
+      fAyuda.textContent = saldoActual > 0 ? `Saldo máximo: ${formatCOP(saldoActual)}` : 'No hay saldo pendiente.';
+      previasWrap.classList.add('d-none');
+      previasBody.innerHTML = '';
+    }
+  }
+
   async function cargarHistorial(cuotaId) {
-    tbodyHist.innerHTML = '<tr><td colspan="8" class="text-muted">Cargando…</td></tr>';
+    const previo = precargados.get(String(cuotaId));
+    if (previo) {
+      pintarHistorial(previo);
+    } else {
+      tbodyHist.innerHTML = '<tr><td colspan="8" class="text-muted">Cargando…</td></tr>';
+    }
     try {
       const resp = await fetch(URL_APLICAR + '?cuota_id=' + encodeURIComponent(cuotaId), {
         headers: { 'X-Requested-With': 'XMLHttpRequest' }
       });
       const data = await resp.json();
       if (!resp.ok || !data.ok) throw new Error(data.error || 'No se pudo obtener el historial.');
-
-      if (!data.pagos || data.pagos.length === 0) {
-        tbodyHist.innerHTML = '<tr><td colspan="8" class="text-muted">Sin pagos.</td></tr>';
-      } else {
-        tbodyHist.innerHTML = data.pagos.map((p, i) => {
-          const valor = formatCOP(p.valor_pagado);
-          const medio = p.forma_pago || '—';
-          const fac   = p.numero_factura || '—';
-          const ref   = p.referencia || '—';
-          const obs   = p.observacion || '';
-          return `<tr>
-            <td>${i + 1}</td>
-            <td>${p.fecha_pago}</td>
-            <td>${valor}</td>
-            <td>${medio}</td>
-            <td>${fac}</td>
-            <td>${ref}</td>
-            <td>${obs}</td>
-            <td class="text-center">
-              <button type="button"
-                      class="btn btn-sm btn-outline-danger btn-del-pago"
-                      data-id="${p.id}">
-                Eliminar
-              </button>
-            </td>
-          </tr>`;
-        }).join('');
-      }
-
-      // ---- Previas con saldo / habilitar valor ----
-      const saldoActual = Number((fSaldoTxt.value || '0').replace(/[^0-9]/g, '')) || 0;
-      const previas = Array.isArray(data.previas_pendientes) ? data.previas_pendientes : [];
-      if (previas.length > 0) {
-        previasBody.innerHTML = previas.map(p => {
-          return `<tr>
-            <td class="text-center">${p.numero}</td>
-            <td>${p.vence}</td>
-            <td>${formatCOP(p.saldo)}</td>
-          </tr>`;
-        }).join('');
-
-        const sumaPrevias = previas.reduce((acc, it) => acc + Number(it.saldo || 0), 0);
-        const capacidadTotal = saldoActual + sumaPrevias;
-
-        // HABILITAR input de valor para distribuir
-        fValorPay.disabled = false;
-        fValorPay.max = '';
-        fAyuda.textContent = `Puedes pagar hasta ${formatCOP(capacidadTotal)} si eliges distribución automática.`;
-        previasWrap.classList.remove('d-none');
-      } else {
-        // Si no hay previas, habilitar sólo si hay saldo en la actual
-        fValorPay.disabled = (saldoActual <= 0);
-        fValorPay.max = saldoActual || '';
-        fAyuda.textContent = saldoActual > 0 ? `Saldo máximo: ${formatCOP(saldoActual)}` : 'No hay saldo pendiente.';
-        previasWrap.classList.add('d-none');
-        previasBody.innerHTML = '';
-      }
-
+      precargados.set(String(cuotaId), data);
+      if (String(fCuotaId.value) === String(cuotaId)) pintarHistorial(data);  // el modal sigue en esta cuota
     } catch (err) {
       tbodyHist.innerHTML = `<tr><td colspan="8" class="text-danger">${err.message}</td></tr>`;
       previasWrap.classList.add('d-none');
@@ -138,6 +187,23 @@
     }
   }
 
+  async function precargarHistoriales() {
+    if (!URL_LOTE) return;
+    const ids = Array.from(document.querySelectorAll('.btn-aplicar-pago')).map(b => b.dataset.cuota);
+    if (ids.length === 0) return;
+    try {
+      const resp = await fetch(URL_LOTE + '?ids=' + ids.join(','), {
+        headers: { 'X-Requested-With': 'XMLHttpRequest' }
+      });
+      const data = await resp.json();
+      if (!resp.ok || !data.ok) return;
+      precargados.clear();
+      Object.entries(data.historiales || {}).forEach(([id, h]) => precargados.set(id, h));
+    } catch (err) {
+      // Sin precarga el modal consulta su historial como antes
+    }
+  }
+
   // Abrir modal
   document.querySelectorAll('.btn-aplicar-pago').forEach(btn => {
     btn.addEventListener('click', () => {
@@ -175,6 +241,7 @@
       previasWrap.classList.add('d-none');
       previasBody.innerHTML = '';
 
+      versionContrato = null;
       cargarHistorial(cuotaId);
       modal.show();
     });
@@ -199,6 +266,7 @@
     const fd = new FormData();
     fd.append('pago_id', pagoId);
     fd.append('csrfmiddlewaretoken', form.querySelector('input[name=csrfmiddlewaretoken]').value);
+    if (versionContrato !== null) fd.append('version_contrato', versionContrato);
 
     const resp = await fetch(URL_ELIMINAR, {
       method: 'POST',
@@ -209,7 +277,20 @@
     try { data = await resp.json(); } catch (e) { data = { ok: false, error: 'Respuesta inválida' }; }
 
     if (resp.ok && data.ok) {
-      location.reload();
+      actualizarFilas(data.filas);
+      precargarHistoriales();  // cambiaron pagos/previas del contrato
+      precargados.delete(String(fCuotaId.value));
+      // Refrescar saldo e historial del modal con la cuota ya corregida
+      const fila = (data.filas || []).find(f => String(f.cuota_id) === String(fCuotaId.value));
+      if (fila) {
+        fPagadoTxt.value = Number(fila.valor_pagado) ? formatCOP(fila.valor_pagado) : '—';
+        fSaldoTxt.value = formatCOP(fila.saldo);
+      }
+      cargarHistorial(fCuotaId.value);
+    } else if (resp.status === 409) {
+      alert(data.error);
+      precargados.delete(String(fCuotaId.value));
+      cargarHistorial(fCuotaId.value);  // trae los pagos y la versión actuales
     } else {
       alert(data.error || 'No se pudo eliminar el pago.');
     }
@@ -225,6 +306,7 @@
     }
 
     const fd = new FormData(form);
+    if (versionContrato !== null) fd.append('version_contrato', versionContrato);
     const resp = await fetch(URL_APLICAR, {
       method: 'POST',
       body: fd,
@@ -234,11 +316,20 @@
     try { data = await resp.json(); } catch (e) { data = { ok: false, error: 'Respuesta inválida' }; }
 
     if (resp.ok && data.ok) {
-      location.reload();
+      actualizarFilas(data.filas);
+      modal.hide();
+      precargarHistoriales();  // cambiaron pagos/previas del contrato
       return;
     }
 
     const code = data.error_code || '';
+    if (resp.status === 409) {
+      // contrato_ocupado: otro registro en curso; version_obsoleta: el historial cambió
+      alert(data.error);
+      precargados.delete(String(fCuotaId.value));
+      cargarHistorial(fCuotaId.value);
+      return;
+    }
     if (code === 'previas_pendientes') {
       if (Array.isArray(data.previas) && data.previas.length) {
         previasBody.innerHTML = data.previas.map(p => {
@@ -262,4 +353,7 @@
 
     alert(data.error || 'No se pudo aplicar el pago.');
   });
+
+  // Precarga en segundo plano de los historiales de la página
+  precargarHistoriales();
 })();
@@ -1,15 +1,20 @@
 from django.contrib import admin
 from django.urls import path
 
+from gestion_clientes import vistas_async
 from gestion_clientes.views import (
     login_view,            # login
     vista_inicial,         # /
     dashboard_view,        # dashboard
     listar_estudiantes,    # estudiantes
     detalle_estudiante,    # estudiantes/<id>
+    estado_cuenta,         # acudientes/<id>/estado-cuenta
     listado_cxc,           # cxc
+    exportar_cxc,          # cxc/exportar
     aplicar_pago,          # pago/aplicar
+    historial_pagos_lote,  # pago/historial
     eliminar_pago,         # pago/eliminar
+    importar_pagos_view,   # pago/importar
     logout_view,           # logout  ← IMPORTANTE
 )
 
@@ -21,10 +26,18 @@ urlpatterns = [
 
     path('estudiantes/', listar_estudiantes, name='listar_estudiantes'),
     path('estudiantes/<int:id>/', detalle_estudiante, name='detalle_estudiante'),
+    path('acudientes/<int:id>/estado-cuenta/', estado_cuenta, name='estado_cuenta'),
 
     path('cxc/', listado_cxc, name='listado_cxc'),
+    path('cxc/exportar/', exportar_cxc, name='exportar_cxc'),
     path('pago/aplicar/', aplicar_pago, name='aplicar_pago'),
     path('pago/eliminar/', eliminar_pago, name='eliminar_pago'),
+    path('pago/historial/', historial_pagos_lote, name='historial_pagos_lote'),
+    path('pago/importar/', importar_pagos_view, name='importar_pagos'),
+
+    # Endpoints JSON async (mismas respuestas; rinden bajo ASGI, ver erp_sen/asgi.py)
+    path('api/pago/historial/', vistas_async.historial_pago, name='historial_pago_async'),
+    path('api/pago/historial/lote/', vistas_async.historial_pagos_lote, name='historial_pagos_lote_async'),
 
     path('logout/', logout_view, name='logout'),  # ← usa la vista importada, no "views.logout_view"
 ]
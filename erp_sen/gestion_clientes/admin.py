@@ -1,5 +1,10 @@
-from django.contrib import admin
-from .models import Sede, Acudiente, Estudiante, Contrato, Pago, Nivel, Horario
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from .cronogramas import generar_cuotas, regenerar_cuotas
+from .models import Sede, Acudiente, Estudiante, Contrato, Cuota, Pago, Nivel, Horario
+from .services import CAMPOS_SNAPSHOT, ContratoOcupado, bloquear_contratos, refrescar_cuotas, sincronizar_contratos
 
 @admin.register(Sede)
 class SedeAdmin(admin.ModelAdmin):
@@ -24,9 +29,70 @@ class EstudianteAdmin(admin.ModelAdmin):
 
 @admin.register(Contrato)
 class ContratoAdmin(admin.ModelAdmin):
-    list_display = ('estudiante', 'acudiente', 'fecha_inicio', 'valor_total', 'estado')
-    list_filter = ('estado', 'fecha_inicio')
+    list_display = ('estudiante', 'acudiente', 'fecha_inicio', 'valor_total', 'total_pagado', 'saldo',
+                    'cuotas_vencidas', 'proximo_vencimiento', 'estado')
+    list_filter = ('estado', 'fecha_inicio', 'proximo_vencimiento')
     search_fields = ('estudiante__nombre_completo', 'acudiente__nombre_completo')
+    list_select_related = ('estudiante', 'acudiente')
+    # Agregados mantenidos por los procesos de pago y, al guardar aquí, por signals.sincronizar_contrato
+    readonly_fields = ('total_pagado', 'saldo', 'cuotas_vencidas', 'proximo_vencimiento')
+    actions = ['generar_cronograma', 'regenerar_cronograma']
+
+    @admin.action(description='Generar cuotas (contratos sin cuotas)')
+    def generar_cronograma(self, request, queryset):
+        try:
+            creadas = generar_cuotas(queryset, hoy=timezone.now().date())
+        except ValidationError as e:
+            self.message_user(request, e.messages[0], messages.ERROR)
+            return
+        except ContratoOcupado:
+            self.message_user(request, 'Otro proceso está modificando estos contratos; intente de nuevo.',
+                              messages.WARNING)
+            return
+        self.message_user(request, f'{creadas} cuota(s) creada(s).')
+
+    @admin.action(description='Regenerar cuotas sin pagos (según los términos actuales)')
+    def regenerar_cronograma(self, request, queryset):
+        try:
+            creadas = regenerar_cuotas(queryset.values_list('id', flat=True), hoy=timezone.now().date())
+        except ValidationError as e:
+            self.message_user(request, e.messages[0], messages.ERROR)
+            return
+        except ContratoOcupado:
+            self.message_user(request, 'Otro proceso está modificando estos contratos; intente de nuevo.',
+                              messages.WARNING)
+            return
+        self.message_user(request, f'{sum(creadas.values())} cuota(s) regenerada(s) en {len(creadas)} contrato(s).')
+
+
+@admin.register(Cuota)
+class CuotaAdmin(admin.ModelAdmin):
+    list_display = ('contrato', 'numero', 'fecha_vencimiento', 'valor', 'valor_pagado', 'estado')
+    list_filter = ('estado', 'fecha_vencimiento')
+    search_fields = ('contrato__estudiante__nombre_completo', 'contrato__id')
+    list_select_related = ('contrato__estudiante',)
+    raw_id_fields = ('contrato',)
+    # Snapshot de los pagos (services.refrescar_cuotas); se recalcula al guardar
+    readonly_fields = tuple(CAMPOS_SNAPSHOT)
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            bloquear_contratos([obj.contrato_id], esperar=True)
+            super().save_model(request, obj, form, change)
+            _recalcular_pagos({obj.id}, {obj.contrato_id})
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            bloquear_contratos([obj.contrato_id], esperar=True)
+            super().delete_model(request, obj)  # sus pagos se eliminan en cascada
+            _recalcular_pagos(set(), {obj.contrato_id})
+
+    def delete_queryset(self, request, queryset):
+        contratos = set(queryset.values_list('contrato_id', flat=True))
+        with transaction.atomic():
+            bloquear_contratos(contratos, esperar=True)
+            super().delete_queryset(request, queryset)
+            _recalcular_pagos(set(), contratos)
 
 @admin.register(Pago)
 class PagoAdmin(admin.ModelAdmin):
@@ -34,6 +100,38 @@ class PagoAdmin(admin.ModelAdmin):
     list_filter = ('fecha_pago', 'forma_pago')
     search_fields = ('contrato__estudiante__nombre_completo', 'referencia')  # ✅ Se agregó búsqueda por referencia
 
+    # Editar o borrar un pago desde aquí actualiza el snapshot de sus cuotas (la anterior y
+    # la nueva si cambió) y los agregados del contrato, con el mismo bloqueo que las vistas
+    # de pago. Antes quedaban desfasados hasta correr verificar_saldos --reparar.
+
+    def save_model(self, request, obj, form, change):
+        anteriores = set(Pago.objects.filter(pk=obj.pk).values_list('cuota_id', 'contrato_id')) if change else set()
+        with transaction.atomic():
+            contratos = {obj.contrato_id} | {contrato_id for _, contrato_id in anteriores}
+            bloquear_contratos(contratos, esperar=True)
+            super().save_model(request, obj, form, change)
+            _recalcular_pagos({obj.cuota_id} | {cuota_id for cuota_id, _ in anteriores}, contratos)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            bloquear_contratos([obj.contrato_id], esperar=True)
+            super().delete_model(request, obj)
+            _recalcular_pagos({obj.cuota_id}, {obj.contrato_id})
+
+    def delete_queryset(self, request, queryset):
+        claves = set(queryset.values_list('cuota_id', 'contrato_id'))
+        with transaction.atomic():
+            contratos = {contrato_id for _, contrato_id in claves}
+            bloquear_contratos(contratos, esperar=True)
+            super().delete_queryset(request, queryset)
+            _recalcular_pagos({cuota_id for cuota_id, _ in claves}, contratos)
+
+
+def _recalcular_pagos(cuota_ids, contrato_ids):
+    # Con la fecha de hoy: una cuota vencida que queda sin pagos vuelve a 'Vencida'
+    refrescar_cuotas(Cuota.objects.filter(id__in=[i for i in cuota_ids if i]), hoy=timezone.now().date())
+    sincronizar_contratos(contrato_ids)
+
 @admin.register(Horario)
 class HorarioAdmin(admin.ModelAdmin):
     list_display = ('descripcion', 'hora')
@@ -0,0 +1,133 @@
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Contrato, Cuota, Pago, TerminoBusqueda
+
+# Búsqueda de texto libre del listado CxC sobre la tabla TerminoBusqueda.
+# Cada palabra de la consulta debe coincidir por PREFIJO con algún término de la cuota
+# (LIKE 'abc%' usa el índice), en vez de seis LIKE '%abc%' sobre cuatro tablas + DISTINCT.
+
+LARGO_TERMINO = 100
+_NO_ALFANUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes: 'José PÉREZ' -> 'jose perez'."""
+    texto = unicodedata.normalize('NFKD', str(texto or '').lower())
+    return ''.join(ch for ch in texto if not unicodedata.combining(ch))
+
+
+def palabras(texto):
+    """Palabras alfanuméricas normalizadas de un texto (usadas para consultar)."""
+    return [p[:LARGO_TERMINO] for p in _NO_ALFANUM.split(normalizar(texto)) if p]
+
+
+def terminos(texto):
+    """
+    Términos a indexar: las palabras más la forma compacta sin separadores,
+    para que '1.023.456' o 'ABC-123' se encuentren también escritos seguidos.
+    """
+    resultado = set(palabras(texto))
+    compacto = _NO_ALFANUM.sub('', normalizar(texto))[:LARGO_TERMINO]
+    if compacto:
+        resultado.add(compacto)
+    return resultado
+
+
+def indexar_contratos(contrato_ids):
+    """Reconstruye los términos de nivel contrato (estudiante y acudiente del estudiante)."""
+    contrato_ids = list(contrato_ids)
+    if not contrato_ids:
+        return
+    filas = (
+        Contrato.objects
+        .filter(id__in=contrato_ids)
+        .values_list(
+            'id',
+            'estudiante__nombre_completo', 'estudiante__documento',
+            'estudiante__acudiente__nombre_completo', 'estudiante__acudiente__documento',
+        )
+    )
+    nuevos = []
+    for contrato_id, *textos in filas:
+        encontrados = set()
+        for texto in textos:
+            encontrados |= terminos(texto)
+        nuevos.extend(TerminoBusqueda(contrato_id=contrato_id, termino=t) for t in encontrados)
+
+    TerminoBusqueda.objects.filter(contrato_id__in=contrato_ids, cuota__isnull=True).delete()
+    TerminoBusqueda.objects.bulk_create(nuevos, batch_size=1000)
+
+
+def indexar_cuotas(cuota_ids):
+    """Reconstruye los términos de nivel cuota (factura y referencia de sus pagos)."""
+    cuota_ids = list(Cuota.objects.filter(id__in=list(cuota_ids)).values_list('id', flat=True))
+    if not cuota_ids:
+        return
+    encontrados = {}
+    filas = (
+        Pago.objects
+        .filter(cuota_id__in=cuota_ids)
+        .values_list('cuota_id', 'cuota__contrato_id', 'numero_factura', 'referencia')
+    )
+    for cuota_id, contrato_id, factura, referencia in filas:
+        encontrados.setdefault((cuota_id, contrato_id), set()).update(terminos(factura) | terminos(referencia))
+
+    # Los procesos de pago lo llaman al confirmar (fuera de su transacción): borrar e insertar
+    # juntos para que una búsqueda no vea la cuota sin términos
+    with transaction.atomic():
+        TerminoBusqueda.objects.filter(cuota_id__in=cuota_ids).delete()
+        TerminoBusqueda.objects.bulk_create(
+            [
+                TerminoBusqueda(contrato_id=contrato_id, cuota_id=cuota_id, termino=t)
+                for (cuota_id, contrato_id), ts in encontrados.items()
+                for t in ts
+            ],
+            batch_size=1000,
+        )
+
+
+def filtrar_cuotas(qs, q_text):
+    """
+    Filtra un queryset de Cuota por texto libre usando el índice.
+    Todas las palabras deben coincidir; si el texto es un número también busca por contrato_id.
+    No genera filas duplicadas (IN con subconsulta, sin JOIN a pagos), así que no requiere distinct().
+    """
+    filtro = Q()
+    for palabra in palabras(q_text):
+        match = TerminoBusqueda.objects.filter(termino__startswith=palabra)
+        filtro &= (
+            Q(contrato_id__in=match.filter(cuota__isnull=True).values('contrato_id')) |
+            Q(id__in=match.filter(cuota__isnull=False).values('cuota_id'))
+        )
+    if q_text.isdigit():
+        filtro |= Q(contrato_id=int(q_text))
+    if not filtro:
+        return qs
+    return qs.filter(filtro)
+
+
+def filtrar_estudiantes(qs, q_text):
+    """
+    Filtra un queryset de Estudiante por texto libre con el mismo índice (términos de nivel
+    contrato: nombre y documento del estudiante y de su acudiente), palabra por palabra por
+    prefijo. Los estudiantes sin contrato no están en el índice: para ellos el nombre completo
+    por prefijo (LIKE 'abc%', índice estudiante_nombre_idx) y el documento por prefijo.
+    """
+    filtro = Q()
+    for palabra in palabras(q_text):
+        filtro &= Q(id__in=(
+            TerminoBusqueda.objects
+            .filter(termino__startswith=palabra, cuota__isnull=True)
+            .values('contrato__estudiante_id')
+        ))
+    if not filtro:
+        return qs
+    return qs.filter(
+        filtro
+        | Q(nombre_completo__istartswith=q_text)
+        | Q(documento__startswith=q_text.replace('.', '').replace(' ', ''))
+    )
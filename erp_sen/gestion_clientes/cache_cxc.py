@@ -0,0 +1,104 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Contrato
+
+# Cache de la tabla renderizada del listado CxC (filas + navegación), por página.
+# La clave incluye versiones de datos: cada escritura que cambia cuotas de una sede sube
+# la versión de esa sede (y la de "todas"), así una página en cache nunca queda vieja y
+# no hace falta borrarla. Las versiones suben al confirmar la transacción.
+#
+# - sede:<id>  -> páginas de usuarios de esa sede o filtradas por ella
+# - todas      -> páginas sin sede (usuarios globales); sube con cualquier sede
+# - global     -> sube con cambios que afectan a todas (catálogos, estudiantes, corridas completas)
+#
+# Las versiones solo invalidan las páginas de la cache donde se suben: con varios workers hace
+# falta un backend compartido. Con settings.CXC_CACHE_PAGINAS=False (default con LocMemCache)
+# obtener/guardar no hacen nada y cada página se consulta a la base.
+
+_PREFIJO = 'cxc'
+
+
+def _clave_version(nombre):
+    return f'{_PREFIJO}:version:{nombre}'
+
+
+def _version(nombre):
+    valor = cache.get(_clave_version(nombre))
+    if valor is None:
+        # Inicial basada en el reloj: si la cache expulsa el contador, el nuevo valor
+        # no coincide con uno anterior y no revive páginas viejas.
+        cache.add(_clave_version(nombre), time.time_ns(), None)
+        valor = cache.get(_clave_version(nombre))
+    return valor
+
+
+def _subir(nombre):
+    try:
+        cache.incr(_clave_version(nombre))
+    except ValueError:  # el contador no existe (expulsado o nunca creado)
+        cache.set(_clave_version(nombre), time.time_ns(), None)
+
+
+def invalidar_sedes(sede_ids):
+    """Sube la versión de las sedes dadas (y la de 'todas') al confirmar."""
+    sede_ids = {s for s in sede_ids if s}
+
+    def subir():
+        for sede_id in sede_ids:
+            _subir(f'sede:{sede_id}')
+        _subir('todas')
+
+    transaction.on_commit(subir)
+
+
+def invalidar_contratos(contrato_ids):
+    """
+    Como invalidar_sedes, a partir de contratos. Las sedes se resuelven al confirmar (una
+    consulta fuera de la transacción, sin alargar el bloqueo de los procesos de pago).
+    """
+    contrato_ids = list(contrato_ids)
+    if not contrato_ids:
+        return
+    transaction.on_commit(lambda: invalidar_sedes(
+        Contrato.objects.filter(id__in=contrato_ids)
+        .values_list('estudiante__sede_id', flat=True).distinct()
+    ))
+
+
+def invalidar_todo():
+    transaction.on_commit(lambda: _subir('global'))
+
+
+def clave_pagina(sede_id, filtros, extra, hoy):
+    """
+    Clave de una página: alcance (sede o todas), filtros normalizados, página/cursor
+    (en `extra`), fecha (cambia es_vencida_roja) y versiones actuales.
+    """
+    alcance = f'sede:{sede_id}' if sede_id else 'todas'
+    partes = {
+        'a': alcance,
+        'v': [_version('global'), _version(alcance)],
+        'f': sorted((k, v) for k, v in filtros.items() if v),
+        'x': sorted((k, v) for k, v in extra.items() if v),
+        'h': hoy.isoformat(),
+    }
+    resumen = hashlib.sha1(json.dumps(partes, sort_keys=True).encode()).hexdigest()
+    return f'{_PREFIJO}:pagina:{resumen}'
+
+
+def obtener(clave):
+    """HTML de la página en cache, o None (también si la cache de páginas está desactivada)."""
+    if not settings.CXC_CACHE_PAGINAS:
+        return None
+    return cache.get(clave)
+
+
+def guardar(clave, html):
+    if settings.CXC_CACHE_PAGINAS:
+        cache.set(clave, html, settings.CXC_CACHE_TTL)
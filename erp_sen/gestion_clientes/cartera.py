@@ -0,0 +1,150 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from . import catalogos
+from .models import Contrato, Cuota, ResumenCartera
+
+# Cartera por edades (corriente, 1–30, 31–60, 61–90, 90+ días) por sede, nivel y horario.
+# Se guarda precalculada en ResumenCartera:
+# - reconstruir_cartera(): recálculo completo (lo corre actualizar_cuotas cada noche,
+#   porque los días de mora cambian aunque nadie pague).
+# - actualizar_cartera_contratos(): recálculo solo de los grupos (sede, nivel, horario)
+#   de los contratos cuyos pagos cambiaron.
+
+TRAMOS = [clave for clave, _ in ResumenCartera.TRAMOS]
+
+_GRUPO = ('contrato__estudiante__sede_id', 'contrato__estudiante__nivel_id', 'contrato__estudiante__horario_id')
+
+
+def _tramo(hoy):
+    return Case(
+        When(fecha_vencimiento__gte=hoy, then=Value('corriente')),
+        When(fecha_vencimiento__gte=hoy - timedelta(days=30), then=Value('1-30')),
+        When(fecha_vencimiento__gte=hoy - timedelta(days=60), then=Value('31-60')),
+        When(fecha_vencimiento__gte=hoy - timedelta(days=90), then=Value('61-90')),
+        default=Value('90+'),
+        output_field=CharField(),
+    )
+
+
+def _calcular(cuotas, hoy):
+    """Filas de ResumenCartera (sin guardar) para las cuotas con saldo del queryset dado."""
+    filas = (
+        cuotas
+        .filter(valor_pagado__lt=F('valor'))
+        .annotate(tramo=_tramo(hoy))
+        .values(*_GRUPO, 'tramo')
+        .annotate(num=Count('id'), total=Sum(F('valor') - F('valor_pagado')))
+        .order_by()
+    )
+    return [
+        ResumenCartera(
+            sede_id=f['contrato__estudiante__sede_id'],
+            nivel_id=f['contrato__estudiante__nivel_id'],
+            horario_id=f['contrato__estudiante__horario_id'],
+            tramo=f['tramo'],
+            num_cuotas=f['num'],
+            saldo=f['total'] or Decimal('0.00'),
+            fecha_corte=hoy,
+        )
+        for f in filas
+    ]
+
+
+def reconstruir_cartera(hoy=None, sede_id=None):
+    """Recalcula toda la cartera (o la de una sede)."""
+    hoy = hoy or timezone.now().date()
+    cuotas = Cuota.objects.all()
+    resumen = ResumenCartera.objects.all()
+    if sede_id:
+        cuotas = cuotas.filter(contrato__estudiante__sede_id=sede_id)
+        resumen = resumen.filter(sede_id=sede_id)
+    with transaction.atomic():
+        nuevas = _calcular(cuotas, hoy)
+        resumen.delete()
+        ResumenCartera.objects.bulk_create(nuevas)
+    return len(nuevas)
+
+
+def actualizar_cartera_contratos(contrato_ids, hoy=None):
+    """Recalcula solo los grupos (sede, nivel, horario) a los que pertenecen los contratos dados."""
+    hoy = hoy or timezone.now().date()
+    grupos = set(
+        Contrato.objects
+        .filter(id__in=list(contrato_ids))
+        .values_list('estudiante__sede_id', 'estudiante__nivel_id', 'estudiante__horario_id')
+    )
+    if not grupos:
+        return
+    filtro_cuotas = Q()
+    filtro_resumen = Q()
+    for sede_id, nivel_id, horario_id in grupos:
+        horario = {'horario_id': horario_id} if horario_id else {'horario__isnull': True}
+        filtro_resumen |= Q(sede_id=sede_id, nivel_id=nivel_id, **horario)
+        filtro_cuotas |= Q(
+            contrato__estudiante__sede_id=sede_id,
+            contrato__estudiante__nivel_id=nivel_id,
+            **{f'contrato__estudiante__{k}': v for k, v in horario.items()},
+        )
+    with transaction.atomic():
+        ResumenCartera.objects.filter(filtro_resumen).delete()
+        ResumenCartera.objects.bulk_create(_calcular(Cuota.objects.filter(filtro_cuotas), hoy))
+
+
+def tablero_cartera(sede_id=None):
+    """
+    Datos del dashboard leyendo solo ResumenCartera (una consulta, unas decenas de filas).
+    - sede_id: si se envía, solo la cartera de esa sede (usuarios asignados a una sede).
+    Agrupa por id (dos sedes pueden llamarse igual en ciudades distintas); los nombres salen
+    de los catálogos en cache (str() de Sede, Nivel y Horario).
+    Retorna {'por_sede'|'por_nivel'|'por_horario': [{'nombre', 'tramos', 'total', 'num_cuotas'}],
+             'totales': {...}, 'fecha_corte': date|None}; 'tramos' va en el orden de TRAMOS.
+    """
+    filas = ResumenCartera.objects.all()
+    if sede_id:
+        filas = filas.filter(sede_id=sede_id)
+    filas = filas.values('sede_id', 'nivel_id', 'horario_id', 'tramo', 'num_cuotas', 'saldo', 'fecha_corte')
+
+    nombres = {
+        'por_sede': {s.id: str(s) for s in catalogos.sedes()},
+        'por_nivel': {n.id: str(n) for n in catalogos.niveles()},
+        'por_horario': {h.id: str(h) for h in catalogos.horarios()},
+    }
+
+    def nueva(nombre):
+        return {'nombre': nombre, 'tramos': {t: Decimal('0.00') for t in TRAMOS},
+                'total': Decimal('0.00'), 'num_cuotas': 0}
+
+    def sumar(fila, f):
+        fila['tramos'][f['tramo']] += f['saldo']
+        fila['total'] += f['saldo']
+        fila['num_cuotas'] += f['num_cuotas']
+
+    tablas = {'por_sede': {}, 'por_nivel': {}, 'por_horario': {}}
+    totales = nueva('Total')
+    cortes = set()
+    for f in filas:
+        for tabla, campo in (('por_sede', 'sede_id'), ('por_nivel', 'nivel_id'), ('por_horario', 'horario_id')):
+            grupo_id = f[campo]
+            if grupo_id not in tablas[tabla]:
+                nombre = nombres[tabla].get(grupo_id, f'#{grupo_id}') if grupo_id else '—'
+                tablas[tabla][grupo_id] = nueva(nombre)
+            sumar(tablas[tabla][grupo_id], f)
+        sumar(totales, f)
+        cortes.add(f['fecha_corte'])
+
+    def como_lista(fila):
+        fila['tramos'] = [fila['tramos'][t] for t in TRAMOS]
+        return fila
+
+    datos = {
+        tabla: [como_lista(fila) for fila in sorted(grupos.values(), key=lambda fila: fila['nombre'])]
+        for tabla, grupos in tablas.items()
+    }
+    datos['totales'] = como_lista(totales)
+    datos['fecha_corte'] = min(cortes) if cortes else None  # la más antigua si hay grupos sin refrescar
+    return datos
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Horario, Nivel, Sede
+
+# Catálogos pequeños y casi fijos (Nivel, Horario, Sede) guardados en cache:
+# los desplegables de filtros y los nombres de cada fila salen de aquí sin consultas.
+# signals.py invalida la entrada del modelo en cada post_save/post_delete (incluye el admin).
+
+_ORDEN = {
+    Nivel: 'nombre',
+    Horario: 'descripcion',
+    Sede: 'nombre',
+}
+
+
+def _clave(modelo):
+    return f'catalogos:{modelo._meta.model_name}'
+
+
+def _catalogo(modelo):
+    """Lista ordenada de instancias del modelo (desde cache, o una consulta si no está)."""
+    filas = cache.get(_clave(modelo))
+    if filas is None:
+        filas = list(modelo.objects.order_by(_ORDEN[modelo], 'id'))
+        cache.set(_clave(modelo), filas, settings.CATALOGOS_CACHE_TTL)
+    return filas
+
+
+def niveles():
+    return _catalogo(Nivel)
+
+
+def horarios():
+    return _catalogo(Horario)
+
+
+def sedes():
+    return _catalogo(Sede)
+
+
+def invalidar(modelo):
+    cache.delete(_clave(modelo))
+
+
+def adjuntar_catalogos(estudiantes):
+    """
+    Asigna nivel, horario y sede desde cache a los estudiantes dados (en lugar de
+    select_related). Si un id no está en cache se deja la carga perezosa normal.
+    """
+    por_id = {
+        'nivel': {n.id: n for n in niveles()},
+        'horario': {h.id: h for h in horarios()},
+        'sede': {s.id: s for s in sedes()},
+    }
+    for e in estudiantes:
+        for campo, catalogo in por_id.items():
+            obj = catalogo.get(getattr(e, f'{campo}_id'))
+            if obj is not None:
+                setattr(e, campo, obj)
+    return estudiantes
@@ -0,0 +1,247 @@
+import calendar
+from datetime import date
+from decimal import ROUND_DOWN, Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Exists, Max, OuterRef
+
+from .busqueda import indexar_contratos
+from .importacion import _parse_fecha, _parse_valor
+from .models import Contrato, Cuota, Estudiante, Pago, TerminoBusqueda
+from .services import CERO, bloquear_contratos, estado_por_pagado, sincronizar_contratos
+
+# Cronograma de cuotas de un contrato: numero_cuotas cuotas mensuales desde fecha_inicio.
+# - Valor: valor_cuota_pactada en todas menos la última, que ajusta solo el redondeo (si
+#   difiere de la pactada en numero_cuotas pesos o más, los términos no cuadran y se
+#   rechazan); sin cuota pactada, valor_total / numero_cuotas en pesos enteros y la
+#   última con el residuo. La suma siempre es exactamente valor_total.
+# - Vencimiento: el mismo día de fecha_inicio cada mes (31 -> último día de los meses cortos).
+# Todo en bloque: un bulk_create de contratos y uno de cuotas por lote, no uno por fila.
+
+REDONDEO = Decimal('1')  # pesos enteros
+
+
+def sumar_meses(fecha, meses):
+    """fecha + meses, con el día ajustado al último del mes si no existe (31/01 + 1 = 28/02)."""
+    mes = fecha.month - 1 + meses
+    anio, mes = fecha.year + mes // 12, mes % 12 + 1
+    return date(anio, mes, min(fecha.day, calendar.monthrange(anio, mes)[1]))
+
+
+def valores_cuotas(valor_total, numero_cuotas, valor_cuota=None):
+    """Valores de las cuotas (lista de Decimal) que suman exactamente valor_total."""
+    if numero_cuotas < 1:
+        raise ValidationError('El número de cuotas debe ser al menos 1.')
+    if valor_total is None or valor_total <= 0:
+        raise ValidationError('El valor total debe ser mayor a cero.')
+    if not valor_cuota:
+        valor_cuota = (valor_total / numero_cuotas).quantize(REDONDEO, rounding=ROUND_DOWN)
+    ultima = valor_total - valor_cuota * (numero_cuotas - 1)
+    if valor_cuota <= 0 or ultima <= 0:
+        raise ValidationError(
+            f'La cuota pactada ({valor_cuota}) por {numero_cuotas} cuotas supera el valor total ({valor_total}).'
+        )
+    # La última solo absorbe el redondeo de repartir en pesos enteros (menos de un peso por cuota)
+    if abs(ultima - valor_cuota) >= REDONDEO * numero_cuotas:
+        raise ValidationError(
+            f'La cuota pactada ({valor_cuota}) por {numero_cuotas} cuotas no cuadra con el valor total '
+            f'({valor_total}): la última cuota sería {ultima}.'
+        )
+    return [valor_cuota] * (numero_cuotas - 1) + [ultima]
+
+
+def construir_cuotas(contrato, hoy, numeros=None, valor_total=None):
+    """
+    Cuotas (sin guardar) del cronograma de un contrato guardado.
+    - numeros: números de cuota a construir (default 1..numero_cuotas); el vencimiento de la
+      cuota n es fecha_inicio + (n - 1) meses.
+    - valor_total: lo que deben sumar esas cuotas (default contrato.valor_total).
+    Las anteriores a hoy quedan 'Vencida' (no tienen pagos).
+    """
+    numeros = list(numeros) if numeros is not None else list(range(1, contrato.numero_cuotas + 1))
+    valores = valores_cuotas(
+        contrato.valor_total if valor_total is None else valor_total, len(numeros), contrato.valor_cuota_pactada,
+    )
+    cuotas = []
+    for numero, valor in zip(numeros, valores):
+        vencimiento = sumar_meses(contrato.fecha_inicio, numero - 1)
+        cuotas.append(Cuota(
+            contrato_id=contrato.id, numero=numero, fecha_vencimiento=vencimiento, valor=valor,
+            estado=estado_por_pagado(valor, 0, vencida=vencimiento < hoy),
+        ))
+    return cuotas
+
+
+def generar_cuotas(contratos, hoy):
+    """
+    Crea el cronograma completo de los contratos (guardados) que todavía no tienen cuotas;
+    los que ya tienen se omiten. Retorna la cantidad de cuotas creadas.
+    Los contratos se bloquean (como en las vistas de pago) antes de ver cuáles ya tienen
+    cuotas: dos corridas a la vez no crean el mismo cronograma dos veces.
+    Los errores de términos (ValidationError) cancelan todo el lote.
+    """
+    contratos = list(contratos)
+    with transaction.atomic():
+        bloquear_contratos([c.id for c in contratos], esperar=True)
+        con_cuotas = set(
+            Cuota.objects.filter(contrato_id__in=[c.id for c in contratos])
+            .values_list('contrato_id', flat=True).order_by().distinct()
+        )
+        cuotas = []
+        for c in contratos:
+            if c.id not in con_cuotas:
+                try:
+                    cuotas.extend(construir_cuotas(c, hoy))
+                except ValidationError as e:
+                    raise ValidationError(f'Contrato {c.id}: {e.messages[0]}')
+        Cuota.objects.bulk_create(cuotas, batch_size=1000)
+        sincronizar_contratos({c.contrato_id for c in cuotas})
+    return len(cuotas)
+
+
+def contratos_desde_filas(filas):
+    """
+    Contratos nuevos (sin guardar) desde filas de CSV (ver importacion.leer_csv) con columnas
+    documento (del estudiante), fecha_inicio, valor_total, numero_cuotas y opcional valor_cuota.
+    El acudiente es el del estudiante. Una consulta para todos los estudiantes.
+    Retorna (contratos, errores) con errores = [{'fila', 'error'}].
+    """
+    filas = list(filas)
+    estudiantes = {
+        documento: (estudiante_id, acudiente_id)
+        for documento, estudiante_id, acudiente_id in (
+            Estudiante.objects
+            .filter(documento__in={f.get('documento', '') for f in filas})
+            .values_list('documento', 'id', 'acudiente_id')
+        )
+    }
+    contratos, errores = [], []
+    for numero, fila in enumerate(filas, start=2):  # la fila 1 es el encabezado
+        estudiante_id, acudiente_id = estudiantes.get(fila.get('documento', ''), (None, None))
+        fecha_inicio = _parse_fecha(fila.get('fecha_inicio', ''))
+        valor_total = _parse_valor(fila.get('valor_total', ''))
+        valor_cuota = _parse_valor(fila['valor_cuota']) if fila.get('valor_cuota') else Decimal('0')
+        numero_cuotas = fila.get('numero_cuotas', '')
+        if not estudiante_id:
+            error = f'Estudiante no encontrado: {fila.get("documento") or "(vacío)"}.'
+        elif not fecha_inicio:
+            error = 'Fecha de inicio inválida (use AAAA-MM-DD o DD/MM/AAAA).'
+        elif valor_total is None or valor_cuota is None or not numero_cuotas.isdigit():
+            error = 'Valor total, valor de cuota o número de cuotas inválido.'
+        else:
+            try:
+                valores_cuotas(valor_total, int(numero_cuotas), valor_cuota)
+                error = None
+            except ValidationError as e:
+                error = e.messages[0]
+        if error:
+            errores.append({'fila': numero, 'error': error})
+            continue
+        contratos.append(Contrato(
+            estudiante_id=estudiante_id, acudiente_id=acudiente_id,
+            fecha_inicio=fecha_inicio, valor_total=valor_total, valor_cuota_pactada=valor_cuota,
+            numero_cuotas=int(numero_cuotas), estado='Activo',
+        ))
+    return contratos, errores
+
+
+def crear_contratos(contratos, hoy):
+    """
+    Guarda contratos nuevos (instancias sin id) con su cronograma: un bulk_create de contratos,
+    uno de cuotas, agregados y búsqueda. Retorna los contratos con id. bulk_create no dispara
+    señales, así que aquí se indexan y se sincronizan los agregados.
+    """
+    contratos = list(contratos)
+    if not contratos:
+        return contratos
+    for c in contratos:
+        valores_cuotas(c.valor_total, c.numero_cuotas, c.valor_cuota_pactada)  # validar antes de escribir
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Contrato.objects.bulk_create(contratos, batch_size=1000)
+        else:
+            _bulk_create_con_ids(contratos)
+        generar_cuotas(contratos, hoy)
+        indexar_contratos([c.id for c in contratos])
+    return contratos
+
+
+def _bulk_create_con_ids(contratos):
+    """
+    MySQL no devuelve las llaves de un INSERT múltiple (MariaDB 10.5+ sí, con RETURNING, y no
+    pasa por aquí): se insertan y luego se leen los ids nuevos por (estudiante, fecha_inicio),
+    que debe ser único dentro del lote. Las filas propias siempre se ven dentro de la
+    transacción y las de otras transacciones solo si ya confirmaron: si una clave aparece más
+    de una vez, otro proceso creó el mismo contrato a la vez y no se puede saber cuál es el
+    propio, así que se cancela el lote (ValidationError) en lugar de asignar un id ajeno.
+    """
+    claves = [(c.estudiante_id, c.fecha_inicio) for c in contratos]
+    if len(set(claves)) != len(claves):
+        raise ValidationError('Hay contratos repetidos (mismo estudiante y fecha de inicio) en el lote.')
+    ultimo = Contrato.objects.aggregate(m=Max('id'))['m'] or 0
+    Contrato.objects.bulk_create(contratos, batch_size=1000)
+    pendientes = set(claves)
+    ids = {}
+    for id_, estudiante_id, fecha_inicio in (
+        Contrato.objects
+        .filter(id__gt=ultimo, estudiante_id__in={e for e, _ in claves})
+        .values_list('id', 'estudiante_id', 'fecha_inicio')
+    ):
+        clave = (estudiante_id, fecha_inicio)
+        if clave not in pendientes:
+            continue
+        if clave in ids:
+            raise ValidationError(
+                f'Otro proceso creó al mismo tiempo un contrato del estudiante {estudiante_id} con inicio '
+                f'{fecha_inicio}; no se guardó el lote, vuelva a intentar.'
+            )
+        ids[clave] = id_
+    for c, clave in zip(contratos, claves):
+        c.id = c.pk = ids[clave]
+        c._state.adding = False
+
+
+def regenerar_cuotas(contrato_ids, hoy):
+    """
+    Rehace las cuotas SIN pagos de los contratos, según sus términos actuales (valor_total,
+    numero_cuotas, valor_cuota_pactada, fecha_inicio). Las cuotas con algún pago se conservan
+    tal cual (número, valor y vencimiento); las nuevas toman los números libres de
+    1..numero_cuotas y reparten lo que falta de valor_total. Mismo bloqueo que las vistas de pago.
+    Retorna {contrato_id: cuotas creadas}.
+    """
+    contrato_ids = sorted(set(contrato_ids))
+    with transaction.atomic():
+        bloquear_contratos(contrato_ids, esperar=True)
+        contratos = list(Contrato.objects.filter(id__in=contrato_ids).order_by('id'))
+        cuotas = Cuota.objects.filter(contrato_id__in=contrato_ids)
+        tiene_pagos = Exists(Pago.objects.filter(cuota_id=OuterRef('pk')))
+        conservadas = {}
+        for contrato_id, numero, valor in cuotas.filter(tiene_pagos).values_list('contrato_id', 'numero', 'valor'):
+            conservadas.setdefault(contrato_id, []).append((numero, valor))
+
+        nuevas = []
+        creadas = {}
+        for c in contratos:
+            usados = {numero for numero, _ in conservadas.get(c.id, [])}
+            restante = c.valor_total - sum((valor for _, valor in conservadas.get(c.id, [])), CERO)
+            faltan = c.numero_cuotas - len(usados)
+            numeros = [n for n in range(1, c.numero_cuotas + len(usados) + 1) if n not in usados][:max(faltan, 0)]
+            if restante < 0:
+                raise ValidationError(f'Contrato {c.id}: las cuotas con pagos suman más que el valor total.')
+            if restante > 0 and not numeros:
+                raise ValidationError(f'Contrato {c.id}: no quedan cuotas sin pagos para repartir {restante}.')
+            construidas = construir_cuotas(c, hoy, numeros=numeros, valor_total=restante) if restante > 0 else []
+            nuevas.extend(construidas)
+            creadas[c.id] = len(construidas)
+
+        # Sin pagos no tienen términos de búsqueda propios ni nada en cascada: se borran con un
+        # DELETE directo. queryset.delete() cargaría cada cuota para su post_delete
+        # (signals.invalidar_cxc_cuota, una consulta por cuota); sincronizar_contratos ya
+        # invalida el listado CxC de estos contratos.
+        sin_pagos = list(cuotas.exclude(tiene_pagos).values_list('id', flat=True))
+        TerminoBusqueda.objects.filter(cuota_id__in=sin_pagos).delete()
+        Cuota.objects.filter(id__in=sin_pagos)._raw_delete(Cuota.objects.db)
+        Cuota.objects.bulk_create(nuevas, batch_size=1000)
+        sincronizar_contratos(contrato_ids)
+    return creadas
@@ -0,0 +1,115 @@
+import os
+
+from django.db.models import F, Prefetch, Q, Sum
+from django.template.loader import render_to_string
+
+from .models import Acudiente, Contrato, Cuota, Pago
+from .services import CERO
+
+# Estados de cuenta por acudiente: contratos (de todos sus estudiantes), cuotas y pagos.
+# Cuatro consultas por lote de acudientes, sin importar cuántos contratos, cuotas o pagos
+# tengan: acudientes, contratos con totales agregados en la base, cuotas y pagos.
+# Para todos los acudientes o una sede completa, ver el comando generar_estados_cuenta.
+
+LOTE_ACUDIENTES = 200
+
+
+def consultar_estados_cuenta(acudiente_ids, hoy, sede_id=None):
+    """
+    Acudientes (orden por nombre) con .contratos; cada contrato con .cuotas (con .saldo), .pagos
+    (incluye los que no tienen cuota, con .cuota_numero) y totales: cuotas_valor, cuotas_pagado,
+    cuotas_saldo, saldo_vencido. Cada acudiente con total_valor, total_pagado, total_saldo y
+    total_vencido. sede_id: solo los contratos de estudiantes de esa sede.
+    """
+    contratos = (
+        Contrato.objects
+        .select_related('estudiante__sede')
+        .annotate(
+            cuotas_valor=Sum('cuota__valor', default=0),
+            cuotas_pagado=Sum('cuota__valor_pagado', default=0),
+            cuotas_saldo=Sum(F('cuota__valor') - F('cuota__valor_pagado'), default=0),
+            saldo_vencido=Sum(
+                F('cuota__valor') - F('cuota__valor_pagado'),
+                filter=Q(cuota__fecha_vencimiento__lt=hoy), default=0,
+            ),
+        )
+        .order_by('estudiante__nombre_completo', 'id')
+    )
+    acudientes = Acudiente.objects.filter(id__in=list(acudiente_ids))
+    if sede_id:
+        contratos = contratos.filter(estudiante__sede_id=sede_id)
+        acudientes = acudientes.filter(contrato__estudiante__sede_id=sede_id).distinct()
+
+    acudientes = list(
+        acudientes
+        .order_by('nombre_completo', 'id')
+        .prefetch_related(
+            Prefetch('contrato_set', queryset=contratos, to_attr='contratos'),
+            Prefetch('contratos__cuota_set', to_attr='cuotas', queryset=(
+                Cuota.objects.annotate(saldo=F('valor') - F('valor_pagado')).order_by('numero')
+            )),
+            Prefetch('contratos__pago_set', to_attr='pagos', queryset=(
+                Pago.objects.annotate(cuota_numero=F('cuota__numero')).order_by('fecha_pago', 'id')
+            )),
+        )
+    )
+    for a in acudientes:
+        a.total_valor = sum((c.cuotas_valor for c in a.contratos), CERO)
+        a.total_pagado = sum((c.cuotas_pagado for c in a.contratos), CERO)
+        a.total_saldo = sum((c.cuotas_saldo for c in a.contratos), CERO)
+        a.total_vencido = sum((c.saldo_vencido for c in a.contratos), CERO)
+    return acudientes
+
+
+def iterar_estados_cuenta(acudiente_ids, hoy, sede_id=None, lote=LOTE_ACUDIENTES):
+    """Como consultar_estados_cuenta, por lotes (memoria acotada para sedes grandes)."""
+    acudiente_ids = list(acudiente_ids)
+    for i in range(0, len(acudiente_ids), lote):
+        yield from consultar_estados_cuenta(acudiente_ids[i:i + lote], hoy, sede_id=sede_id)
+
+
+def acudientes_de_sede(sede_id=None):
+    """Ids de los acudientes con contratos de estudiantes de la sede (o de cualquiera), en orden de id."""
+    contratos = Contrato.objects.all()
+    if sede_id:
+        contratos = contratos.filter(estudiante__sede_id=sede_id)
+    return list(contratos.order_by('acudiente_id').values_list('acudiente_id', flat=True).distinct())
+
+
+def renderizar_html(acudientes, hoy):
+    """HTML imprimible (un salto de página por acudiente)."""
+    return render_to_string('estado_cuenta.html', {'acudientes': acudientes, 'hoy': hoy})
+
+
+def html_a_pdf(html):
+    """PDF del HTML con WeasyPrint (dependencia opcional: ImportError si no está instalada)."""
+    from weasyprint import HTML
+    return HTML(string=html).write_pdf()
+
+
+def generar_archivos(acudiente_ids, directorio, hoy, sede_id=None, formato='html'):
+    """
+    Escribe un archivo por acudiente en `directorio` (estado_cuenta_<id>.html|pdf) y retorna
+    las filas del manifiesto para el envío por correo. Se ejecuta en cada proceso del comando
+    generar_estados_cuenta; también sirve en un solo proceso.
+    """
+    filas = []
+    for a in iterar_estados_cuenta(acudiente_ids, hoy, sede_id=sede_id):
+        html = renderizar_html([a], hoy)
+        nombre = f'estado_cuenta_{a.id}.{formato}'
+        if formato == 'pdf':
+            with open(os.path.join(directorio, nombre), 'wb') as fh:
+                fh.write(html_a_pdf(html))
+        else:
+            with open(os.path.join(directorio, nombre), 'w', encoding='utf-8') as fh:
+                fh.write(html)
+        filas.append({
+            'acudiente_id': a.id,
+            'nombre': a.nombre_completo,
+            'email': a.email,
+            'archivo': nombre,
+            'contratos': len(a.contratos),
+            'saldo': str(a.total_saldo),
+            'vencido': str(a.total_vencido),
+        })
+    return filas
@@ -0,0 +1,123 @@
+from collections import defaultdict
+
+from .models import Cuota, Pago
+
+# Historial de pagos de una o varias cuotas para el modal de CxC (aplicar_pago GET y
+# historial_pagos_lote). Dos consultas sin importar cuántas cuotas: las cuotas de sus
+# contratos (de ahí salen las previas con saldo, usando el snapshot valor_pagado) y sus pagos.
+# ahistoriales hace lo mismo con el ORM async; ambas comparten las consultas y el armado.
+# El ETag del historial de una cuota es la version de su contrato (sube con cada cambio de
+# pagos, ver services.sincronizar_contratos), leída de la base: vale igual en todos los workers.
+
+
+def _pago_json(p):
+    medio = p['forma_pago'] or ''
+    return {
+        'id': p['id'],
+        'fecha_pago': p['fecha_pago'].strftime('%Y-%m-%d'),
+        'valor_pagado': str(p['valor_pagado']),
+        'forma_pago': 'Banco' if medio == 'Transferencia' else medio,
+        'numero_factura': p['numero_factura'] or '',
+        'referencia': p['referencia'] or '',
+        'observacion': p['observacion'] or '',
+    }
+
+
+def _consulta_cuotas(pedidas, sede_id):
+    cuotas = Cuota.objects.filter(
+        contrato_id__in=Cuota.objects.filter(id__in=pedidas).values('contrato_id')
+    )
+    if sede_id:
+        cuotas = cuotas.filter(contrato__estudiante__sede_id=sede_id)
+    return (
+        cuotas.order_by('contrato_id', 'numero')
+        .values('id', 'contrato_id', 'contrato__version', 'numero', 'fecha_vencimiento', 'valor', 'valor_pagado')
+    )
+
+
+def _armar(pedidas, filas_cuotas):
+    por_contrato = defaultdict(list)
+    for c in filas_cuotas:
+        por_contrato[c['contrato_id']].append(c)
+
+    resultado = {}
+    for filas in por_contrato.values():
+        for c in filas:
+            if c['id'] not in pedidas:
+                continue
+            resultado[c['id']] = {
+                'contrato_id': c['contrato_id'],
+                'version_contrato': c['contrato__version'],
+                'pagos': [],
+                'previas_pendientes': [
+                    {
+                        'cuota_id': p['id'],
+                        'numero': p['numero'],
+                        'vence': p['fecha_vencimiento'].strftime('%Y-%m-%d'),
+                        'saldo': str(p['valor'] - p['valor_pagado']),
+                    }
+                    for p in filas
+                    if p['numero'] < c['numero'] and p['valor'] > p['valor_pagado']
+                ],
+            }
+    return resultado
+
+
+def _consulta_pagos(resultado):
+    # Se leen en el orden del índice pago_cuota_fecha_idx (sin ordenamiento en la base)
+    # y se invierten por cuota: el historial se muestra del más antiguo al más reciente.
+    return (
+        Pago.objects
+        .filter(cuota_id__in=list(resultado))
+        .order_by('cuota_id', '-fecha_pago', '-id')
+        .values('id', 'cuota_id', 'fecha_pago', 'valor_pagado', 'forma_pago', 'numero_factura',
+                'referencia', 'observacion')
+    )
+
+
+def _agregar_pagos(resultado, filas_pagos):
+    for p in filas_pagos:
+        resultado[p['cuota_id']]['pagos'].append(_pago_json(p))
+    for datos in resultado.values():
+        datos['pagos'].reverse()
+    return resultado
+
+
+def _consulta_version(cuota_id):
+    return Cuota.objects.filter(id=cuota_id).values_list('contrato_id', 'contrato__version')
+
+
+def version_de_cuota(cuota_id):
+    """(contrato_id, version) del contrato de la cuota, o None si la cuota no existe. Una consulta."""
+    return _consulta_version(cuota_id).first()
+
+
+async def aversion_de_cuota(cuota_id):
+    return await _consulta_version(cuota_id).afirst()
+
+
+def etag_historial(cuota_id, contrato_id, version):
+    return f'"h{cuota_id}-{contrato_id}-{version}"'
+
+
+def historiales(cuota_ids, sede_id=None):
+    """
+    {cuota_id: {'contrato_id', 'version_contrato', 'pagos': [...], 'previas_pendientes': [...]}}
+    de las cuotas dadas (version_contrato: la que aplicar_pago/eliminar_pago comparan).
+    - sede_id: si se envía, se omiten las cuotas de otras sedes.
+    Las cuotas que no existen (o de otra sede) no aparecen en el resultado.
+    """
+    pedidas = {int(i) for i in cuota_ids}
+    if not pedidas:
+        return {}
+    resultado = _armar(pedidas, _consulta_cuotas(pedidas, sede_id))
+    return _agregar_pagos(resultado, _consulta_pagos(resultado))
+
+
+async def ahistoriales(cuota_ids, sede_id=None):
+    """Igual que historiales, con el ORM async (para las vistas de vistas_async.py)."""
+    pedidas = {int(i) for i in cuota_ids}
+    if not pedidas:
+        return {}
+    resultado = _armar(pedidas, [c async for c in _consulta_cuotas(pedidas, sede_id)])
+    return _agregar_pagos(resultado, [p async for p in _consulta_pagos(resultado)])
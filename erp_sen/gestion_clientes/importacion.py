@@ -0,0 +1,206 @@
+import csv
+import io
+import re
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .models import Contrato, Cuota, Pago
+from .services import CERO, ContratoOcupado, bloquear_contratos, guardar_pagos, preparar_pagos, saldo_de
+
+# Importación masiva de pagos desde un extracto bancario (CSV).
+# Columnas: documento o contrato, valor, fecha, forma_pago, referencia
+#           (+ opcionales numero_factura, observacion).
+# Las filas se agrupan por contrato: cada contrato se bloquea UNA vez y sus pagos se
+# aplican del más antiguo al más reciente con las reglas de modo=auto (cuotas más
+# antiguas primero, sin superar el saldo total del contrato).
+
+FORMAS_PAGO = {clave for clave, _ in Pago.FORMA_PAGO}
+FORMATOS_FECHA = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+
+
+def leer_csv(archivo_texto):
+    """Filas del CSV como dicts con encabezados normalizados (minúsculas, sin espacios)."""
+    muestra = archivo_texto[:2048]
+    try:
+        dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    lector = csv.DictReader(io.StringIO(archivo_texto.lstrip('\ufeff')), dialect=dialecto)
+    for fila in lector:
+        yield {
+            (k or '').strip().lower().replace(' ', '_'): (v or '').strip()
+            for k, v in fila.items()
+        }
+
+
+def _parse_fecha(texto):
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    return None
+
+
+# Valor: dígitos solos o en grupos de mil con '.' o ',' (un solo separador), y opcionalmente
+# decimales de exactamente 2 dígitos con el OTRO separador (o cualquiera si no hay miles).
+_VALOR = re.compile(
+    r'(?P<entero>\d{1,3}(?:(?P<miles>[.,])\d{3})(?:(?P=miles)\d{3})*|\d+)'
+    r'(?:(?P<decimal>[.,])(?P<centavos>\d{2}))?'
+)
+
+
+def _parse_valor(texto):
+    """
+    Decimal de un valor de extracto, o None si el formato es ambiguo o inválido.
+    "150000", "$ 150.000", "150,000", "1.500.000", "1.500,50", "1,500.50" y "150000.00"
+    son válidos; "150.5", "1,5", "12,34,567" y "1.500.50" no (un valor 1000 veces menor
+    por leer mal un separador es peor que una fila rechazada).
+    """
+    limpio = texto.replace('$', '').replace(' ', '').replace('\xa0', '')
+    m = _VALOR.fullmatch(limpio)
+    if not m or (m['miles'] and m['decimal'] == m['miles']):
+        return None
+    entero = m['entero'].replace(m['miles'] or '.', '')
+    try:
+        return Decimal(f"{entero}.{m['centavos']}" if m['centavos'] else entero)
+    except InvalidOperation:
+        return None
+
+
+def _validar(numero, fila):
+    """Convierte una fila cruda en datos de pago; retorna (datos, error)."""
+    valor = _parse_valor(fila.get('valor', ''))
+    if valor is None or valor <= 0:
+        return None, 'Valor inválido.'
+    fecha = _parse_fecha(fila.get('fecha', ''))
+    if not fecha:
+        return None, 'Fecha inválida (use AAAA-MM-DD o DD/MM/AAAA).'
+    forma_pago = fila.get('forma_pago', '')
+    if forma_pago not in FORMAS_PAGO:
+        return None, f'Forma de pago inválida: {forma_pago or "(vacía)"}.'
+    referencia = fila.get('referencia', '')
+    if not referencia:
+        return None, 'La referencia es obligatoria.'
+    contrato = fila.get('contrato', '')
+    documento = fila.get('documento', '')
+    if not contrato and not documento:
+        return None, 'Falta documento o contrato.'
+    if contrato and not contrato.isdigit():
+        return None, 'Contrato inválido.'
+    return {
+        'fila': numero,
+        'contrato': int(contrato) if contrato else None,
+        'documento': documento,
+        'valor': valor,
+        'fecha_pago': fecha,
+        'forma_pago': forma_pago,
+        'referencia': referencia[:100],
+        'numero_factura': (fila.get('numero_factura') or '')[:30] or None,
+        'observacion': fila.get('observacion') or '',
+    }, None
+
+
+def importar_pagos(filas, sede_id=None, dry_run=False):
+    """
+    Aplica pagos en bloque. `filas`: iterable de dicts (ver leer_csv).
+    - sede_id: si se envía, solo se aceptan contratos de estudiantes de esa sede.
+    - dry_run: calcula todo pero revierte las escrituras.
+    Retorna un reporte por fila: {'fila', 'ok', 'contrato_id', 'error', 'distribucion'}.
+    """
+    reporte = {}
+    validas = []
+    for numero, fila in enumerate(filas, start=2):  # fila 1 = encabezados
+        datos, error = _validar(numero, fila)
+        if error:
+            reporte[numero] = {'fila': numero, 'ok': False, 'contrato_id': None, 'error': error, 'distribucion': []}
+        else:
+            validas.append(datos)
+
+    # --------- Resolver contratos (2 consultas) ---------
+    por_id = {
+        c.id: c for c in
+        Contrato.objects.filter(id__in={d['contrato'] for d in validas if d['contrato']})
+        .select_related('estudiante')
+    }
+    por_documento = {}
+    activos = (
+        Contrato.objects
+        .filter(estudiante__documento__in={d['documento'] for d in validas if not d['contrato']}, estado='Activo')
+        .select_related('estudiante')
+        .order_by('id')
+    )
+    for c in activos:
+        por_documento[c.estudiante.documento] = c  # el contrato activo más reciente
+
+    grupos = OrderedDict()
+    for d in validas:
+        contrato = por_id.get(d['contrato']) if d['contrato'] else por_documento.get(d['documento'])
+        error = None
+        if contrato is None:
+            error = 'Contrato no encontrado.' if d['contrato'] else 'No hay contrato activo para el documento.'
+        elif sede_id and contrato.estudiante.sede_id != sede_id:
+            error = 'No tiene permisos sobre esta sede.'
+        if error:
+            reporte[d['fila']] = {'fila': d['fila'], 'ok': False, 'contrato_id': None, 'error': error, 'distribucion': []}
+            continue
+        grupos.setdefault(contrato.id, []).append(d)
+
+    # --------- Referencias ya registradas (evita aplicar dos veces el mismo extracto) ---------
+    existentes = set(
+        Pago.objects
+        .filter(contrato_id__in=list(grupos), referencia__in={d['referencia'] for g in grupos.values() for d in g})
+        .values_list('contrato_id', 'referencia')
+    )
+
+    # --------- Aplicar por contrato ---------
+    for contrato_id, datos_grupo in grupos.items():
+        datos_grupo.sort(key=lambda d: (d['fecha_pago'], d['fila']))  # más antiguos primero
+        try:
+            with transaction.atomic():
+                bloquear_contratos([contrato_id], esperar=True)
+                _aplicar_grupo(contrato_id, datos_grupo, existentes, reporte, dry_run)
+        except ContratoOcupado:
+            for d in datos_grupo:
+                reporte[d['fila']] = {
+                    'fila': d['fila'], 'ok': False, 'contrato_id': contrato_id, 'distribucion': [],
+                    'error': 'El contrato estaba ocupado por otra operación; vuelva a importar esta fila.',
+                }
+
+    return [reporte[k] for k in sorted(reporte)]
+
+
+def _aplicar_grupo(contrato_id, datos_grupo, existentes, reporte, dry_run):
+    """Aplica las filas de un contrato ya bloqueado (dentro de atomic)."""
+    cuotas = list(Cuota.objects.filter(contrato_id=contrato_id).order_by('numero'))
+    pagos = []
+    for d in datos_grupo:
+        clave = (contrato_id, d['referencia'])
+        resultado = {'fila': d['fila'], 'ok': False, 'contrato_id': contrato_id, 'error': None, 'distribucion': []}
+        reporte[d['fila']] = resultado
+        if clave in existentes:
+            resultado['error'] = f'La referencia {d["referencia"]} ya está registrada en el contrato.'
+            continue
+        capacidad = sum((max(saldo_de(c), CERO) for c in cuotas), CERO)
+        if d['valor'] > capacidad:
+            resultado['error'] = f'El valor ({d["valor"]}) supera la capacidad total disponible ({capacidad}).'
+            continue
+        nuevos = preparar_pagos(
+            cuotas, d['valor'],
+            fecha_pago=d['fecha_pago'], forma_pago=d['forma_pago'], referencia=d['referencia'],
+            numero_factura=d['numero_factura'], observacion=d['observacion'],
+        )
+        pagos.extend(nuevos)
+        existentes.add(clave)
+        resultado['ok'] = True
+        resultado['distribucion'] = [
+            {'cuota_id': p.cuota.id, 'numero': p.cuota.numero, 'aplicado': str(p.valor_pagado)}
+            for p in nuevos
+        ]
+
+    guardar_pagos(pagos)
+    if dry_run:
+        transaction.set_rollback(True)
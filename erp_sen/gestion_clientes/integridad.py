@@ -0,0 +1,139 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import Contrato, Cuota, Pago
+from .services import (
+    CAMPOS_AGREGADOS_CONTRATO, CAMPOS_SNAPSHOT, CERO, bloquear_contratos,
+    calcular_agregados_contratos, calcular_snapshot_cuotas, refrescar_cuotas, sincronizar_contratos,
+)
+
+# Verificación de los snapshots de Cuota contra las filas de Pago que resumen.
+# Consultas agrupadas por bloque de contratos (no una por cuota).
+
+
+def diferencias_cuotas(contrato_ids):
+    """
+    Cuotas de los contratos dados cuyo valor_pagado guardado no es la suma de sus pagos.
+    Dos consultas. Retorna [{'cuota_id', 'contrato_id', 'guardado', 'calculado'}].
+    """
+    contrato_ids = list(contrato_ids)
+    pagado = dict(
+        Pago.objects
+        .filter(cuota__contrato_id__in=contrato_ids)
+        .values('cuota_id')
+        .annotate(total=Sum('valor_pagado'))
+        .values_list('cuota_id', 'total')
+    )
+    diferencias = []
+    for cuota_id, contrato_id, guardado in (
+        Cuota.objects.filter(contrato_id__in=contrato_ids).values_list('id', 'contrato_id', 'valor_pagado')
+    ):
+        calculado = (pagado.get(cuota_id) or CERO).quantize(CERO)  # SQLite suma sin decimales fijos
+        if guardado != calculado:
+            diferencias.append({
+                'cuota_id': cuota_id, 'contrato_id': contrato_id,
+                'guardado': str(guardado), 'calculado': str(calculado),
+            })
+    return diferencias
+
+
+def contratos_descuadrados(contrato_ids):
+    """Ids de contratos cuyos agregados guardados (total_pagado, saldo, ...) no cuadran con pagos y cuotas."""
+    return sorted(c.id for c in calcular_agregados_contratos(Contrato.objects.filter(id__in=list(contrato_ids))))
+
+
+def referencias_repetidas(contrato_ids, prefijo=''):
+    """
+    (cuota_id, referencia, veces) de referencias registradas más de una vez en la misma cuota:
+    un mismo envío nunca crea dos pagos en una cuota (modo=auto reparte en cuotas distintas),
+    así que suelen ser dobles envíos del formulario.
+    """
+    qs = Pago.objects.filter(contrato_id__in=list(contrato_ids))
+    if prefijo:
+        qs = qs.filter(referencia__startswith=prefijo)
+    return list(
+        qs.values('cuota_id', 'referencia')
+        .annotate(veces=Count('id'))
+        .filter(veces__gt=1)
+        .values_list('cuota_id', 'referencia', 'veces')
+    )
+
+
+def _campos_distintos(obj, antes, campos):
+    """{campo: [guardado, calculado]} de una instancia recalculada, como texto (para JSON)."""
+    return {
+        campo: [_texto(antes[i]), _texto(getattr(obj, campo))]
+        for i, campo in enumerate(campos) if antes[i] != getattr(obj, campo)
+    }
+
+
+def _texto(valor):
+    if isinstance(valor, Decimal):
+        valor = valor.quantize(CERO)
+    return None if valor is None else str(valor)
+
+
+def revisar_rango(desde_id, hasta_id, hoy=None, limite_detalle=100):
+    """
+    Verifica los contratos con id entre desde_id y hasta_id (inclusive): snapshot de cada
+    cuota (valor_pagado, estado, último pago) contra sus pagos y agregados de cada contrato.
+    Solo lectura; unas seis consultas agrupadas por rango, sin importar cuántas cuotas tenga.
+    - hoy: las cuotas sin pagos vencidas antes de esta fecha deben estar 'Vencida'.
+    Retorna un dict serializable a JSON; 'afectados' son los contratos a reparar.
+    """
+    # Una sola transacción: todas las lecturas ven el mismo estado (InnoDB, REPEATABLE READ),
+    # así un pago que se confirma a mitad de la revisión no aparece como diferencia.
+    with transaction.atomic():
+        cuotas = list(Cuota.objects.filter(contrato_id__gte=desde_id, contrato_id__lte=hasta_id).order_by('id'))
+        guardadas = {c.id: tuple(getattr(c, f) for f in CAMPOS_SNAPSHOT) for c in cuotas}
+        cuotas_mal = calcular_snapshot_cuotas(cuotas, hoy=hoy)
+
+        contratos = list(Contrato.objects.filter(id__gte=desde_id, id__lte=hasta_id).order_by('id'))
+        guardados = {c.id: tuple(getattr(c, f) for f in CAMPOS_AGREGADOS_CONTRATO) for c in contratos}
+        contratos_mal = calcular_agregados_contratos(contratos)
+
+    por_campo = {}
+    detalle = []
+    for c in cuotas_mal:
+        campos = _campos_distintos(c, guardadas[c.id], CAMPOS_SNAPSHOT)
+        for campo in campos:
+            por_campo[campo] = por_campo.get(campo, 0) + 1
+        if len(detalle) < limite_detalle:
+            detalle.append({'cuota_id': c.id, 'contrato_id': c.contrato_id, 'campos': campos})
+    for c in contratos_mal:
+        campos = _campos_distintos(c, guardados[c.id], CAMPOS_AGREGADOS_CONTRATO)
+        for campo in campos:
+            clave = f'contrato.{campo}'
+            por_campo[clave] = por_campo.get(clave, 0) + 1
+        if len(detalle) < limite_detalle:
+            detalle.append({'contrato_id': c.id, 'campos': campos})
+
+    afectados = sorted({c.contrato_id for c in cuotas_mal} | {c.id for c in contratos_mal})
+    return {
+        'desde_id': desde_id,
+        'hasta_id': hasta_id,
+        'contratos': len(contratos),
+        'cuotas': len(cuotas),
+        'cuotas_con_diferencias': len(cuotas_mal),
+        'contratos_con_diferencias': len(contratos_mal),
+        'afectados': afectados,
+        'por_campo': por_campo,
+        'detalle': detalle,
+    }
+
+
+def reparar_contratos(contrato_ids, hoy=None):
+    """
+    Recalcula desde los pagos y guarda (bulk_update) el snapshot de las cuotas y los agregados
+    de los contratos dados, con el mismo bloqueo que las vistas de pago (espera; si vence,
+    ContratoOcupado). Bajo el bloqueo se recalcula todo de nuevo: los pagos pudieron cambiar
+    desde la revisión.
+    """
+    contrato_ids = sorted(set(contrato_ids))
+    with transaction.atomic():
+        bloquear_contratos(contrato_ids, esperar=True)
+        refrescar_cuotas(Cuota.objects.filter(contrato_id__in=contrato_ids), hoy=hoy)
+        sincronizar_contratos(contrato_ids)
+    return len(contrato_ids)
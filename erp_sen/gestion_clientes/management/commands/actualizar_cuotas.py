@@ -1,23 +1,93 @@
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
-from gestion_clientes.models import Cuota
+from gestion_clientes import cache_cxc
+from gestion_clientes.cartera import reconstruir_cartera
+from gestion_clientes.models import Cuota, MarcaProceso
+from gestion_clientes.services import bloquear_contratos, sincronizar_contratos
+
 
 class Command(BaseCommand):
     help = 'Actualiza el estado de las cuotas vencidas automáticamente'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Solo cuenta las cuotas que se marcarían, sin escribir.')
+        parser.add_argument('--sede', type=int, default=None,
+                            help='Limitar a los estudiantes de una sede.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Cuotas por UPDATE (default 1000).')
+        parser.add_argument('--completo', action='store_true',
+                            help='Ignora la última fecha procesada y revisa todas las cuotas vencidas.')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
         hoy = timezone.now().date()
-        cuotas_actualizadas = 0
+        dry_run = options['dry_run']
+        sede_id = options['sede']
+        batch_size = max(1, options['batch_size'])
 
-        cuotas = Cuota.objects.filter(
-            fecha_vencimiento__lt=hoy
-        ).exclude(estado__in=['Pagada', 'Parcial'])
+        # Marca por sede para que una corrida parcial no adelante la global
+        clave = 'actualizar_cuotas' if not sede_id else f'actualizar_cuotas:sede={sede_id}'
+        marca = MarcaProceso.objects.filter(nombre=clave).first()
+
+        # Solo 'Pendiente' vencidas (Pagada/Parcial no se tocan y 'Vencida' ya está marcada)
+        cuotas = Cuota.objects.filter(estado='Pendiente', fecha_vencimiento__lt=hoy)
+        if sede_id:
+            cuotas = cuotas.filter(contrato__estudiante__sede_id=sede_id)
+        if marca and not options['completo']:
+            # Incremental: lo anterior a la última corrida ya fue procesado. Quien devuelva
+            # una cuota a sin pagos debe recalcularla con hoy (services.refrescar_cuotas).
+            cuotas = cuotas.filter(fecha_vencimiento__gte=marca.ultima_fecha)
+            modo = f'incremental desde {marca.ultima_fecha}'
+        else:
+            modo = 'completo'
+
+        cuotas_actualizadas = 0
+        lotes = 0
+        ultimo_id = 0
+        while True:
+            ids = list(
+                cuotas.filter(id__gt=ultimo_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            if dry_run:
+                cuotas_actualizadas += len(ids)
+            else:
+                contrato_ids = set(
+                    Cuota.objects.filter(id__in=ids).values_list('contrato_id', flat=True).distinct()
+                )
+                with transaction.atomic():
+                    # Mismo orden de bloqueo que las vistas de pago: Contrato y después Cuota
+                    bloquear_contratos(contrato_ids, esperar=True)
+                    # UPDATE ... SET estado='Vencida' WHERE id IN (...) AND estado='Pendiente'
+                    # (si un pago llegó antes del bloqueo, la cuota ya no está 'Pendiente')
+                    cuotas_actualizadas += (
+                        Cuota.objects.filter(id__in=ids, estado='Pendiente').update(estado='Vencida')
+                    )
+                    # version y cuotas_vencidas de los contratos afectados
+                    sincronizar_contratos(contrato_ids)
+            lotes += 1
+            ultimo_id = ids[-1]
 
-        for cuota in cuotas:
-            cuota.estado = 'Vencida'
-            cuota.save()
-            cuotas_actualizadas += 1
+        grupos_cartera = 0
+        if not dry_run:
+            MarcaProceso.objects.update_or_create(nombre=clave, defaults={'ultima_fecha': hoy})
+            # Los días de mora avanzan cada día: recalcular la cartera por edades completa
+            grupos_cartera = reconstruir_cartera(hoy=hoy, sede_id=sede_id)
+            # Páginas del listado CxC en cache de la sede (o de todas)
+            if sede_id:
+                cache_cxc.invalidar_sedes([sede_id])
+            else:
+                cache_cxc.invalidar_todo()
 
+        segundos = time.monotonic() - inicio
+        self.stdout.write(f'Modo: {modo}{" (dry-run)" if dry_run else ""}; lotes: {lotes}; '
+                          f'filas de cartera: {grupos_cartera}; tiempo: {segundos:.2f}s')
+        verbo = 'se marcarían' if dry_run else 'actualizada(s)'
         self.stdout.write(self.style.SUCCESS(
-            f'{cuotas_actualizadas} cuota(s) actualizada(s) como Vencida(s).'
+            f'{cuotas_actualizadas} cuota(s) {verbo} como Vencida(s).'
         ))
@@ -0,0 +1,211 @@
+import io
+import json
+import platform
+import random
+import statistics
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import F
+from django.test import RequestFactory
+from django.utils import timezone
+
+from gestion_clientes.middleware import PerfilConsultas
+from gestion_clientes.models import Cuota, Estudiante, Pago
+from gestion_clientes.paginacion import paginar_keyset
+from gestion_clientes.views import (
+    CXC_ORDEN_KEYSET, aplicar_pago, eliminar_pago, listado_cxc,
+)
+
+
+class Command(BaseCommand):
+    help = ('Mide los caminos calientes de CxC (listado con filtros típicos, aplicar_pago en ambos '
+            'modos, eliminar_pago y actualizar_cuotas) sobre la base actual y emite JSON. '
+            'Los pagos de prueba se eliminan al terminar. Use generar_datos para crear volumen.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=5,
+                            help='Mediciones por caso (default 5).')
+        parser.add_argument('--semilla', type=int, default=1,
+                            help='Semilla para elegir cuotas y textos de búsqueda (default 1).')
+        parser.add_argument('--salida', default=None,
+                            help='Archivo donde guardar el JSON (además de imprimirlo).')
+        parser.add_argument('--sin-escrituras', action='store_true',
+                            help='Solo mide lecturas (listado).')
+
+    def handle(self, *args, **options):
+        self.repeticiones = max(1, options['repeticiones'])
+        self.rng = random.Random(options['semilla'])
+        self.factory = RequestFactory()
+        self.usuario = self._usuario()
+
+        total_cuotas = Cuota.objects.count()
+        if not total_cuotas:
+            raise CommandError('No hay cuotas: genere datos con "manage.py generar_datos".')
+
+        resultados = {
+            'fecha': timezone.now().isoformat(),
+            'motor': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'volumen': {
+                'cuotas': total_cuotas,
+                'pagos': Pago.objects.count(),
+                'estudiantes': Estudiante.objects.count(),
+            },
+            'repeticiones': self.repeticiones,
+            'casos': {},
+        }
+        casos = resultados['casos']
+
+        # --------- Listado CxC (cache fría: se limpia antes de cada medición) ---------
+        for nombre, params in self._filtros_tipicos().items():
+            casos[f'listado_cxc:{nombre}'] = self._medir(
+                lambda p=params: listado_cxc(self._get('/cxc/', p)), antes=cache.clear,
+            )
+        casos['listado_cxc:cache_caliente'] = self._medir(lambda: listado_cxc(self._get('/cxc/', {})))
+
+        # --------- Escrituras ---------
+        # Cada pago creado se elimina después; las cuotas que vuelven a quedar sin pago
+        # las marca de nuevo como Vencida el propio actualizar_cuotas medido al final.
+        if not options['sin_escrituras']:
+            casos.update(self._medir_pagos())
+            casos['actualizar_cuotas:incremental'] = self._medir(
+                lambda: call_command('actualizar_cuotas', stdout=io.StringIO()))
+            casos['actualizar_cuotas:completo'] = self._medir(
+                lambda: call_command('actualizar_cuotas', '--completo', stdout=io.StringIO()))
+
+        salida = json.dumps(resultados, ensure_ascii=False, indent=2)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as fh:
+                fh.write(salida)
+        self.stdout.write(salida)
+
+    # ------------------------------------------------------------------ #
+
+    def _usuario(self):
+        usuario, creado = get_user_model().objects.get_or_create(username='benchmark_cxc')
+        if creado:
+            usuario.set_unusable_password()
+            usuario.save()
+        return usuario
+
+    def _get(self, ruta, params):
+        request = self.factory.get(ruta, params)
+        request.user = self.usuario
+        return request
+
+    def _post(self, ruta, datos):
+        request = self.factory.post(ruta, datos)
+        request.user = self.usuario
+        request._dont_enforce_csrf_checks = True
+        return request
+
+    def _filtros_tipicos(self):
+        hoy = timezone.now().date()
+        nombre = (
+            Estudiante.objects.order_by('id')
+            .values_list('nombre_completo', flat=True)[self.rng.randrange(Estudiante.objects.count())]
+        )
+        # Cursor de una página profunda (página 20 de 50 filas), calculado sin medir
+        cursor = ''
+        qs = Cuota.objects.all()
+        for _ in range(19):
+            pagina = paginar_keyset(qs, CXC_ORDEN_KEYSET, cursor, 50)
+            if not pagina.has_next:
+                break
+            cursor = pagina.next_cursor
+        return {
+            'sin_filtros': {},
+            'texto': {'q': nombre.split()[0].lower()},
+            'estado_vencida': {'estado': 'Vencida'},
+            'rango_vencimiento': {'fv_desde': str(hoy - timedelta(days=30)), 'fv_hasta': str(hoy)},
+            'medio_nequi': {'medio': 'Nequi'},
+            'con_total': {'contar': '1'},
+            'pagina_profunda': {'cursor': cursor},
+            'per_page_200': {'per_page': '200'},
+        }
+
+    def _medir_pagos(self):
+        casos = {}
+        pendientes = Cuota.objects.filter(valor_pagado__lt=F('valor')).order_by('id')
+        # Normal: primeras cuotas con saldo (sin previas que bloqueen)
+        normales = list(pendientes.filter(numero=1).values_list('id', flat=True)[:500])
+        # Auto: cuotas posteriores; el pago cubre primero las previas con saldo
+        auto = list(pendientes.filter(numero__gte=3).values_list('id', flat=True)[:500])
+        if not normales or not auto:
+            raise CommandError('No hay suficientes cuotas con saldo para medir pagos.')
+
+        for modo, ids in (('normal', normales), ('auto', auto)):
+            referencias = []
+            self.rng.shuffle(ids)
+
+            def aplicar(ids=ids, modo=modo, referencias=referencias):
+                cuota = Cuota.objects.get(id=ids.pop())  # sin repetir: cada cuota con su saldo original
+                referencia = f'BENCH-{time.time_ns()}'
+                referencias.append(referencia)
+                datos = {
+                    'cuota_id': cuota.id, 'valor_pagado': str(cuota.valor - cuota.valor_pagado),
+                    'forma_pago': 'Nequi', 'referencia': referencia,
+                }
+                if modo == 'auto':
+                    datos['modo'] = 'auto'
+                respuesta = aplicar_pago(self._post('/pago/aplicar/', datos))
+                if respuesta.status_code != 200:
+                    raise CommandError(f'aplicar_pago ({modo}) respondió {respuesta.status_code}: '
+                                       f'{respuesta.content[:200]}')
+
+            casos[f'aplicar_pago:{modo}'] = self._medir(aplicar)
+
+            pagos = list(Pago.objects.filter(referencia__in=referencias).values_list('id', flat=True))
+            casos[f'eliminar_pago:{modo}'] = self._medir_lista(
+                lambda pago_id: eliminar_pago(self._post('/pago/eliminar/', {'pago_id': pago_id})),
+                pagos,
+            )
+        return casos
+
+    def _medir(self, funcion, antes=None):
+        muestras = []
+        for _ in range(self.repeticiones):
+            if antes:
+                antes()
+            muestras.append(self._una(funcion))
+        return _resumen(muestras)
+
+    def _medir_lista(self, funcion, argumentos):
+        return _resumen([self._una(lambda a=a: funcion(a)) for a in argumentos])
+
+    @staticmethod
+    def _una(funcion):
+        perfil = PerfilConsultas()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(perfil))
+            inicio = time.perf_counter()
+            funcion()
+            duracion = time.perf_counter() - inicio
+        return duracion, perfil.total
+
+
+def _resumen(muestras):
+    if not muestras:
+        return {'n': 0}
+    tiempos = sorted(t * 1000 for t, _ in muestras)
+    consultas = [q for _, q in muestras]
+    p95 = tiempos[min(len(tiempos) - 1, int(round(0.95 * (len(tiempos) - 1))))]
+    return {
+        'n': len(tiempos),
+        'ms_min': round(tiempos[0], 2),
+        'ms_p50': round(statistics.median(tiempos), 2),
+        'ms_p95': round(p95, 2),
+        'ms_max': round(tiempos[-1], 2),
+        'ms_media': round(statistics.fmean(tiempos), 2),
+        'consultas_max': max(consultas),
+    }
@@ -0,0 +1,262 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import F
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from gestion_clientes.integridad import contratos_descuadrados, diferencias_cuotas, referencias_repetidas
+from gestion_clientes.models import Contrato, Cuota, Pago
+from gestion_clientes.perfil import medir_bloqueos, percentiles
+from gestion_clientes.services import bloquear_contratos, refrescar_cuotas, sincronizar_contratos
+
+OPERACIONES = ('aplicar', 'auto', 'eliminar')
+
+
+class Command(BaseCommand):
+    help = ('Estrés concurrente de aplicar_pago (normal y modo=auto) y eliminar_pago: varios hilos, '
+            'cada uno con su Client de pruebas (middleware, sesión y vistas reales), contra un grupo '
+            'pequeño de contratos de la base actual para forzar contención. Reporta latencias '
+            'p50/p95/p99, throughput, espera de bloqueos (FOR UPDATE), respuestas 409/errores y '
+            'violaciones de invariantes (Cuota.valor_pagado = suma de sus pagos; agregados de '
+            'Contrato). Los pagos creados se eliminan al terminar.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=8, help='Hilos concurrentes (default 8).')
+        parser.add_argument('--operaciones', type=int, default=50,
+                            help='Operaciones por hilo (default 50).')
+        parser.add_argument('--contratos', type=int, default=5,
+                            help='Contratos sobre los que se concentra la carga (default 5).')
+        parser.add_argument('--mezcla', default='4,3,3',
+                            help='Pesos aplicar,auto,eliminar (default 4,3,3).')
+        parser.add_argument('--reintentos', type=int, default=10,
+                            help='Reintentos ante 409 por operación (default 10).')
+        parser.add_argument('--doble-envio', type=float, default=0.0,
+                            help='Fracción de pagos enviados dos veces a la vez (doble clic), 0-1.')
+        parser.add_argument('--semilla', type=int, default=1)
+        parser.add_argument('--conservar', action='store_true',
+                            help='No eliminar los pagos creados por la prueba.')
+        parser.add_argument('--salida', default=None, help='Archivo donde guardar el JSON.')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['semilla'])
+        self.reintentos = max(0, options['reintentos'])
+        self.doble = min(max(options['doble_envio'], 0.0), 1.0)
+        try:
+            pesos = [int(p) for p in options['mezcla'].split(',')]
+            assert len(pesos) == 3 and sum(pesos) > 0 and min(pesos) >= 0
+        except (ValueError, AssertionError):
+            raise CommandError('--mezcla debe ser tres enteros no negativos, p. ej. 4,3,3.')
+        self.pesos = pesos
+
+        self.contratos = list(
+            Contrato.objects.filter(saldo__gt=0, numero_cuotas__gte=3)
+            .order_by('id').values_list('id', flat=True)[:max(1, options['contratos'])]
+        )
+        if not self.contratos:
+            raise CommandError('No hay contratos con saldo: genere datos con "manage.py generar_datos".')
+        self.prefijo = f'ESTRES-{time.time_ns()}-'
+        self.host = next((h for h in settings.ALLOWED_HOSTS if h not in ('*', '') and not h.startswith('.')), 'localhost')
+        self.usuario = self._usuario()
+
+        self.mutex = threading.Lock()
+        self.pagos_creados = []          # ids disponibles para eliminar
+        self.latencias = defaultdict(list)
+        self.estados = defaultdict(lambda: defaultdict(int))
+        self.errores = []
+        self.esperas = []                # segundos de cada SELECT ... FOR UPDATE
+        self.contador = 0
+
+        n_hilos = max(1, options['hilos'])
+        hilos = [
+            threading.Thread(target=self._trabajar, args=(n, max(1, options['operaciones'])))
+            for n in range(n_hilos)
+        ]
+        with medir_bloqueos(self._registrar_espera):
+            inicio = time.perf_counter()
+            for h in hilos:
+                h.start()
+            for h in hilos:
+                h.join()
+            segundos = time.perf_counter() - inicio
+
+        reporte = self._reporte(n_hilos, segundos)
+        if not options['conservar']:
+            reporte['pagos_eliminados_al_final'] = self._limpiar()
+
+        salida = json.dumps(reporte, ensure_ascii=False, indent=2)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as fh:
+                fh.write(salida)
+        self.stdout.write(salida)
+        if reporte['invariantes']['violaciones']:
+            self.stderr.write(self.style.ERROR('Hay violaciones de invariantes (ver "invariantes").'))
+
+    # ------------------------------------------------------------------ #
+
+    def _usuario(self):
+        usuario, creado = get_user_model().objects.get_or_create(username='prueba_estres')
+        if creado:
+            usuario.set_unusable_password()
+            usuario.save()
+        return usuario
+
+    def _registrar_espera(self, segundos):
+        with self.mutex:
+            self.esperas.append(segundos)
+
+    def _trabajar(self, n, operaciones):
+        rng = random.Random(self.rng.random() + n)
+        # El segundo cliente es para el doble clic. Sin raise_request_exception: un error de la
+        # vista (deadlock, timeout de bloqueo) cuenta como 500, igual que lo vería el navegador.
+        clientes = [Client(HTTP_HOST=self.host, raise_request_exception=False) for _ in range(2)]
+        for cliente in clientes:
+            cliente.force_login(self.usuario)
+        try:
+            for _ in range(operaciones):
+                operacion = rng.choices(OPERACIONES, weights=self.pesos)[0]
+                try:
+                    if operacion == 'eliminar':
+                        self._eliminar(clientes[0], rng)
+                    else:
+                        self._aplicar(clientes, rng, operacion)
+                except Exception as e:  # errores fuera de la vista (consultas del propio comando)
+                    with self.mutex:
+                        self.errores.append(f'{operacion}: {e!r}'[:300])
+        finally:
+            _cerrar_conexiones()
+
+    def _aplicar(self, clientes, rng, operacion):
+        contrato_id = rng.choice(self.contratos)
+        cuotas = list(
+            Cuota.objects.filter(contrato_id=contrato_id, valor_pagado__lt=F('valor'))
+            .order_by('numero').values_list('id', 'valor', 'valor_pagado')
+        )
+        if not cuotas:
+            return
+        if operacion == 'aplicar':
+            cuota_id, valor, pagado = cuotas[0]  # primera con saldo: no la frenan previas
+            monto = min(valor - pagado, 1000 * rng.randint(1, 20))
+        else:
+            cuota_id = cuotas[-1][0]  # la última: modo=auto reparte desde las previas
+            monto = 1000 * rng.randint(1, 40)
+        with self.mutex:
+            self.contador += 1
+            referencia = f'{self.prefijo}{self.contador}'
+        datos = {
+            'cuota_id': cuota_id, 'valor_pagado': str(monto), 'forma_pago': 'Nequi',
+            'referencia': referencia, 'fecha_pago': timezone.now().date().isoformat(),
+        }
+        if operacion == 'auto':
+            datos['modo'] = 'auto'
+
+        if rng.random() < self.doble:
+            # Doble clic: el mismo formulario dos veces casi al mismo tiempo
+            def segundo_envio():
+                try:
+                    self._post(clientes[1], operacion, 'aplicar_pago', datos)
+                finally:
+                    _cerrar_conexiones()
+
+            otro = threading.Thread(target=segundo_envio)
+            otro.start()
+            self._post(clientes[0], operacion, 'aplicar_pago', datos)
+            otro.join()
+        else:
+            self._post(clientes[0], operacion, 'aplicar_pago', datos)
+
+    def _eliminar(self, cliente, rng):
+        with self.mutex:
+            if not self.pagos_creados:
+                return
+            pago_id = self.pagos_creados.pop(rng.randrange(len(self.pagos_creados)))
+        self._post(cliente, 'eliminar', 'eliminar_pago', {'pago_id': pago_id})
+
+    def _post(self, cliente, operacion, url, datos):
+        for intento in range(self.reintentos + 1):
+            inicio = time.perf_counter()
+            r = cliente.post(reverse(url), datos)
+            duracion = time.perf_counter() - inicio
+            with self.mutex:
+                self.latencias[operacion].append(duracion)
+                self.estados[operacion][r.status_code] += 1
+                if r.status_code >= 500:
+                    self.errores.append(f'{operacion}: {r.status_code} {r.content[:200]!r}')
+            if r.status_code != 409:
+                break
+            time.sleep(0.005 * (intento + 1))
+        if r.status_code == 200 and url == 'aplicar_pago':
+            ids = Pago.objects.filter(referencia=datos['referencia']).values_list('id', flat=True)
+            with self.mutex:
+                self.pagos_creados.extend(i for i in ids if i not in self.pagos_creados)
+
+    def _reporte(self, n_hilos, segundos):
+        operaciones = {}
+        exitosas = 0
+        for operacion in OPERACIONES:
+            estados = dict(self.estados.get(operacion, {}))
+            exitosas += estados.get(200, 0)
+            operaciones[operacion] = {
+                'peticiones': sum(estados.values()),
+                'estados': {str(k): v for k, v in sorted(estados.items())},
+                **percentiles(self.latencias.get(operacion, [])),
+            }
+        diferencias = diferencias_cuotas(self.contratos)
+        descuadrados = contratos_descuadrados(self.contratos)
+        repetidas = referencias_repetidas(self.contratos, prefijo=self.prefijo)
+        totales = [
+            {'contrato_id': c, 'total_pagado': str(t), 'saldo': str(s)}
+            for c, t, s in Contrato.objects.filter(id__in=self.contratos).values_list('id', 'total_pagado', 'saldo')
+        ]
+        return {
+            'fecha': timezone.now().isoformat(),
+            'motor': connections['default'].vendor,
+            'hilos': n_hilos,
+            'contratos': self.contratos,
+            'segundos': round(segundos, 3),
+            'exitosas_por_segundo': round(exitosas / segundos, 1) if segundos else None,
+            'operaciones': operaciones,
+            'bloqueos': {
+                'select_for_update': len(self.esperas),
+                'espera_total_ms': round(sum(self.esperas) * 1000, 1),
+                **percentiles(self.esperas),
+            },
+            'errores': self.errores[:50],
+            'total_errores': len(self.errores),
+            'invariantes': {
+                'violaciones': len(diferencias) + len(descuadrados),
+                'cuotas_descuadradas': diferencias[:50],
+                'contratos_descuadrados': descuadrados,
+                'contratos': totales,
+            },
+            # No es una violación (la vista no impide repetir referencia), pero con --doble-envio
+            # muestra cuántos dobles clics terminaron en dos pagos.
+            'referencias_repetidas': [
+                {'cuota_id': c, 'referencia': r, 'veces': v} for c, r, v in repetidas
+            ],
+        }
+
+    def _limpiar(self):
+        """Elimina los pagos de la prueba y recalcula snapshots, con el mismo bloqueo que las vistas."""
+        with transaction.atomic():
+            bloquear_contratos(self.contratos, esperar=True)
+            pagos = Pago.objects.filter(contrato_id__in=self.contratos, referencia__startswith=self.prefijo)
+            cuota_ids = set(pagos.values_list('cuota_id', flat=True))
+            borrados, _ = pagos.delete()
+            refrescar_cuotas(Cuota.objects.filter(id__in=cuota_ids), hoy=timezone.now().date())
+            sincronizar_contratos(self.contratos)
+        return borrados
+
+
+def _cerrar_conexiones():
+    # Cada hilo abre sus propias conexiones; se cierran al terminar el hilo
+    for conexion in connections.all(initialized_only=True):
+        conexion.close()
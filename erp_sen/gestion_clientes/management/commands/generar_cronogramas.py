@@ -0,0 +1,91 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from gestion_clientes.cronogramas import contratos_desde_filas, crear_contratos, generar_cuotas, regenerar_cuotas
+from gestion_clientes.importacion import leer_csv
+from gestion_clientes.models import Contrato, Cuota
+from gestion_clientes.services import ContratoOcupado
+
+
+class Command(BaseCommand):
+    help = ('Cronogramas de cuotas en bloque. Con un CSV (documento, fecha_inicio, valor_total, '
+            'numero_cuotas, valor_cuota opcional) crea los contratos de la temporada de matrículas '
+            'con sus cuotas mensuales; con --sin-cuotas genera las cuotas de los contratos que no '
+            'tienen; con --regenerar rehace las cuotas sin pagos según los términos actuales.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', nargs='?', help='CSV de contratos nuevos (UTF-8; separador , ; o tabulador).')
+        parser.add_argument('--sin-cuotas', action='store_true',
+                            help='Genera el cronograma de los contratos existentes que no tienen cuotas.')
+        parser.add_argument('--regenerar', type=int, nargs='+', metavar='CONTRATO',
+                            help='Ids de contratos cuyas cuotas sin pagos se rehacen.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Contratos por lote/transacción (default 1000).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Con archivo: solo valida las filas, sin guardar.')
+
+    def handle(self, *args, **options):
+        modos = [bool(options['archivo']), options['sin_cuotas'], bool(options['regenerar'])]
+        if sum(modos) != 1:
+            raise CommandError('Indique exactamente uno: archivo, --sin-cuotas o --regenerar.')
+        inicio = time.monotonic()
+        hoy = timezone.now().date()
+        batch_size = max(1, options['batch_size'])
+
+        try:
+            if options['archivo']:
+                mensaje = self._desde_archivo(options['archivo'], hoy, batch_size, options['dry_run'])
+            elif options['sin_cuotas']:
+                mensaje = self._sin_cuotas(hoy, batch_size)
+            else:
+                creadas = {}
+                ids = options['regenerar']
+                for i in range(0, len(ids), batch_size):
+                    creadas.update(regenerar_cuotas(ids[i:i + batch_size], hoy))
+                mensaje = f'{sum(creadas.values())} cuota(s) regenerada(s) en {len(creadas)} contrato(s)'
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+        except ContratoOcupado as e:
+            raise CommandError(f'Otro proceso tiene bloqueados los contratos del lote, vuelva a intentar: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'{mensaje}; {time.monotonic() - inicio:.1f}s.'))
+
+    def _desde_archivo(self, ruta, hoy, batch_size, dry_run):
+        try:
+            with open(ruta, encoding='utf-8-sig') as fh:
+                texto = fh.read()
+        except OSError as exc:
+            raise CommandError(f'No se pudo leer el archivo: {exc}')
+
+        contratos, errores = contratos_desde_filas(leer_csv(texto))
+        for e in errores:
+            self.stdout.write(self.style.WARNING(f"Fila {e['fila']}: {e['error']}"))
+        if dry_run:
+            return f'{len(contratos)} contrato(s) válido(s), {len(errores)} fila(s) con error (dry-run, sin guardar)'
+
+        for i in range(0, len(contratos), batch_size):
+            crear_contratos(contratos[i:i + batch_size], hoy)
+            self.stdout.write(f'{min(i + batch_size, len(contratos))}/{len(contratos)} contratos...')
+        cuotas = sum(c.numero_cuotas for c in contratos)
+        return f'{len(contratos)} contrato(s) y {cuotas} cuota(s) creado(s), {len(errores)} fila(s) con error'
+
+    def _sin_cuotas(self, hoy, batch_size):
+        pendientes = (
+            Contrato.objects
+            .exclude(Exists(Cuota.objects.filter(contrato_id=OuterRef('pk'))))
+            .order_by('id')
+        )
+        contratos = creadas = 0
+        ultimo_id = 0
+        while True:
+            lote = list(pendientes.filter(id__gt=ultimo_id)[:batch_size])
+            if not lote:
+                break
+            creadas += generar_cuotas(lote, hoy)
+            contratos += len(lote)
+            ultimo_id = lote[-1].id
+        return f'{creadas} cuota(s) creada(s) para {contratos} contrato(s) sin cuotas'
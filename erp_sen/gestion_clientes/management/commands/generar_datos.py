@@ -0,0 +1,186 @@
+import random
+import time
+from datetime import time as hora, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from gestion_clientes import cache_cxc
+from gestion_clientes.busqueda import indexar_contratos, indexar_cuotas
+from gestion_clientes.cartera import reconstruir_cartera
+from gestion_clientes.models import (
+    Acudiente, Contrato, Cuota, Estudiante, Horario, Nivel, Pago, Sede,
+)
+from gestion_clientes.services import recalcular_contratos, registrar_pago_en_snapshot
+
+NOMBRES = ['Ana', 'Luis', 'María', 'Juan', 'Camila', 'Andrés', 'Valentina', 'Santiago', 'Sofía',
+           'Mateo', 'Isabella', 'Sebastián', 'Daniela', 'Nicolás', 'Mariana', 'Samuel', 'Paula',
+           'Felipe', 'Laura', 'Tomás', 'Gabriela', 'David', 'Natalia', 'Julián']
+APELLIDOS = ['Gómez', 'Rodríguez', 'Martínez', 'López', 'García', 'Pérez', 'Hernández', 'Díaz',
+             'Torres', 'Ramírez', 'Sánchez', 'Rojas', 'Moreno', 'Vargas', 'Castro', 'Ortiz',
+             'Jiménez', 'Muñoz', 'Álvarez', 'Romero', 'Suárez', 'Cárdenas', 'Mejía', 'Ospina']
+CIUDADES = ['Bogotá', 'Medellín', 'Cali', 'Barranquilla', 'Bucaramanga', 'Pereira']
+NIVELES = [('A1', 'Básico A1'), ('A2', 'Básico A2'), ('B1', 'Intermedio B1'),
+           ('B2', 'Intermedio B2'), ('C1', 'Avanzado C1'), ('KIDS', 'Kids')]
+HORARIOS = [(hora(7), '7:00 am'), (hora(9), '9:00 am'), (hora(14), '2:00 pm'),
+            (hora(16), '4:00 pm'), (hora(18), '6:00 pm')]
+FORMAS_PAGO = ['Banco', 'Nequi', 'Efectivo', 'Transferencia', 'Otro']
+VALORES_CUOTA = [Decimal(v) for v in ('150000', '180000', '220000', '250000', '320000')]
+
+
+class Command(BaseCommand):
+    help = ('Genera datos sintéticos (sedes, acudientes, estudiantes, contratos, cuotas y pagos) '
+            'en bloque y de forma reproducible a partir de una semilla, para pruebas de volumen')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--estudiantes', type=int, default=1000,
+                            help='Estudiantes a crear, cada uno con un contrato (default 1000).')
+        parser.add_argument('--cuotas', type=int, default=10,
+                            help='Cuotas por contrato (default 10). 10k/100k/1M cuotas = '
+                                 '1k/10k/100k estudiantes.')
+        parser.add_argument('--sedes', type=int, default=3,
+                            help='Sedes a usar; se crean las que falten (default 3).')
+        parser.add_argument('--semilla', type=int, default=1,
+                            help='Semilla del generador aleatorio (default 1).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Estudiantes por lote/transacción (default 500).')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        rng = random.Random(options['semilla'])
+        total = options['estudiantes']
+        num_cuotas = max(1, options['cuotas'])
+        batch_size = max(1, options['batch_size'])
+        if total <= 0:
+            raise CommandError('--estudiantes debe ser mayor a cero.')
+        hoy = timezone.now().date()
+
+        sedes, niveles, horarios = self._catalogos(options['sedes'])
+
+        creados = {'estudiantes': 0, 'cuotas': 0, 'pagos': 0}
+        for desde in range(0, total, batch_size):
+            cantidad = min(batch_size, total - desde)
+            with transaction.atomic():
+                lote = self._lote(rng, cantidad, num_cuotas, hoy, sedes, niveles, horarios)
+            for clave, valor in lote.items():
+                creados[clave] += valor
+            self.stdout.write(f'{creados["estudiantes"]}/{total} estudiantes...')
+
+        filas_cartera = reconstruir_cartera(hoy=hoy)
+        cache_cxc.invalidar_todo()
+
+        segundos = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{creados["estudiantes"]} estudiante(s)/contrato(s), {creados["cuotas"]} cuota(s), '
+            f'{creados["pagos"]} pago(s); {filas_cartera} fila(s) de cartera; {segundos:.1f}s.'
+        ))
+
+    def _catalogos(self, num_sedes):
+        sedes = list(Sede.objects.order_by('id')[:num_sedes])
+        for i in range(len(sedes), num_sedes):
+            sedes.append(Sede.objects.create(
+                nombre=f'Sede {i + 1}', ciudad=CIUDADES[i % len(CIUDADES)], direccion=f'Calle {10 + i} # 1-{i}',
+            ))
+        niveles = [Nivel.objects.get_or_create(codigo=c, defaults={'nombre': n})[0] for c, n in NIVELES]
+        horarios = [Horario.objects.get_or_create(hora=h, defaults={'descripcion': d})[0] for h, d in HORARIOS]
+        return sedes, niveles, horarios
+
+    @staticmethod
+    def _siguiente_id(modelo):
+        # Ids explícitos: bulk_create en MySQL no devuelve las llaves generadas
+        return (modelo.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+
+    def _lote(self, rng, cantidad, num_cuotas, hoy, sedes, niveles, horarios):
+        id_acu = self._siguiente_id(Acudiente)
+        id_est = self._siguiente_id(Estudiante)
+        id_con = self._siguiente_id(Contrato)
+        id_cuo = self._siguiente_id(Cuota)
+        id_pag = self._siguiente_id(Pago)
+
+        acudientes, estudiantes, contratos, cuotas, pagos = [], [], [], [], []
+        for i in range(cantidad):
+            apellido = f'{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}'
+            acudiente = Acudiente(
+                id=id_acu + i,
+                nombre_completo=f'{rng.choice(NOMBRES)} {apellido}',
+                tipo_documento='CC',
+                documento=f'9{id_acu + i:09d}',
+                telefono=f'3{rng.randint(0, 999999999):09d}',
+                email=f'acudiente{id_acu + i}@example.com',
+            )
+            estudiante = Estudiante(
+                id=id_est + i,
+                nombre_completo=f'{rng.choice(NOMBRES)} {apellido}',
+                tipo_documento='TI',
+                documento=f'8{id_est + i:09d}',
+                fecha_nacimiento=hoy - timedelta(days=rng.randint(6 * 365, 40 * 365)),
+                nivel=rng.choice(niveles),
+                acudiente_id=acudiente.id,
+                sede=rng.choice(sedes),
+                horario=rng.choice(horarios),
+            )
+            valor_cuota = rng.choice(VALORES_CUOTA)
+            # Contratos iniciados hasta una duración completa atrás: mezcla de vencidas y futuras
+            fecha_inicio = hoy - timedelta(days=rng.randint(0, 30 * num_cuotas))
+            contrato = Contrato(
+                id=id_con + i,
+                estudiante_id=estudiante.id,
+                acudiente_id=acudiente.id,
+                fecha_inicio=fecha_inicio,
+                valor_total=valor_cuota * num_cuotas,
+                valor_cuota_pactada=valor_cuota,
+                numero_cuotas=num_cuotas,
+                estado='Activo',
+            )
+            # Perfil de pago del contrato: puntual, irregular o moroso
+            prob_pago = rng.choice([0.95, 0.95, 0.75, 0.4])
+            for n in range(num_cuotas):
+                cuota = Cuota(
+                    id=id_cuo + len(cuotas),
+                    contrato_id=contrato.id,
+                    numero=n + 1,
+                    fecha_vencimiento=fecha_inicio + timedelta(days=30 * n),
+                    valor=valor_cuota,
+                )
+                cuotas.append(cuota)
+                if cuota.fecha_vencimiento > hoy + timedelta(days=5) or rng.random() > prob_pago:
+                    cuota.estado = 'Vencida' if cuota.fecha_vencimiento < hoy else 'Pendiente'
+                    continue
+                # Uno o dos pagos; a veces queda parcial
+                partes = [cuota.valor] if rng.random() < 0.8 else [cuota.valor / 2, cuota.valor / 2]
+                if rng.random() < 0.1:
+                    partes = partes[:1] if len(partes) == 2 else [cuota.valor / 2]
+                for parte in partes:
+                    fecha_pago = min(hoy, cuota.fecha_vencimiento + timedelta(days=rng.randint(-10, 20)))
+                    pago = Pago(
+                        id=id_pag + len(pagos),
+                        contrato_id=contrato.id,
+                        cuota=cuota,
+                        fecha_pago=fecha_pago,
+                        valor_pagado=parte.quantize(Decimal('0.01')),
+                        forma_pago=rng.choice(FORMAS_PAGO),
+                        referencia=f'GEN{id_pag + len(pagos)}',
+                        numero_factura=f'F{id_pag + len(pagos)}' if rng.random() < 0.5 else None,
+                        observacion='',
+                    )
+                    registrar_pago_en_snapshot(cuota, pago)
+                    pagos.append(pago)
+            acudientes.append(acudiente)
+            estudiantes.append(estudiante)
+            contratos.append(contrato)
+
+        Acudiente.objects.bulk_create(acudientes, batch_size=1000)
+        Estudiante.objects.bulk_create(estudiantes, batch_size=1000)
+        Contrato.objects.bulk_create(contratos, batch_size=1000)
+        Cuota.objects.bulk_create(cuotas, batch_size=1000)
+        Pago.objects.bulk_create(pagos, batch_size=1000)
+
+        # Lo que normalmente mantienen las vistas de pago (bulk_create no dispara señales)
+        ids_contratos = [c.id for c in contratos]
+        recalcular_contratos(ids_contratos)
+        indexar_contratos(ids_contratos)
+        indexar_cuotas({p.cuota.id for p in pagos})
+        return {'estudiantes': len(estudiantes), 'cuotas': len(cuotas), 'pagos': len(pagos)}
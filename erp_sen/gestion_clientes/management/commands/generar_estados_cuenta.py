@@ -0,0 +1,103 @@
+import csv
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from gestion_clientes.estados_cuenta import LOTE_ACUDIENTES, acudientes_de_sede, generar_archivos
+from gestion_clientes.models import Sede
+
+COLUMNAS_MANIFIESTO = ['acudiente_id', 'nombre', 'email', 'archivo', 'contratos', 'saldo', 'vencido']
+
+
+class Command(BaseCommand):
+    help = ('Genera los estados de cuenta de los acudientes, un archivo HTML imprimible o PDF por '
+            'acudiente, más manifiesto.csv (nombre, email, archivo, saldo) para el envío de fin de mes. '
+            'Sin --sede: un estado por acudiente con TODOS sus contratos (aunque tenga estudiantes en '
+            'varias sedes) y un solo manifiesto; es el modo para el envío por correo. Con --sede: una '
+            'carpeta por sede con solo los contratos de esa sede (un acudiente con estudiantes en dos '
+            'sedes recibe dos estados parciales). Reparte los acudientes en lotes entre varios '
+            'procesos; cada lote se consulta con cuatro consultas agrupadas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sede', type=int, action='append', default=None,
+                            help='Id de sede (se puede repetir): estados parciales por sede. '
+                                 'Por defecto todas, agrupadas por acudiente.')
+        parser.add_argument('--directorio', default=None,
+                            help='Carpeta de salida (default estados_cuenta_AAAAMMDD); con --sede, '
+                                 'una subcarpeta por sede.')
+        parser.add_argument('--formato', choices=['html', 'pdf'], default='html',
+                            help='html (por defecto) o pdf (requiere weasyprint).')
+        parser.add_argument('--procesos', type=int, default=min(4, os.cpu_count() or 1),
+                            help='Procesos en paralelo (default min(4, CPUs); 1 = sin pool).')
+        parser.add_argument('--lote', type=int, default=LOTE_ACUDIENTES,
+                            help=f'Acudientes por tarea (default {LOTE_ACUDIENTES}).')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        hoy = timezone.now().date()
+        formato = options['formato']
+        if formato == 'pdf':
+            try:
+                import weasyprint  # noqa: F401  dependencia opcional
+            except ImportError:
+                raise CommandError('Formato pdf no disponible (falta weasyprint); use --formato html.')
+        lote = max(1, options['lote'])
+        procesos = max(1, options['procesos'])
+        base = options['directorio'] or f'estados_cuenta_{hoy:%Y%m%d}'
+
+        # Sin --sede, sede_id=None: cada acudiente con todos sus contratos, en un solo estado
+        if options['sede']:
+            alcances = [
+                (sede_id, os.path.join(base, f'sede_{sede_id}'))
+                for sede_id in Sede.objects.filter(id__in=options['sede']).order_by('id').values_list('id', flat=True)
+            ]
+        else:
+            alcances = [(None, base)]
+        tareas = []  # (sede_id, directorio, acudiente_ids)
+        for sede_id, directorio in alcances:
+            os.makedirs(directorio, exist_ok=True)
+            ids = acudientes_de_sede(sede_id)
+            tareas += [(sede_id, directorio, ids[i:i + lote]) for i in range(0, len(ids), lote)]
+        if not tareas:
+            raise CommandError('No hay acudientes con contratos en las sedes indicadas.')
+
+        if procesos == 1 or len(tareas) == 1:
+            resultados = [generar_archivos(ids, directorio, hoy, sede_id, formato) for sede_id, directorio, ids in tareas]
+        else:
+            # spawn y django.setup como inicializador (ver verificar_saldos)
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=django.setup) as pool:
+                resultados = list(pool.map(
+                    generar_archivos,
+                    [ids for _, _, ids in tareas],
+                    [directorio for _, directorio, _ in tareas],
+                    [hoy] * len(tareas),
+                    [sede_id for sede_id, _, _ in tareas],
+                    [formato] * len(tareas),
+                ))
+
+        # Un manifiesto por sede, en el orden de las tareas (acudientes por nombre dentro de cada lote)
+        por_sede = {}
+        for (sede_id, directorio, _), filas in zip(tareas, resultados):
+            por_sede.setdefault((sede_id, directorio), []).extend(filas)
+        total = 0
+        for (sede_id, directorio), filas in por_sede.items():
+            with open(os.path.join(directorio, 'manifiesto.csv'), 'w', newline='', encoding='utf-8') as fh:
+                writer = csv.DictWriter(fh, fieldnames=COLUMNAS_MANIFIESTO)
+                writer.writeheader()
+                writer.writerows(filas)
+            total += len(filas)
+            alcance = f'Sede {sede_id}' if sede_id else 'Todas las sedes'
+            self.stdout.write(f'{alcance}: {len(filas)} estado(s) de cuenta en {directorio}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} estado(s) de cuenta ({formato}) en {time.perf_counter() - inicio:.1f}s '
+            f'con {procesos} proceso(s).'
+        ))
@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion_clientes.importacion import importar_pagos, leer_csv
+
+
+class Command(BaseCommand):
+    help = ('Importa pagos desde un CSV (documento o contrato, valor, fecha, forma_pago, referencia) '
+            'aplicándolos con distribución automática, agrupados por contrato')
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta del CSV (UTF-8; separador , ; o tabulador).')
+        parser.add_argument('--sede', type=int, default=None,
+                            help='Rechazar filas de contratos de otras sedes.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Valida y calcula la distribución sin guardar.')
+        parser.add_argument('--json', action='store_true',
+                            help='Imprime el reporte por fila en JSON.')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['archivo'], encoding='utf-8-sig') as fh:
+                texto = fh.read()
+        except OSError as exc:
+            raise CommandError(f'No se pudo leer el archivo: {exc}')
+
+        reporte = importar_pagos(leer_csv(texto), sede_id=options['sede'], dry_run=options['dry_run'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(reporte, ensure_ascii=False, indent=2))
+            return
+
+        for r in reporte:
+            if r['ok']:
+                detalle = ', '.join(f"#{d['numero']}: {d['aplicado']}" for d in r['distribucion'])
+                self.stdout.write(f"Fila {r['fila']}: OK contrato {r['contrato_id']} ({detalle})")
+            else:
+                self.stdout.write(self.style.WARNING(f"Fila {r['fila']}: {r['error']}"))
+
+        aplicadas = sum(1 for r in reporte if r['ok'])
+        sufijo = ' (dry-run, sin guardar)' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{aplicadas} de {len(reporte)} fila(s) aplicada(s){sufijo}.'
+        ))
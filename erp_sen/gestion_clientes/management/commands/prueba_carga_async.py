@@ -0,0 +1,168 @@
+import asyncio
+import io
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+from importlib import import_module
+
+from gestion_clientes.models import Cuota
+from gestion_clientes.perfil import latencia_sql, percentiles
+
+# Rutas comparadas: (WSGI: vista sync actual, ASGI: vista de vistas_async.py)
+ENDPOINTS = {
+    'historial': ('aplicar_pago', 'historial_pago_async'),
+    'lote': ('historial_pagos_lote', 'historial_pagos_lote_async'),
+}
+
+
+class Command(BaseCommand):
+    help = ('Prueba de carga local, en un solo proceso, de los endpoints JSON de historial: '
+            'WSGI (vistas sync; un hilo por worker, como Passenger) contra ASGI (vistas async; '
+            'N peticiones concurrentes en el event loop). Usa los handlers reales de Django, sin '
+            'servidor HTTP. --latencia-ms simula la ida y vuelta a MySQL en cada consulta.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='historial')
+        parser.add_argument('--peticiones', type=int, default=200,
+                            help='Peticiones por camino (default 200).')
+        parser.add_argument('--concurrencia', type=int, default=20,
+                            help='Peticiones simultáneas en el camino ASGI (default 20).')
+        parser.add_argument('--hilos-wsgi', type=int, default=1,
+                            help='Hilos del worker WSGI (default 1, como Passenger).')
+        parser.add_argument('--latencia-ms', type=float, default=5.0,
+                            help='Espera agregada a cada consulta SQL (default 5; 0 = sin simular).')
+        parser.add_argument('--semilla', type=int, default=1)
+        parser.add_argument('--salida', default=None, help='Archivo donde guardar el JSON.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['semilla'])
+        total = max(1, options['peticiones'])
+        cuota_ids = list(Cuota.objects.order_by('id').values_list('id', flat=True)[:5000])
+        if not cuota_ids:
+            raise CommandError('No hay cuotas: genere datos con "manage.py generar_datos".')
+
+        nombre_wsgi, nombre_asgi = ENDPOINTS[options['endpoint']]
+        consultas = []
+        for _ in range(total):
+            if options['endpoint'] == 'lote':
+                consultas.append('ids=' + ','.join(str(i) for i in rng.sample(cuota_ids, min(50, len(cuota_ids)))))
+            else:
+                consultas.append(f'cuota_id={rng.choice(cuota_ids)}')
+
+        sesion = self._sesion()
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={sesion.session_key}'.encode()
+        self.host = next((h for h in settings.ALLOWED_HOSTS if h not in ('*', '') and not h.startswith('.')), 'localhost')
+
+        latencia = options['latencia_ms'] / 1000
+        try:
+            with latencia_sql(latencia):
+                wsgi = self._wsgi(reverse(nombre_wsgi), consultas, max(1, options['hilos_wsgi']))
+                asgi = asyncio.run(self._asgi(reverse(nombre_asgi), consultas, max(1, options['concurrencia'])))
+        finally:
+            sesion.delete()
+
+        resultados = {
+            'endpoint': options['endpoint'],
+            'peticiones': total,
+            'latencia_sql_ms': options['latencia_ms'],
+            'wsgi': wsgi,
+            'asgi': asgi,
+            'asgi_vs_wsgi': round(asgi['por_segundo'] / wsgi['por_segundo'], 2) if wsgi['por_segundo'] else None,
+        }
+        salida = json.dumps(resultados, ensure_ascii=False, indent=2)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as fh:
+                fh.write(salida)
+        self.stdout.write(salida)
+
+    # ------------------------------------------------------------------ #
+
+    def _sesion(self):
+        """Sesión autenticada (como Client.force_login) para enviar en la cookie."""
+        usuario, creado = get_user_model().objects.get_or_create(username='prueba_carga')
+        if creado:
+            usuario.set_unusable_password()
+            usuario.save()
+        sesion = import_module(settings.SESSION_ENGINE).SessionStore()
+        sesion[SESSION_KEY] = str(usuario.pk)
+        sesion[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        sesion[HASH_SESSION_KEY] = usuario.get_session_auth_hash()
+        sesion.create()
+        return sesion
+
+    def _wsgi(self, ruta, consultas, hilos):
+        app = get_wsgi_application()
+
+        def una(consulta):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': ruta, 'QUERY_STRING': consulta,
+                'SERVER_NAME': self.host, 'SERVER_PORT': '443', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': self.host, 'HTTP_COOKIE': self.cookie.decode(),
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(), 'wsgi.url_scheme': 'https',
+                'wsgi.version': (1, 0), 'wsgi.multithread': hilos > 1, 'wsgi.multiprocess': True,
+                'wsgi.run_once': False,
+            }
+            estado = []
+            inicio = time.perf_counter()
+            respuesta = app(environ, lambda status, headers, exc_info=None: estado.append(status))
+            b''.join(respuesta)
+            respuesta.close()
+            return time.perf_counter() - inicio, int(estado[0].split()[0])
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=hilos) as pool:
+            muestras = list(pool.map(una, consultas))
+        return _resumen(muestras, time.perf_counter() - inicio, concurrencia=hilos)
+
+    async def _asgi(self, ruta, consultas, concurrencia):
+        app = get_asgi_application()
+        limite = asyncio.Semaphore(concurrencia)
+
+        async def una(consulta):
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'https', 'path': ruta, 'raw_path': ruta.encode(), 'root_path': '',
+                'query_string': consulta.encode(), 'server': (self.host, 443), 'client': ('127.0.0.1', 0),
+                'headers': [(b'host', self.host.encode()), (b'cookie', self.cookie)],
+            }
+            estado = []
+            cuerpo_enviado = asyncio.Event()
+
+            async def recibir():
+                # Primero el cuerpo (vacío); después, como un cliente que sigue conectado,
+                # no hay más mensajes (Django cancela esta espera al terminar la respuesta).
+                if cuerpo_enviado.is_set():
+                    await asyncio.Event().wait()
+                cuerpo_enviado.set()
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def enviar(mensaje):
+                if mensaje['type'] == 'http.response.start':
+                    estado.append(mensaje['status'])
+
+            async with limite:
+                inicio = time.perf_counter()
+                await app(scope, recibir, enviar)
+                return time.perf_counter() - inicio, estado[0]
+
+        inicio = time.perf_counter()
+        muestras = await asyncio.gather(*(una(c) for c in consultas))
+        return _resumen(muestras, time.perf_counter() - inicio, concurrencia=concurrencia)
+
+
+def _resumen(muestras, segundos, concurrencia):
+    return {
+        'concurrencia': concurrencia,
+        'segundos': round(segundos, 3),
+        'por_segundo': round(len(muestras) / segundos, 1) if segundos else None,
+        **percentiles([t for t, _ in muestras]),
+        'errores': sum(1 for _, estado in muestras if estado != 200),
+    }
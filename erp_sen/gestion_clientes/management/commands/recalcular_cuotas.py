@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from gestion_clientes import cache_cxc
+from gestion_clientes.cartera import reconstruir_cartera
+from gestion_clientes.models import Cuota
+from gestion_clientes.services import bloquear_contratos, recalcular_contratos, refrescar_cuotas
+
+
+class Command(BaseCommand):
+    help = ('Recalcula desde los pagos el snapshot de cada cuota (total pagado, estado y último pago) '
+            'y los agregados de sus contratos')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Cuotas por lote (default 1000).')
+        parser.add_argument('--contrato', type=int, default=None,
+                            help='Limitar a un contrato.')
+
+    def handle(self, *args, **options):
+        hoy = timezone.now().date()
+        batch_size = max(1, options['batch_size'])
+
+        qs = Cuota.objects.order_by('id')
+        if options['contrato']:
+            qs = qs.filter(contrato_id=options['contrato'])
+
+        procesadas = 0
+        ultimo_id = 0
+        while True:
+            with transaction.atomic():
+                claves = list(qs.filter(id__gt=ultimo_id).values_list('id', 'contrato_id')[:batch_size])
+                if not claves:
+                    break
+                # Mismo punto de bloqueo que las vistas de pago: los contratos del lote
+                bloquear_contratos({contrato_id for _, contrato_id in claves}, esperar=True)
+                lote = list(Cuota.objects.filter(id__in=[i for i, _ in claves]).order_by('id'))
+                refrescar_cuotas(lote, hoy=hoy)
+                recalcular_contratos({c.contrato_id for c in lote})
+            procesadas += len(lote)
+            ultimo_id = lote[-1].id
+
+        reconstruir_cartera(hoy=hoy)
+        cache_cxc.invalidar_todo()
+        self.stdout.write(self.style.SUCCESS(
+            f'{procesadas} cuota(s) recalculada(s).'
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gestion_clientes.busqueda import indexar_contratos, indexar_cuotas
+from gestion_clientes.models import Contrato, Cuota
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda del listado CxC (TerminoBusqueda)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Contratos por lote (default 500).')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        procesados = 0
+        ultimo_id = 0
+        while True:
+            ids = list(
+                Contrato.objects.filter(id__gt=ultimo_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                indexar_contratos(ids)
+                indexar_cuotas(Cuota.objects.filter(contrato_id__in=ids).values_list('id', flat=True))
+            procesados += len(ids)
+            ultimo_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{procesados} contrato(s) indexado(s).'
+        ))
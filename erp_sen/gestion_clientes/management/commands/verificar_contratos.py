@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gestion_clientes.models import Contrato
+from gestion_clientes.services import CAMPOS_AGREGADOS_CONTRATO, calcular_agregados_contratos
+
+
+class Command(BaseCommand):
+    help = ('Verifica los agregados guardados en Contrato (total_pagado, saldo, cuotas_vencidas, '
+            'proximo_vencimiento) contra cuotas y pagos; con --reparar los corrige')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reparar', action='store_true',
+                            help='Guarda los valores recalculados de los contratos con diferencias.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Contratos por lote (default 500).')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        revisados = 0
+        diferencias = 0
+        ultimo_id = 0
+        while True:
+            with transaction.atomic():
+                qs = Contrato.objects.filter(id__gt=ultimo_id).order_by('id')
+                if options['reparar']:
+                    qs = qs.select_for_update()
+                lote = list(qs[:batch_size])
+                if not lote:
+                    break
+                guardados = {c.id: tuple(getattr(c, f) for f in CAMPOS_AGREGADOS_CONTRATO) for c in lote}
+                cambiados = calcular_agregados_contratos(lote)
+                for c in cambiados:
+                    antes = dict(zip(CAMPOS_AGREGADOS_CONTRATO, guardados[c.id]))
+                    despues = {f: getattr(c, f) for f in CAMPOS_AGREGADOS_CONTRATO}
+                    self.stdout.write(f'Contrato {c.id}: guardado {antes} -> calculado {despues}')
+                if cambiados and options['reparar']:
+                    Contrato.objects.bulk_update(cambiados, CAMPOS_AGREGADOS_CONTRATO)
+            revisados += len(lote)
+            diferencias += len(cambiados)
+            ultimo_id = lote[-1].id
+
+        accion = 'corregido(s)' if options['reparar'] else 'con diferencias'
+        self.stdout.write(self.style.SUCCESS(
+            f'{revisados} contrato(s) revisado(s); {diferencias} {accion}.'
+        ))
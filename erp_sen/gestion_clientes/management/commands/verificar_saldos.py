@@ -0,0 +1,132 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from gestion_clientes import cache_cxc
+from gestion_clientes.integridad import reparar_contratos, revisar_rango
+from gestion_clientes.models import Contrato
+from gestion_clientes.services import ContratoOcupado
+
+
+class Command(BaseCommand):
+    help = ('Verifica en paralelo el snapshot de cada cuota (valor_pagado, estado y último pago) y los '
+            'agregados de cada contrato contra la tabla Pago. Reparte los contratos en rangos de ids '
+            'entre varios procesos; cada rango se revisa con unas pocas consultas agrupadas. Con '
+            '--reparar, al terminar corrige los contratos con diferencias (bulk_update, por lotes y '
+            'con el bloqueo de las vistas de pago). Emite un reporte JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reparar', action='store_true',
+                            help='Recalcula y guarda los contratos con diferencias.')
+        parser.add_argument('--procesos', type=int, default=min(4, os.cpu_count() or 1),
+                            help='Procesos en paralelo (default min(4, CPUs); 1 = sin pool).')
+        parser.add_argument('--tamano', type=int, default=500,
+                            help='Contratos por rango (default 500).')
+        parser.add_argument('--detalle', type=int, default=100,
+                            help='Máximo de diferencias detalladas en el reporte (default 100).')
+        parser.add_argument('--salida', default=None, help='Archivo donde guardar el JSON.')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        hoy = timezone.now().date()
+        tamano = max(1, options['tamano'])
+        procesos = max(1, options['procesos'])
+        limite = max(0, options['detalle'])
+
+        ids = list(Contrato.objects.order_by('id').values_list('id', flat=True))
+        rangos = [(ids[i], ids[min(i + tamano, len(ids)) - 1]) for i in range(0, len(ids), tamano)]
+        argumentos = [(desde, hasta, hoy, limite) for desde, hasta in rangos]
+
+        resultados = []
+        if procesos == 1 or len(rangos) <= 1:
+            resultados = [self._uno(revisar_rango, *a) for a in argumentos]
+        else:
+            # Procesos nuevos (spawn, no fork: no heredan las conexiones abiertas del padre).
+            # El inicializador es django.setup directamente: cualquier función de este módulo
+            # importaría los modelos en el hijo antes de cargar las apps.
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=django.setup) as pool:
+                futuros = {pool.submit(revisar_rango, *a): a for a in argumentos}
+                for futuro in as_completed(futuros):
+                    desde, hasta = futuros[futuro][:2]
+                    try:
+                        resultados.append(futuro.result())
+                    except Exception as e:  # un rango con error no detiene los demás
+                        resultados.append({'desde_id': desde, 'hasta_id': hasta, 'error': repr(e)[:300]})
+        resultados.sort(key=lambda r: r['desde_id'])
+
+        # La revisión es de solo lectura y va en paralelo; la reparación (pocas filas, con
+        # bloqueos) va aquí, en un solo proceso, para no competir por los mismos bloqueos.
+        reparados = 0
+        errores = []
+        if options['reparar']:
+            afectados = sorted(i for r in resultados for i in r.get('afectados', []))
+            for i in range(0, len(afectados), tamano):
+                lote = afectados[i:i + tamano]
+                try:
+                    reparados += reparar_contratos(lote, hoy=hoy)
+                except ContratoOcupado as e:
+                    errores.append({'desde_id': lote[0], 'hasta_id': lote[-1],
+                                    'error': f'Contratos ocupados, sin reparar: {e}'[:300]})
+            if reparados:
+                cache_cxc.invalidar_todo()
+
+        reporte = self._reporte(resultados, hoy, procesos, time.perf_counter() - inicio, limite)
+        reporte['errores'] += errores
+        reporte['reparar'] = options['reparar']
+        reporte['reparados'] = reparados
+
+        salida = json.dumps(reporte, ensure_ascii=False, indent=2)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as fh:
+                fh.write(salida)
+        self.stdout.write(salida)
+        pendientes = reporte['contratos_afectados'] - reporte['reparados']
+        if pendientes:
+            self.stderr.write(self.style.WARNING(f'{pendientes} contrato(s) con diferencias sin reparar.'))
+
+    @staticmethod
+    def _uno(funcion, desde, hasta, *args):
+        try:
+            return funcion(desde, hasta, *args)
+        except Exception as e:
+            return {'desde_id': desde, 'hasta_id': hasta, 'error': repr(e)[:300]}
+
+    @staticmethod
+    def _reporte(resultados, hoy, procesos, segundos, limite):
+        totales = {'contratos': 0, 'cuotas': 0, 'cuotas_con_diferencias': 0,
+                   'contratos_con_diferencias': 0}
+        afectados = 0
+        por_campo = {}
+        detalle = []
+        errores = []
+        for r in resultados:
+            if 'error' in r:
+                errores.append({'desde_id': r['desde_id'], 'hasta_id': r['hasta_id'], 'error': r['error']})
+            for clave in totales:
+                totales[clave] += r.get(clave, 0)
+            afectados += len(r.get('afectados', []))
+            for campo, n in r.get('por_campo', {}).items():
+                por_campo[campo] = por_campo.get(campo, 0) + n
+            detalle.extend(r.get('detalle', [])[:max(0, limite - len(detalle))])
+        return {
+            'fecha': timezone.now().isoformat(),
+            'hoy': hoy.isoformat(),
+            'motor': connections['default'].vendor,
+            'procesos': procesos,
+            'rangos': len(resultados),
+            'segundos': round(segundos, 3),
+            **totales,
+            'contratos_afectados': afectados,
+            'por_campo': dict(sorted(por_campo.items())),
+            'detalle': detalle,
+            'errores': errores,
+        }
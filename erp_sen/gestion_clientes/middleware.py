@@ -0,0 +1,76 @@
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('gestion_clientes.consultas')
+
+
+class PerfilConsultas:
+    """Consultas SQL de una petición: cantidad, tiempo total, la más lenta y las repetidas."""
+
+    def __init__(self):
+        self.total = 0
+        self.tiempo = 0.0
+        self.mas_lenta = ('', 0.0)
+        self.sentencias = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.total += 1
+            self.tiempo += duracion
+            self.sentencias[sql] += 1  # el SQL llega sin parámetros: misma forma = misma sentencia
+            if duracion > self.mas_lenta[1]:
+                self.mas_lenta = (sql, duracion)
+
+    @property
+    def repetidas(self):
+        """{sql: veces} de las sentencias ejecutadas más de una vez (posible N+1)."""
+        return {sql: n for sql, n in self.sentencias.items() if n > 1}
+
+
+class PerfilConsultasMiddleware:
+    """
+    Mide las consultas SQL de cada petición con connection.execute_wrapper.
+    Se activa con PERFIL_CONSULTAS = True. Agrega los encabezados X-Consultas-SQL,
+    X-Tiempo-SQL-ms y X-Consultas-Repetidas, y registra en el logger 'gestion_clientes.consultas'
+    (WARNING si supera PERFIL_CONSULTAS_UMBRAL consultas o hay sentencias repetidas).
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERFIL_CONSULTAS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.umbral = getattr(settings, 'PERFIL_CONSULTAS_UMBRAL', 30)
+
+    def __call__(self, request):
+        perfil = PerfilConsultas()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(perfil))
+            response = self.get_response(request)
+
+        repetidas = perfil.repetidas
+        response['X-Consultas-SQL'] = str(perfil.total)
+        response['X-Tiempo-SQL-ms'] = f'{perfil.tiempo * 1000:.1f}'
+        response['X-Consultas-Repetidas'] = str(sum(repetidas.values()) - len(repetidas))
+
+        nivel = logging.WARNING if perfil.total > self.umbral or repetidas else logging.INFO
+        if logger.isEnabledFor(nivel):
+            sql_lenta, t_lenta = perfil.mas_lenta
+            logger.log(
+                nivel,
+                '%s %s: %d consulta(s), %.1f ms SQL; más lenta %.1f ms: %s%s',
+                request.method, request.path, perfil.total, perfil.tiempo * 1000, t_lenta * 1000,
+                sql_lenta[:300],
+                ''.join(f'\n  x{n}: {sql[:300]}' for sql, n in sorted(repetidas.items(), key=lambda i: -i[1])),
+            )
+        return response
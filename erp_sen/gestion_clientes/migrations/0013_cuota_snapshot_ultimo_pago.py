@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0012_pago_referencia_not_null'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cuota',
+            name='ultimo_pago_factura',
+            field=models.CharField(blank=True, max_length=30, null=True),
+        ),
+        migrations.AddField(
+            model_name='cuota',
+            name='ultimo_pago_fecha',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cuota',
+            name='ultimo_pago_medio',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='cuota',
+            name='ultimo_pago_obs',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cuota',
+            name='ultimo_pago_referencia',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.4
+from datetime import date
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Sum
+
+LOTE = 1000
+
+CAMPOS = [
+    'valor_pagado', 'estado', 'ultimo_pago_fecha', 'ultimo_pago_medio', 'ultimo_pago_obs',
+    'ultimo_pago_factura', 'ultimo_pago_referencia',
+]
+
+
+def forwards(apps, schema_editor):
+    from gestion_clientes.services import estado_por_pagado
+
+    Cuota = apps.get_model('gestion_clientes', 'Cuota')
+    Pago = apps.get_model('gestion_clientes', 'Pago')
+
+    # El listado CxC lee el snapshot guardado en lugar de sumar los pagos por fila: se
+    # recalcula completo (valor_pagado, estado y datos del último pago, fecha desc, id desc)
+    # desde la tabla Pago para que lo que ya estuviera desfasado no aparezca al desplegar.
+    # Las cuotas sin pagos con vencimiento anterior a hoy quedan 'Vencida'.
+    # Por lotes de ids: dos consultas de lectura y un bulk_update cada uno.
+    hoy = date.today()
+    ultimo_id = 0
+    while True:
+        lote = list(Cuota.objects.filter(id__gt=ultimo_id).order_by('id')[:LOTE])
+        if not lote:
+            break
+        ids = [c.id for c in lote]
+        totales = dict(
+            Pago.objects.filter(cuota_id__in=ids)
+            .values('cuota_id').annotate(total=Sum('valor_pagado'))
+            .values_list('cuota_id', 'total')
+        )
+        ultimos = {}
+        for p in Pago.objects.filter(cuota_id__in=ids).order_by('cuota_id', '-fecha_pago', '-id'):
+            ultimos.setdefault(p.cuota_id, p)
+
+        cambiadas = []
+        for c in lote:
+            antes = tuple(getattr(c, campo) for campo in CAMPOS)
+            p = ultimos.get(c.id)
+            c.valor_pagado = totales.get(c.id) or Decimal('0.00')
+            c.estado = estado_por_pagado(c.valor, c.valor_pagado, vencida=c.fecha_vencimiento < hoy)
+            c.ultimo_pago_fecha = p.fecha_pago if p else None
+            c.ultimo_pago_medio = p.forma_pago if p else None
+            c.ultimo_pago_obs = p.observacion if p else None
+            c.ultimo_pago_factura = p.numero_factura if p else None
+            c.ultimo_pago_referencia = p.referencia if p else None
+            if tuple(getattr(c, campo) for campo in CAMPOS) != antes:
+                cambiadas.append(c)
+        if cambiadas:
+            Cuota.objects.bulk_update(cambiadas, CAMPOS)
+        ultimo_id = lote[-1].id
+
+
+def backwards(apps, schema_editor):
+    # Los campos se eliminan al revertir 0013; no hay nada que deshacer aquí.
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0013_cuota_snapshot_ultimo_pago'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, reverse_code=backwards),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0014_backfill_cuota_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerminoBusqueda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('termino', models.CharField(max_length=100)),
+                ('contrato', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terminos_busqueda', to='gestion_clientes.contrato')),
+                ('cuota', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='terminos_busqueda', to='gestion_clientes.cuota')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['termino', 'contrato', 'cuota'], name='termino_busq_idx')],
+            },
+        ),
+    ]
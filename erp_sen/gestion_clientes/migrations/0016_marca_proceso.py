@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0015_termino_busqueda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaProceso',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True)),
+                ('ultima_fecha', models.DateField()),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0016_marca_proceso'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contrato',
+            name='cuotas_vencidas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='contrato',
+            name='proximo_vencimiento',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='contrato',
+            name='saldo',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='contrato',
+            name='total_pagado',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+    ]
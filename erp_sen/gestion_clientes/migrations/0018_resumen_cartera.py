@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0017_contrato_agregados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenCartera',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tramo', models.CharField(choices=[('corriente', 'Corriente'), ('1-30', '1–30 días'), ('31-60', '31–60 días'), ('61-90', '61–90 días'), ('90+', 'Más de 90 días')], max_length=10)),
+                ('num_cuotas', models.IntegerField(default=0)),
+                ('saldo', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('fecha_corte', models.DateField()),
+                ('horario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='gestion_clientes.horario')),
+                ('nivel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gestion_clientes.nivel')),
+                ('sede', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gestion_clientes.sede')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sede', 'nivel', 'horario'], name='resumen_cartera_grupo_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0018_resumen_cartera'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(fields=['estado', 'fecha_vencimiento'], name='cuota_estado_venc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cuota',
+            index=models.Index(fields=['contrato', 'fecha_vencimiento', 'numero'], name='cuota_contrato_venc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['cuota', '-fecha_pago', '-id'], name='pago_cuota_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pago',
+            index=models.Index(fields=['cuota', 'forma_pago'], name='pago_cuota_forma_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0019_indices_cxc'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contrato',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4
+from django.db import migrations
+
+LOTE = 1000
+
+CAMPOS = ['total_pagado', 'saldo', 'cuotas_vencidas', 'proximo_vencimiento']
+
+
+def forwards(apps, schema_editor):
+    from gestion_clientes.services import calcular_agregados_contratos
+
+    Contrato = apps.get_model('gestion_clientes', 'Contrato')
+
+    # 0017 agregó los campos con 0/NULL: sin esto todo contrato se lee con saldo 0 hasta
+    # correr verificar_contratos --reparar. Por lotes de ids, dos consultas agrupadas cada uno.
+    ultimo_id = 0
+    while True:
+        lote = list(Contrato.objects.filter(id__gt=ultimo_id).order_by('id')[:LOTE])
+        if not lote:
+            break
+        cambiados = calcular_agregados_contratos(lote)
+        if cambiados:
+            Contrato.objects.bulk_update(cambiados, CAMPOS)
+        ultimo_id = lote[-1].id
+
+
+def backwards(apps, schema_editor):
+    # Los campos se eliminan al revertir 0017; no hay nada que deshacer aquí.
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0020_version_contrato'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, reverse_code=backwards),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion_clientes', '0021_backfill_contrato_agregados'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='estudiante',
+            index=models.Index(fields=['nombre_completo'], name='estudiante_nombre_idx'),
+        ),
+    ]
@@ -74,6 +74,12 @@ class Estudiante(models.Model):
     observacion = models.TextField(blank=True, null=True)
     horario = models.ForeignKey(Horario, on_delete=models.PROTECT, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Búsqueda por prefijo del nombre (busqueda.filtrar_estudiantes)
+            models.Index(fields=['nombre_completo'], name='estudiante_nombre_idx'),
+        ]
+
     def __str__(self):
         return f"{self.nombre_completo} ({self.tipo_documento} {self.documento})" if self.documento else self.nombre_completo
 
@@ -90,7 +96,18 @@ class Contrato(models.Model):
         ('Activo', 'Activo'), ('Finalizado', 'Finalizado')
     ])
 
+    # Agregados mantenidos por los procesos de pago (services.recalcular_contratos)
+    total_pagado = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    saldo = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cuotas_vencidas = models.IntegerField(default=0)
+    proximo_vencimiento = models.DateField(null=True, blank=True)  # primera cuota con saldo
+
+    # Punto único de bloqueo de pagos (services.bloquear_contratos); sube con cada cambio de
+    # pagos del contrato, así el cliente puede detectar que trabaja sobre datos viejos.
+    version = models.PositiveIntegerField(default=0)
+
     def calcular_total_pagado(self):
+        # Cálculo en vivo (para verificar); en listados usar total_pagado
         return sum(p.valor_pagado for p in self.pago_set.all())
 
     def calcular_saldo(self):
@@ -98,7 +115,7 @@ class Contrato(models.Model):
 
     @property
     def en_incumplimiento(self):
-        return self.cuota_set.filter(estado='Vencida').exists()
+        return self.cuotas_vencidas > 0
 
     def __str__(self):
         return f"Contrato #{self.id} de {self.estudiante} - {self.estado}"
@@ -117,9 +134,22 @@ class Cuota(models.Model):
         ('Parcial', 'Parcial'),
     ], default='Pendiente')
 
+    # Snapshot del último pago (lo mantienen aplicar_pago / eliminar_pago; ver services.py)
+    ultimo_pago_fecha = models.DateField(null=True, blank=True)
+    ultimo_pago_medio = models.CharField(max_length=50, blank=True, null=True)
+    ultimo_pago_obs = models.TextField(blank=True, null=True)
+    ultimo_pago_factura = models.CharField(max_length=30, blank=True, null=True)
+    ultimo_pago_referencia = models.CharField(max_length=100, blank=True, null=True)
+
     class Meta:
         unique_together = (('contrato', 'numero'),)
         ordering = ['fecha_vencimiento', 'numero']
+        indexes = [
+            # actualizar_cuotas: estado='Pendiente' AND fecha_vencimiento < hoy
+            models.Index(fields=['estado', 'fecha_vencimiento'], name='cuota_estado_venc_idx'),
+            # cuotas de un contrato en orden de vencimiento (listado CxC, historial, cartera)
+            models.Index(fields=['contrato', 'fecha_vencimiento', 'numero'], name='cuota_contrato_venc_idx'),
+        ]
 
     def calcular_saldo(self):
         return self.valor - self.valor_pagado
@@ -152,6 +182,14 @@ class Pago(models.Model):
 
     numero_factura = models.CharField(max_length=30, blank=True, null=True, db_index=True)
 
+    class Meta:
+        indexes = [
+            # último pago por cuota (refrescar_cuotas) e historial del modal
+            models.Index(fields=['cuota', '-fecha_pago', '-id'], name='pago_cuota_fecha_idx'),
+            # filtro por medio de pago del listado CxC (EXISTS por cuota)
+            models.Index(fields=['cuota', 'forma_pago'], name='pago_cuota_forma_idx'),
+        ]
+
     def clean(self):
         if self.cuota and self.cuota.contrato_id != self.contrato_id:
             from django.core.exceptions import ValidationError
@@ -163,3 +201,62 @@ class Pago(models.Model):
     def __str__(self):
         return f"{self.fecha_pago} - ${self.valor_pagado}"
 
+
+class TerminoBusqueda(models.Model):
+    """
+    Índice de búsqueda del listado CxC: un token normalizado (minúsculas, sin tildes) por fila.
+    - cuota vacía: términos del contrato (nombres y documentos de estudiante y acudiente).
+    - cuota llena: términos de los pagos de esa cuota (factura y referencia).
+    Lo mantienen las señales de signals.py; ver busqueda.py.
+    """
+    contrato = models.ForeignKey(Contrato, on_delete=models.CASCADE, related_name='terminos_busqueda')
+    cuota = models.ForeignKey(Cuota, on_delete=models.CASCADE, null=True, blank=True, related_name='terminos_busqueda')
+    termino = models.CharField(max_length=100)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['termino', 'contrato', 'cuota'], name='termino_busq_idx'),
+        ]
+
+    def __str__(self):
+        return self.termino
+
+
+class MarcaProceso(models.Model):
+    """Última fecha procesada por un proceso periódico (p.ej. actualizar_cuotas) para correr de forma incremental."""
+    nombre = models.CharField(max_length=100, unique=True)
+    ultima_fecha = models.DateField()
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.nombre}: {self.ultima_fecha}"
+
+
+class ResumenCartera(models.Model):
+    """
+    Cartera por edades precalculada: saldo pendiente por (sede, nivel, horario, tramo de mora).
+    La mantienen los procesos de pago y actualizar_cuotas (ver cartera.py); el dashboard solo la lee.
+    """
+    TRAMOS = [
+        ('corriente', 'Corriente'),
+        ('1-30', '1–30 días'),
+        ('31-60', '31–60 días'),
+        ('61-90', '61–90 días'),
+        ('90+', 'Más de 90 días'),
+    ]
+
+    sede = models.ForeignKey(Sede, on_delete=models.CASCADE)
+    nivel = models.ForeignKey(Nivel, on_delete=models.CASCADE)
+    horario = models.ForeignKey(Horario, on_delete=models.CASCADE, null=True, blank=True)
+    tramo = models.CharField(max_length=10, choices=TRAMOS)
+    num_cuotas = models.IntegerField(default=0)
+    saldo = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    fecha_corte = models.DateField()  # fecha con la que se calcularon los días de mora
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sede', 'nivel', 'horario'], name='resumen_cartera_grupo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sede_id}/{self.nivel_id}/{self.horario_id} {self.tramo}: {self.saldo}"
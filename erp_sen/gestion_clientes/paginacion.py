@@ -0,0 +1,114 @@
+import base64
+import binascii
+import json
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Paginación por cursor (keyset / seek): en vez de COUNT(*) + OFFSET, cada página
+# filtra "después de la última fila vista" sobre un orden estable y único, así la
+# página 200 cuesta lo mismo que la página 1.
+
+
+class PaginaKeyset:
+    def __init__(self, object_list, has_next, has_previous, next_cursor, prev_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _a_json(valor):
+    if isinstance(valor, date):
+        return {'d': valor.isoformat()}
+    return valor
+
+
+def _de_json(valor):
+    if isinstance(valor, dict) and 'd' in valor:
+        return date.fromisoformat(valor['d'])
+    return valor
+
+
+def codificar_cursor(direccion, valores):
+    """Cursor opaco: base64 (url-safe) de la dirección ('n'/'p') y los valores de la clave."""
+    crudo = json.dumps({'d': direccion, 'k': [_a_json(v) for v in valores]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, num_campos):
+    """Devuelve (direccion, valores) o (None, None) si el cursor no es válido."""
+    if not cursor:
+        return None, None
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + relleno).decode())
+        direccion = data['d']
+        valores = [_de_json(v) for v in data['k']]
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None, None
+    if direccion not in ('n', 'p') or len(valores) != num_campos:
+        return None, None
+    return direccion, valores
+
+
+def _valor_de(obj, campo):
+    if isinstance(obj, dict):  # filas de .values()
+        return obj[campo]
+    # 'contrato__estudiante__id' -> obj.contrato.estudiante.id (usar select_related)
+    for parte in campo.split('__'):
+        obj = getattr(obj, parte)
+    return obj
+
+
+def _filtro_seek(campos, valores, op):
+    """(a > x) | (a = x & b > y) | (a = x & b = y & c > z) ..."""
+    filtro = Q()
+    for i, campo in enumerate(campos):
+        paso = Q(**{f'{campo}__{op}': valores[i]})
+        for previo, valor in zip(campos[:i], valores[:i]):
+            paso &= Q(**{previo: valor})
+        filtro |= paso
+    return filtro
+
+
+def paginar_keyset(qs, campos, cursor, per_page):
+    """
+    Pagina `qs` por cursor sobre `campos` (todos ascendentes; la tupla debe ser única,
+    p.ej. terminando en 'id'). `cursor` es el valor recibido en la URL (o vacío); si no es
+    válido se entrega la primera página.
+    """
+    direccion, valores = decodificar_cursor(cursor, len(campos))
+    if direccion:
+        # Los tipos de los valores se validan al armar el filtro (get_prep_value de cada campo):
+        # un cursor editado a mano con tipos que no corresponden se trata como inválido.
+        try:
+            qs = qs.filter(_filtro_seek(campos, valores, 'lt' if direccion == 'p' else 'gt'))
+        except (ValueError, TypeError, ValidationError):
+            direccion = None
+
+    if direccion == 'p':
+        # Hacia atrás: orden invertido, luego se voltea la página
+        qs = qs.order_by(*[f'-{c}' for c in campos])
+        filas = list(qs[:per_page + 1])
+        has_previous = len(filas) > per_page
+        filas = filas[:per_page][::-1]
+        has_next = True
+    else:
+        qs = qs.order_by(*campos)
+        filas = list(qs[:per_page + 1])
+        has_next = len(filas) > per_page
+        filas = filas[:per_page]
+        has_previous = direccion == 'n'
+
+    next_cursor = codificar_cursor('n', [_valor_de(filas[-1], c) for c in campos]) if filas and has_next else ''
+    prev_cursor = codificar_cursor('p', [_valor_de(filas[0], c) for c in campos]) if filas and has_previous else ''
+    return PaginaKeyset(filas, has_next, has_previous, next_cursor, prev_cursor)
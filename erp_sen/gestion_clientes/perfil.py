@@ -0,0 +1,83 @@
+import statistics
+import time
+from contextlib import nullcontext
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Herramientas de medición para los comandos de carga (prueba_carga_async, estres_pagos):
+# envolturas de consultas SQL instaladas en todas las conexiones y percentiles de latencia.
+# El perfil por petición de la aplicación está en middleware.py.
+
+
+class envolver_consultas:
+    """
+    Instala `envoltura` (un execute_wrapper de Django) en todas las conexiones mientras dura el
+    bloque, también en las que se abran después en otros hilos. connection.execute_wrapper()
+    solo cubre la conexión del hilo actual.
+    """
+
+    def __init__(self, envoltura):
+        self.envoltura = envoltura
+
+    def _instalar(self, sender=None, connection=None, **kwargs):
+        # connection_created se emite en cada reconexión del mismo objeto (CONN_MAX_AGE=0)
+        if self.envoltura not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.envoltura)
+
+    def __enter__(self):
+        connection_created.connect(self._instalar)
+        for conexion in connections.all(initialized_only=True):
+            self._instalar(connection=conexion)
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(self._instalar)
+        for conexion in connections.all(initialized_only=True):
+            if self.envoltura in conexion.execute_wrappers:
+                conexion.execute_wrappers.remove(self.envoltura)
+
+
+def latencia_sql(segundos):
+    """Agrega `segundos` de espera a cada consulta (simula la ida y vuelta a MySQL); 0 = nada."""
+    if segundos <= 0:
+        return nullcontext()
+
+    def esperar(execute, sql, params, many, context):
+        time.sleep(segundos)
+        return execute(sql, params, many, context)
+
+    return envolver_consultas(esperar)
+
+
+def medir_bloqueos(registrar):
+    """Llama registrar(segundos) con la duración de cada SELECT ... FOR UPDATE (espera del bloqueo)."""
+
+    def medir(execute, sql, params, many, context):
+        if 'FOR UPDATE' not in sql:
+            return execute(sql, params, many, context)
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            registrar(time.perf_counter() - inicio)
+
+    return envolver_consultas(medir)
+
+
+def percentiles(segundos):
+    """{'n', 'ms_p50', 'ms_p95', 'ms_p99', 'ms_max'} de una lista de duraciones en segundos."""
+    if not segundos:
+        return {'n': 0}
+    ms = sorted(s * 1000 for s in segundos)
+
+    def p(q):
+        return round(ms[min(len(ms) - 1, int(round(q * (len(ms) - 1))))], 2)
+
+    return {
+        'n': len(ms),
+        'ms_p50': round(statistics.median(ms), 2),
+        'ms_p95': p(0.95),
+        'ms_p99': p(0.99),
+        'ms_max': round(ms[-1], 2),
+    }
@@ -0,0 +1,239 @@
+from decimal import Decimal
+
+from django.db import OperationalError, transaction
+from django.db.models import Count, F, Min, Q, Sum
+
+from . import cache_cxc
+from .busqueda import indexar_cuotas
+from .cartera import actualizar_cartera_contratos
+from .models import Contrato, Cuota, Pago
+
+CERO = Decimal('0.00')
+
+# Campos de Cuota que resumen sus pagos (snapshot mantenido por las vistas de pago)
+CAMPOS_SNAPSHOT = [
+    'valor_pagado',
+    'estado',
+    'ultimo_pago_fecha',
+    'ultimo_pago_medio',
+    'ultimo_pago_obs',
+    'ultimo_pago_factura',
+    'ultimo_pago_referencia',
+]
+
+# Campos de Contrato que resumen sus cuotas y pagos
+CAMPOS_AGREGADOS_CONTRATO = ['total_pagado', 'saldo', 'cuotas_vencidas', 'proximo_vencimiento']
+
+
+class ContratoOcupado(Exception):
+    """Otra operación tiene bloqueado el contrato; se puede reintentar (las vistas responden 409)."""
+
+
+def bloquear_contratos(contrato_ids, esperar=False):
+    """
+    Punto único de bloqueo para cambiar pagos o el snapshot de cuotas: SELECT ... FOR UPDATE
+    sobre las filas de Contrato, en orden de id (dos operaciones con varios contratos los toman
+    en el mismo orden y no se cruzan). Después del bloqueo las cuotas se leen sin bloquear.
+    - esperar=False: NOWAIT, para las vistas: si otro lo tiene, ContratoOcupado al instante.
+    - esperar=True: espera el bloqueo (procesos en bloque); si vence la espera, ContratoOcupado.
+    Debe llamarse dentro de transaction.atomic(). Retorna {contrato_id: version}.
+    """
+    qs = Contrato.objects.select_for_update(nowait=not esperar).filter(id__in=list(contrato_ids)).order_by('id')
+    try:
+        return dict(qs.values_list('id', 'version'))
+    except OperationalError as e:  # NOWAIT sin bloqueo disponible, espera vencida o deadlock
+        raise ContratoOcupado(str(e)) from e
+
+
+def saldo_de(cuota):
+    return (cuota.valor or CERO) - (cuota.valor_pagado or CERO)
+
+
+def estado_por_pagado(valor, pagado, vencida=False):
+    """Estado de una cuota según lo pagado. Solo marca 'Vencida' si se pide explícitamente."""
+    if pagado >= valor:
+        return 'Pagada'
+    if pagado > 0:
+        return 'Parcial'
+    return 'Vencida' if vencida else 'Pendiente'
+
+
+def _copiar_ultimo_pago(cuota, pago):
+    cuota.ultimo_pago_fecha = pago.fecha_pago if pago else None
+    cuota.ultimo_pago_medio = pago.forma_pago if pago else None
+    cuota.ultimo_pago_obs = pago.observacion if pago else None
+    cuota.ultimo_pago_factura = pago.numero_factura if pago else None
+    cuota.ultimo_pago_referencia = pago.referencia if pago else None
+
+
+def registrar_pago_en_snapshot(cuota, pago):
+    """
+    Suma un pago NUEVO al snapshot de la cuota (en memoria, sin consultas).
+    El pago nuevo tiene el id más alto, así que es el último si su fecha no es anterior.
+    """
+    cuota.valor_pagado = (cuota.valor_pagado or CERO) + pago.valor_pagado
+    cuota.estado = estado_por_pagado(cuota.valor, cuota.valor_pagado)
+    if cuota.ultimo_pago_fecha is None or pago.fecha_pago >= cuota.ultimo_pago_fecha:
+        _copiar_ultimo_pago(cuota, pago)
+
+
+def calcular_snapshot_cuotas(cuotas, hoy=None):
+    """
+    Recalcula en memoria, desde la tabla Pago, el snapshot (CAMPOS_SNAPSHOT) de las cuotas dadas.
+    - hoy: si se envía, las cuotas sin pagos con vencimiento anterior quedan 'Vencida'.
+    Dos consultas de lectura. Retorna las cuotas cuyo snapshot cambió.
+    """
+    cuotas = list(cuotas)
+    if not cuotas:
+        return cuotas
+    ids = [c.id for c in cuotas]
+
+    totales = dict(
+        Pago.objects
+        .filter(cuota_id__in=ids)
+        .values('cuota_id')
+        .annotate(total=Sum('valor_pagado'))
+        .values_list('cuota_id', 'total')
+    )
+    ultimos = {}
+    pagos = (
+        Pago.objects
+        .filter(cuota_id__in=ids)
+        .order_by('cuota_id', '-fecha_pago', '-id')
+        .only('cuota_id', 'fecha_pago', 'forma_pago', 'observacion', 'numero_factura', 'referencia')
+    )
+    for p in pagos:
+        ultimos.setdefault(p.cuota_id, p)
+
+    cambiadas = []
+    for c in cuotas:
+        antes = tuple(getattr(c, campo) for campo in CAMPOS_SNAPSHOT)
+        c.valor_pagado = totales.get(c.id) or CERO
+        vencida = bool(hoy and c.fecha_vencimiento < hoy)
+        c.estado = estado_por_pagado(c.valor, c.valor_pagado, vencida=vencida)
+        _copiar_ultimo_pago(c, ultimos.get(c.id))
+        if tuple(getattr(c, campo) for campo in CAMPOS_SNAPSHOT) != antes:
+            cambiadas.append(c)
+    return cambiadas
+
+
+def refrescar_cuotas(cuotas, hoy=None):
+    """
+    Recalcula desde la tabla Pago el snapshot de las cuotas dadas (instancias) y lo guarda.
+    - hoy: si se envía, las cuotas sin pagos con vencimiento anterior quedan 'Vencida'.
+      Toda escritura fuera de actualizar_cuotas debe enviarlo: la corrida incremental solo
+      revisa vencimientos desde su última fecha, y una cuota vencida que quede 'Pendiente'
+      no se vuelve a marcar hasta un --completo.
+    Usa dos consultas de lectura y un bulk_update, sin importar cuántas cuotas sean.
+    """
+    cuotas = list(cuotas)
+    if not cuotas:
+        return cuotas
+    calcular_snapshot_cuotas(cuotas, hoy=hoy)
+    Cuota.objects.bulk_update(cuotas, CAMPOS_SNAPSHOT)
+    return cuotas
+
+
+def recalcular_cuotas(cuota_ids, hoy=None):
+    """Igual que refrescar_cuotas pero a partir de ids."""
+    return refrescar_cuotas(Cuota.objects.filter(id__in=list(cuota_ids)), hoy=hoy)
+
+
+def preparar_pagos(cuotas, monto, **datos):
+    """
+    Reparte `monto` sobre `cuotas` en el orden dado (más antiguas primero) hasta el saldo
+    de cada una, igual que modo=auto. Solo en memoria: retorna los Pago sin guardar y deja
+    actualizado el snapshot de las cuotas tocadas. `datos`: fecha_pago, forma_pago, referencia, ...
+    """
+    pagos = []
+    for c in cuotas:
+        if monto <= 0:
+            break
+        aplicar = min(monto, saldo_de(c))
+        if aplicar <= 0:
+            continue
+        pago = Pago(contrato_id=c.contrato_id, cuota=c, valor_pagado=aplicar, **datos)
+        registrar_pago_en_snapshot(c, pago)
+        pagos.append(pago)
+        monto -= aplicar
+    return pagos
+
+
+def guardar_pagos(pagos):
+    """Persiste pagos preparados: un bulk_create de Pago y un bulk_update de sus cuotas."""
+    if not pagos:
+        return
+    Pago.objects.bulk_create(pagos)
+    cuotas = list({p.cuota.id: p.cuota for p in pagos}.values())
+    Cuota.objects.bulk_update(cuotas, CAMPOS_SNAPSHOT)
+    # bulk_create no dispara señales; el índice de búsqueda se rehace al confirmar, fuera del bloqueo
+    cuota_ids = [c.id for c in cuotas]
+    transaction.on_commit(lambda: indexar_cuotas(cuota_ids))
+    sincronizar_contratos({p.contrato_id for p in pagos})
+
+
+def sincronizar_contratos(contrato_ids):
+    """
+    Mantiene lo que depende de los pagos de estos contratos. Dentro de la transacción (con el
+    contrato bloqueado) solo version y agregados de Contrato: una lectura de los contratos, dos
+    consultas agrupadas y un bulk_update. Cartera por edades y versión del listado CxC en
+    cache, al confirmar.
+    """
+    contrato_ids = set(contrato_ids)
+    contratos = list(Contrato.objects.filter(id__in=contrato_ids))
+    calcular_agregados_contratos(contratos)
+    for c in contratos:
+        c.version = F('version') + 1
+    if contratos:
+        Contrato.objects.bulk_update(contratos, CAMPOS_AGREGADOS_CONTRATO + ['version'])
+    cache_cxc.invalidar_contratos(contrato_ids)
+    transaction.on_commit(lambda: actualizar_cartera_contratos(contrato_ids))
+
+
+def calcular_agregados_contratos(contratos):
+    """
+    Calcula en memoria total_pagado, saldo, cuotas_vencidas y proximo_vencimiento de los
+    contratos dados con dos consultas agrupadas. Retorna los contratos cuyo valor cambió.
+    """
+    contratos = list(contratos)
+    ids = [c.id for c in contratos]
+    pagado = dict(
+        Pago.objects
+        .filter(contrato_id__in=ids)
+        .values('contrato_id')
+        .annotate(total=Sum('valor_pagado'))
+        .values_list('contrato_id', 'total')
+    )
+    por_cuotas = {
+        fila['contrato_id']: fila
+        for fila in (
+            Cuota.objects
+            .filter(contrato_id__in=ids)
+            .values('contrato_id')
+            .annotate(
+                vencidas=Count('id', filter=Q(estado='Vencida')),
+                proximo=Min('fecha_vencimiento', filter=Q(valor_pagado__lt=F('valor'))),
+            )
+        )
+    }
+
+    cambiados = []
+    for c in contratos:
+        antes = tuple(getattr(c, campo) for campo in CAMPOS_AGREGADOS_CONTRATO)
+        fila = por_cuotas.get(c.id, {})
+        c.total_pagado = pagado.get(c.id) or CERO
+        c.saldo = c.valor_total - c.total_pagado
+        c.cuotas_vencidas = fila.get('vencidas') or 0
+        c.proximo_vencimiento = fila.get('proximo')
+        if tuple(getattr(c, campo) for campo in CAMPOS_AGREGADOS_CONTRATO) != antes:
+            cambiados.append(c)
+    return cambiados
+
+
+def recalcular_contratos(contrato_ids):
+    """Recalcula y guarda los agregados de los contratos dados (solo escribe los que cambiaron)."""
+    contratos = Contrato.objects.filter(id__in=list(contrato_ids))
+    cambiados = calcular_agregados_contratos(contratos)
+    if cambiados:
+        Contrato.objects.bulk_update(cambiados, CAMPOS_AGREGADOS_CONTRATO)
+    return cambiados
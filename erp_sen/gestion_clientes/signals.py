@@ -0,0 +1,114 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import cache_cxc, catalogos
+from .busqueda import indexar_contratos, indexar_cuotas
+from .models import Acudiente, Contrato, Cuota, Estudiante, Horario, Nivel, Pago, Sede
+from .services import sincronizar_contratos
+
+
+# --------- Índice de búsqueda CxC (TerminoBusqueda) ---------
+# Las escrituras masivas (bulk_create/update) no disparan señales: deben llamar
+# directamente a busqueda.indexar_contratos / indexar_cuotas.
+
+@receiver(post_save, sender=Contrato)
+def indexar_contrato(sender, instance, raw=False, **kwargs):
+    if not raw:
+        indexar_contratos([instance.id])
+
+
+@receiver(post_save, sender=Estudiante)
+def indexar_estudiante(sender, instance, raw=False, **kwargs):
+    if not raw:
+        indexar_contratos(Contrato.objects.filter(estudiante_id=instance.id).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Acudiente)
+def indexar_acudiente(sender, instance, raw=False, **kwargs):
+    if not raw:
+        indexar_contratos(
+            Contrato.objects.filter(estudiante__acudiente_id=instance.id).values_list('id', flat=True)
+        )
+
+
+@receiver(pre_save, sender=Pago)
+def recordar_cuota_pago(sender, instance, raw=False, **kwargs):
+    # Un pago movido a otra cuota (admin, shell) deja términos en la anterior: se reindexan ambas
+    if not raw and instance.pk:
+        instance._cuota_anterior_id = (
+            Pago.objects.filter(pk=instance.pk).values_list('cuota_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Pago)
+def indexar_pago(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cuota_ids = {instance.cuota_id, getattr(instance, '_cuota_anterior_id', None)} - {None}
+        if cuota_ids:
+            indexar_cuotas(cuota_ids)
+
+
+@receiver(post_delete, sender=Pago)
+def desindexar_pago(sender, instance, **kwargs):
+    # Al confirmar: si el borrado viene en cascada desde la cuota, no reinsertar términos
+    # que bloquearían su eliminación (indexar_cuotas ignora cuotas que ya no existen).
+    if instance.cuota_id:
+        cuota_id = instance.cuota_id
+        transaction.on_commit(lambda: indexar_cuotas([cuota_id]))
+
+
+# --------- Catálogos en cache (Nivel, Horario, Sede) ---------
+
+@receiver(post_save, sender=Nivel)
+@receiver(post_delete, sender=Nivel)
+@receiver(post_save, sender=Horario)
+@receiver(post_delete, sender=Horario)
+@receiver(post_save, sender=Sede)
+@receiver(post_delete, sender=Sede)
+def invalidar_catalogo(sender, **kwargs):
+    # Ahora y al confirmar: evita que otra petición vuelva a llenar la cache con
+    # los datos anteriores mientras la transacción sigue abierta.
+    catalogos.invalidar(sender)
+    transaction.on_commit(lambda: catalogos.invalidar(sender))
+    cache_cxc.invalidar_todo()  # los nombres salen en cada fila del listado CxC
+
+
+# --------- Listado CxC en cache (ver cache_cxc.py) ---------
+# Las vistas de pago e importación suben la versión en services.sincronizar_contratos;
+# estas señales cubren ediciones sueltas (admin, shell).
+
+@receiver(post_save, sender=Pago)
+@receiver(post_delete, sender=Pago)
+def invalidar_cxc_pago(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cache_cxc.invalidar_contratos([instance.contrato_id])
+
+
+@receiver(post_save, sender=Cuota)
+@receiver(post_delete, sender=Cuota)
+def invalidar_cxc_cuota(sender, instance, raw=False, **kwargs):
+    if not raw:
+        cache_cxc.invalidar_contratos([instance.contrato_id])
+
+
+# --------- Agregados de Contrato (saldo, total_pagado, ...) ---------
+# Los procesos de pago los mantienen en services.sincronizar_contratos; al crear un contrato
+# o editar sus términos (valor_total) en el admin o el shell, saldo = valor_total - pagado
+# cambia sin pasar por ellos. bulk_create/bulk_update no disparan esta señal.
+
+@receiver(post_save, sender=Contrato)
+def sincronizar_contrato(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sincronizar_contratos([instance.id])
+
+
+@receiver(post_save, sender=Contrato)
+@receiver(post_delete, sender=Contrato)
+@receiver(post_save, sender=Estudiante)
+@receiver(post_delete, sender=Estudiante)
+@receiver(post_save, sender=Acudiente)
+def invalidar_cxc(sender, raw=False, **kwargs):
+    # Pueden cambiar de sede o de nombre: se invalidan todas las páginas
+    if not raw:
+        cache_cxc.invalidar_todo()
@@ -1,3 +1,1055 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Sum
+from django.test import Client, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .cartera import reconstruir_cartera, tablero_cartera
+from .cronogramas import crear_contratos, generar_cuotas, regenerar_cuotas, sumar_meses, valores_cuotas
+from .importacion import _parse_valor, importar_pagos, leer_csv
+from .integridad import contratos_descuadrados, diferencias_cuotas, referencias_repetidas
+from .models import (
+    Acudiente, Contrato, Cuota, Estudiante, Horario, MarcaProceso, Nivel, Pago, Sede, TerminoBusqueda,
+)
+from .paginacion import codificar_cursor
+from .services import ContratoOcupado, bloquear_contratos, guardar_pagos, preparar_pagos
+
+
+def crear_datos(estudiantes=20, cuotas=6, sedes=2):
+    """Sedes, estudiantes con acudiente y un contrato cada uno con sus cuotas; la primera cuota pagada."""
+    hoy = date.today()
+    sedes = [Sede.objects.create(nombre=f'Sede {i}', ciudad='Cali', direccion='Calle 1') for i in range(sedes)]
+    nivel = Nivel.objects.create(codigo='A1', nombre='Básico A1')
+    horario = Horario.objects.create(hora='08:00', descripcion='8:00 am')
+    contratos = []
+    for i in range(estudiantes):
+        acudiente = Acudiente.objects.create(
+            nombre_completo=f'Acudiente {i}', tipo_documento='CC', documento=f'A{i}',
+            telefono='3000000000', email=f'acudiente{i}@example.com',
+        )
+        estudiante = Estudiante.objects.create(
+            nombre_completo=f'Estudiante {i}', documento=f'E{i}', fecha_nacimiento=date(2010, 1, 1),
+            nivel=nivel, horario=horario, acudiente=acudiente, sede=sedes[i % len(sedes)],
+        )
+        contrato = Contrato.objects.create(
+            estudiante=estudiante, acudiente=acudiente, fecha_inicio=hoy - timedelta(days=90),
+            valor_total=Decimal('100000') * cuotas, valor_cuota_pactada=Decimal('100000'),
+            numero_cuotas=cuotas, estado='Activo',
+        )
+        Cuota.objects.bulk_create([
+            Cuota(contrato=contrato, numero=n + 1, valor=Decimal('100000'),
+                  fecha_vencimiento=hoy - timedelta(days=60) + timedelta(days=30 * n))
+            for n in range(cuotas)
+        ])
+        contratos.append(contrato)
+    for contrato in contratos:
+        primera = list(contrato.cuota_set.order_by('numero')[:1])
+        guardar_pagos(preparar_pagos(
+            primera, Decimal('100000'), fecha_pago=hoy - timedelta(days=55),
+            forma_pago='Nequi', referencia=f'R-{contrato.id}',
+        ))
+    return contratos
+
+
+class PresupuestoConsultasMixin:
+    """Presupuesto de consultas: falla si el bloque ejecuta más de `maximo` consultas SQL."""
+
+    @contextmanager
+    def assertMaxConsultas(self, maximo):
+        with CaptureQueriesContext(connection) as ctx:
+            yield ctx
+        if len(ctx) > maximo:
+            detalle = '\n'.join(q['sql'] for q in ctx.captured_queries)
+            self.fail(f'{len(ctx)} consultas (presupuesto {maximo}):\n{detalle}')
+
+
+class PresupuestoVistasTests(PresupuestoConsultasMixin, TestCase):
+    # Los presupuestos incluyen las 2 consultas de sesión y usuario de login_required, los
+    # SAVEPOINT de la transacción y el trabajo diferido a on_commit (cartera, índice de búsqueda,
+    # versiones de cache). No deben crecer con la cantidad de filas (20 estudiantes x 6 cuotas).
+    # Son el conteo medido, sin holgura: si una mejora lo baja, bajar también el presupuesto.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contratos = crear_datos()
+        cls.usuario = User.objects.create_user('cajero', password='clave')
+
+    def setUp(self):
+        cache.clear()  # páginas CxC y catálogos en cache de otras pruebas
+        self.client.force_login(self.usuario)
+
+    def test_listado_cxc(self):
+        with self.assertMaxConsultas(6):
+            r = self.client.get(reverse('listado_cxc'), {'per_page': 200})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.context['cuotas']), 120)
+
+    def test_listado_cxc_con_filtros(self):
+        with self.assertMaxConsultas(6):
+            r = self.client.get(reverse('listado_cxc'), {'q': 'estudiante', 'estado': 'Pagada', 'medio': 'Nequi'})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.context['cuotas']), 20)
+
+    @override_settings(CXC_CACHE_PAGINAS=True)
+    def test_catalogos_al_editar(self):
+        # Los filtros del listado salen de la cache de catálogos: guardar o borrar un
+        # Nivel/Sede la invalida por señal, sin limpiar la cache a mano
+        def consultar():
+            with CaptureQueriesContext(connection) as ctx:
+                r = self.client.get(reverse('listado_cxc'))
+            self.assertEqual(r.status_code, 200)
+            consultas_nivel = [q for q in ctx.captured_queries if 'FROM "gestion_clientes_nivel"' in q['sql']]
+            return r, consultas_nivel
+
+        r, _ = consultar()
+        self.assertEqual([n.nombre for n in r.context['niveles']], ['Básico A1'])
+        r, consultas_nivel = consultar()
+        self.assertEqual(consultas_nivel, [])  # desde cache
+
+        nivel = Nivel.objects.get()
+        nivel.nombre = 'Intermedio B1'
+        with self.captureOnCommitCallbacks(execute=True):
+            nivel.save()
+            sede = Sede.objects.create(nombre='Sede nueva', ciudad='Pasto', direccion='Calle 2')
+        r, _ = consultar()
+        self.assertEqual([n.nombre for n in r.context['niveles']], ['Intermedio B1'])
+        self.assertIn(sede, r.context['sedes'])
+        self.assertContains(r, 'data-nivel="Intermedio B1"')  # filas de la tabla, no la página en cache
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sede.delete()
+        r, _ = consultar()
+        self.assertNotIn(sede, r.context['sedes'])
+
+    def test_listado_cxc_cursor_editado(self):
+        primera = self.client.get(reverse('listado_cxc')).context['cuotas']
+        for valores in (['x', 'y', 'z', 'w'], [1, {'d': 'x'}, 1, 1], [1, '2027-01-01', [1], None]):
+            for direccion in ('n', 'p'):
+                r = self.client.get(reverse('listado_cxc'), {'cursor': codificar_cursor(direccion, valores)})
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(list(r.context['cuotas']), list(primera))  # inválido: primera página
+
+    @override_settings(CXC_CACHE_PAGINAS=True)  # un solo proceso: la cache local es compartida
+    def test_listado_cxc_desde_cache(self):
+        self.client.get(reverse('listado_cxc'))
+        with self.assertMaxConsultas(2):
+            r = self.client.get(reverse('listado_cxc'))
+        self.assertEqual(r.status_code, 200)
+
+    @override_settings(CXC_CACHE_PAGINAS=False)
+    def test_listado_cxc_sin_cache_de_paginas(self):
+        self.client.get(reverse('listado_cxc'))
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(reverse('listado_cxc'))
+        self.assertEqual(r.status_code, 200)
+        self.assertGreater(len(ctx), 2)  # la página se vuelve a consultar
+
+    def test_exportar_cxc_xlsx_limite(self):
+        with override_settings(CXC_XLSX_MAX_FILAS=119):  # 20 estudiantes x 6 cuotas
+            r = self.client.get(reverse('exportar_cxc'), {'formato': 'xlsx'})
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(self.client.get(reverse('exportar_cxc'), {'formato': 'csv'}).status_code, 200)
+        with override_settings(CXC_XLSX_MAX_FILAS=120):
+            r = self.client.get(reverse('exportar_cxc'), {'formato': 'xlsx'})
+        if r.status_code == 501:
+            self.skipTest('openpyxl no instalado')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r['Content-Disposition'].endswith('.xlsx"'))
+
+    def test_tablero_cartera_por_sede(self):
+        reconstruir_cartera()
+        total = tablero_cartera()['totales']['total']
+        por_sede = [tablero_cartera(sede_id=s.id) for s in Sede.objects.all()]
+        self.assertEqual([len(t['por_sede']) for t in por_sede], [1, 1])
+        self.assertEqual(sum(t['totales']['total'] for t in por_sede), total)
+        self.assertGreater(por_sede[0]['totales']['total'], 0)
+
+        # Dos sedes con el mismo nombre en ciudades distintas no se suman en una fila
+        Sede.objects.update(nombre='Principal')
+        Sede.objects.filter(id=Sede.objects.order_by('id')[0].id).update(ciudad='Bogotá')
+        cache.clear()
+        tablero = tablero_cartera()
+        self.assertEqual([f['nombre'] for f in tablero['por_sede']], ['Principal - Bogotá', 'Principal - Cali'])
+        self.assertEqual(sum(f['total'] for f in tablero['por_sede']), total)
+        self.assertEqual([f['nombre'] for f in tablero['por_nivel']], ['A1 - Básico A1'])
+
+    def test_listar_estudiantes(self):
+        # sesión + usuario + página + 3 catálogos (cache vacía)
+        with self.assertMaxConsultas(6):
+            r = self.client.get(reverse('listar_estudiantes'), {'per_page': 10})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.context['estudiantes']), 10)
+        with self.assertMaxConsultas(3):  # siguiente página, catálogos ya en cache
+            r = self.client.get(reverse('listar_estudiantes'), {'per_page': 10, 'cursor': r.context['pagina'].next_cursor})
+        self.assertEqual(len(r.context['estudiantes']), 10)
+        self.assertFalse(r.context['pagina'].has_next)
+
+    def test_listar_estudiantes_filtros(self):
+        sede = self.contratos[1].estudiante.sede_id
+        r = self.client.get(reverse('listar_estudiantes'), {'sede': sede, 'estado': 'Activo'})
+        self.assertEqual(len(r.context['estudiantes']), 10)
+        r = self.client.get(reverse('listar_estudiantes'), {'q': 'estudiante 13'})
+        self.assertEqual([e.nombre_completo for e in r.context['estudiantes']], ['Estudiante 13'])
+        r = self.client.get(reverse('listar_estudiantes'), {'q': 'E12'})
+        self.assertEqual([e.nombre_completo for e in r.context['estudiantes']], ['Estudiante 12'])
+        # Palabras por prefijo, en cualquier orden; también por el acudiente (índice de búsqueda)
+        for q in ['13 ESTUD', 'acudiente 13']:
+            r = self.client.get(reverse('listar_estudiantes'), {'q': q})
+            self.assertEqual([e.nombre_completo for e in r.context['estudiantes']], ['Estudiante 13'], q)
+        r = self.client.get(reverse('listar_estudiantes'), {'q': 'tudiante'})  # no es prefijo
+        self.assertEqual(list(r.context['estudiantes']), [])
+        # Sin contrato no está en el índice: nombre completo por prefijo
+        otro = self.contratos[0].estudiante
+        Estudiante.objects.create(
+            nombre_completo='José Sin Contrato', documento='E-NUEVO', fecha_nacimiento=date(2012, 1, 1),
+            nivel_id=otro.nivel_id, acudiente_id=otro.acudiente_id, sede_id=otro.sede_id,
+        )
+        r = self.client.get(reverse('listar_estudiantes'), {'q': 'josé sin'})
+        self.assertEqual([e.nombre_completo for e in r.context['estudiantes']], ['José Sin Contrato'])
+
+    def test_detalle_estudiante(self):
+        # sesión + usuario + estudiante + contratos + cuotas, sin importar cuántos haya
+        contrato = self.contratos[0]
+        with self.assertMaxConsultas(5):
+            r = self.client.get(reverse('detalle_estudiante', args=[contrato.estudiante_id]))
+        self.assertEqual(r.status_code, 200)
+
+        nuevo = Contrato.objects.create(
+            estudiante_id=contrato.estudiante_id, acudiente_id=contrato.acudiente_id,
+            fecha_inicio=date.today(), valor_total=Decimal('300000'), numero_cuotas=3, estado='Activo',
+        )
+        Cuota.objects.bulk_create([
+            Cuota(contrato=nuevo, numero=n + 1, valor=Decimal('100000'),
+                  fecha_vencimiento=date.today() + timedelta(days=30 * n))
+            for n in range(3)
+        ])
+        with self.assertMaxConsultas(5):
+            r = self.client.get(reverse('detalle_estudiante', args=[contrato.estudiante_id]))
+        contratos = r.context['contratos']
+        self.assertEqual([len(c.cuotas) for c in contratos], [3, 6])
+        self.assertEqual(contratos[1].cuotas_pagado, Decimal('100000'))
+        self.assertEqual(contratos[1].cuotas_saldo, Decimal('500000'))
+        self.assertEqual(contratos[1].cuotas_pagadas, 1)
+
+    def test_estado_cuenta(self):
+        # sesión + usuario + acudiente + (acudientes, contratos, cuotas, pagos), sin importar cuántos haya
+        contrato = self.contratos[0]
+        with self.assertMaxConsultas(7):
+            r = self.client.get(reverse('estado_cuenta', args=[contrato.acudiente_id]))
+        self.assertEqual(r.status_code, 200)
+        self.assertContains(r, f'Contrato #{contrato.id}')
+
+        nuevo = Contrato.objects.create(
+            estudiante_id=contrato.estudiante_id, acudiente_id=contrato.acudiente_id,
+            fecha_inicio=date.today(), valor_total=Decimal('200000'), numero_cuotas=2, estado='Activo',
+        )
+        Cuota.objects.bulk_create([
+            Cuota(contrato=nuevo, numero=n + 1, valor=Decimal('100000'), fecha_vencimiento=date.today())
+            for n in range(2)
+        ])
+        Pago.objects.create(contrato=nuevo, fecha_pago=date.today(), valor_pagado=Decimal('5000'),
+                            forma_pago='Efectivo', referencia='SIN-CUOTA')  # pago sin cuota
+        with self.assertMaxConsultas(7):
+            r = self.client.get(reverse('estado_cuenta', args=[contrato.acudiente_id]))
+        self.assertContains(r, f'Contrato #{nuevo.id}')
+        self.assertContains(r, 'SIN-CUOTA')
+        acudiente = r.context['acudientes'][0]
+        self.assertEqual(acudiente.total_valor, Decimal('800000'))
+        self.assertEqual(acudiente.total_pagado, Decimal('100000'))
+        self.assertEqual(acudiente.total_vencido, Decimal('100000'))  # cuota 2 del primer contrato
+
+    def test_generar_estados_cuenta(self):
+        # Un acudiente con contratos en las dos sedes (estudiantes 0 y 1)
+        primero, segundo = self.contratos[0], self.contratos[1]
+        Estudiante.objects.filter(id=segundo.estudiante_id).update(acudiente_id=primero.acudiente_id)
+        Contrato.objects.filter(id=segundo.id).update(acudiente_id=primero.acudiente_id)
+
+        def manifiesto(carpeta):
+            with open(os.path.join(carpeta, 'manifiesto.csv'), encoding='utf-8') as fh:
+                filas = list(csv.DictReader(fh))
+            self.assertEqual(sorted(os.listdir(carpeta)), sorted([f['archivo'] for f in filas] + ['manifiesto.csv']))
+            return filas
+
+        # Sin --sede: un estado por acudiente con todos sus contratos, un solo manifiesto
+        with tempfile.TemporaryDirectory() as directorio:
+            call_command('generar_estados_cuenta', '--directorio', directorio, '--procesos', '1',
+                         '--lote', '3', stdout=io.StringIO())
+            filas = manifiesto(directorio)
+            self.assertEqual(len(filas), 19)
+            fila = next(f for f in filas if f['acudiente_id'] == str(primero.acudiente_id))
+            self.assertEqual((fila['contratos'], Decimal(fila['saldo'])), ('2', Decimal('1000000')))
+
+        # Con --sede: carpetas por sede con estados parciales
+        with tempfile.TemporaryDirectory() as directorio:
+            sedes = Sede.objects.order_by('id')
+            call_command('generar_estados_cuenta', '--directorio', directorio, '--procesos', '1',
+                         *[a for s in sedes for a in ('--sede', str(s.id))], stdout=io.StringIO())
+            total = sum(len(manifiesto(os.path.join(directorio, f'sede_{s.id}'))) for s in sedes)
+            self.assertEqual(total, 20)
+
+    def test_historial_pagos(self):
+        cuota = self.contratos[0].cuota_set.get(numero=3)
+        with self.assertMaxConsultas(5):
+            r = self.client.get(reverse('aplicar_pago'), {'cuota_id': cuota.id})
+        self.assertEqual(r.status_code, 200)
+        etag = r['ETag']
+        with self.assertMaxConsultas(3):
+            r = self.client.get(reverse('aplicar_pago'), {'cuota_id': cuota.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+        # Un pago atendido por otro worker no toca esta cache, pero sí la versión del contrato
+        cache.clear()
+        Contrato.objects.filter(id=cuota.contrato_id).update(version=F('version') + 1)
+        r = self.client.get(reverse('aplicar_pago'), {'cuota_id': cuota.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+
+    def fila_esperada(self, cuota, pagado, estado, referencia=None, vencida_roja=False):
+        """Fila del listado CxC que cxc.js debe recibir para la cuota (ver views._filas_cxc)."""
+        hoy = timezone.now().date()
+        return {
+            'cuota_id': cuota.id, 'valor': '100000.00', 'valor_pagado': pagado,
+            'saldo': str(Decimal('100000.00') - Decimal(pagado)), 'estado': estado,
+            'ultimo_pago_fecha': hoy.isoformat() if referencia else '',
+            'ultimo_pago_medio': 'Nequi' if referencia else '', 'ultimo_pago_factura': '',
+            'ultimo_pago_referencia': referencia or '', 'ultimo_pago_obs': '',
+            'vencida_roja': vencida_roja,
+        }
+
+    def test_aplicar_pago(self):
+        cuota = self.contratos[0].cuota_set.get(numero=2)
+        # 2 login + 1 cuota + 10 con el contrato bloqueado (SAVEPOINT, bloqueo, cuotas, pago, cuota,
+        # contrato y agregados, RELEASE) + al confirmar: 6 índice, 1 sedes en cache, 6 cartera
+        with self.assertMaxConsultas(26), self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(reverse('aplicar_pago'), {
+                'cuota_id': cuota.id, 'valor_pagado': '50000', 'referencia': 'X-1', 'forma_pago': 'Nequi',
+            })
+        self.assertEqual(r.status_code, 200, r.content)
+        cuota.refresh_from_db()
+        self.assertEqual(cuota.estado, 'Parcial')
+        # Vencida hace 30 días y con saldo: sigue en rojo
+        self.assertEqual(r.json()['filas'], [
+            self.fila_esperada(cuota, '50000.00', 'Parcial', referencia='X-1', vencida_roja=True),
+        ])
+
+    def test_aplicar_pago_auto(self):
+        cuota = self.contratos[0].cuota_set.get(numero=6)
+        # Igual que un pago a una cuota: cinco cuotas tocadas no agregan consultas
+        with self.assertMaxConsultas(26), self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(reverse('aplicar_pago'), {
+                'cuota_id': cuota.id, 'valor_pagado': '450000', 'referencia': 'X-2', 'forma_pago': 'Nequi',
+                'modo': 'auto',
+            })
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual(len(r.json()['distribucion']), 5)
+        # Las previas cubiertas (2 a 5) y la actual, con el remanente
+        cuotas = list(self.contratos[0].cuota_set.filter(numero__gte=2).order_by('numero'))
+        self.assertEqual(r.json()['filas'], [
+            self.fila_esperada(c, '100000.00', 'Pagada', referencia='X-2') for c in cuotas[:4]
+        ] + [self.fila_esperada(cuotas[4], '50000.00', 'Parcial', referencia='X-2')])
+
+    def test_eliminar_pago(self):
+        pago = Pago.objects.filter(contrato=self.contratos[0]).first()
+        # 2 login + 1 pago + 13 con el contrato bloqueado + al confirmar: 5 índice, 2 sedes en cache
+        # (señal del pago y sincronizar_contratos), 6 cartera
+        with self.assertMaxConsultas(29), self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(reverse('eliminar_pago'), {'pago_id': pago.id})
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertFalse(Pago.objects.filter(pk=pago.pk).exists())
+        # Vencida hace 60 días: vuelve a 'Vencida', no a 'Pendiente' (el incremental no la vería)
+        cuota = Cuota.objects.get(pk=pago.cuota_id)
+        self.assertEqual(cuota.estado, 'Vencida')
+        self.assertEqual(r.json()['filas'], [self.fila_esperada(cuota, '0.00', 'Vencida', vencida_roja=True)])
+
+
+def _planes_mysql(nodo):
+    """Recorre el EXPLAIN FORMAT=JSON de MySQL y entrega (tabla, access_type, using_filesort)."""
+    if isinstance(nodo, dict):
+        filesort = bool(nodo.get('using_filesort'))
+        if 'table_name' in nodo:
+            yield nodo['table_name'], nodo.get('access_type'), filesort
+        elif filesort:
+            yield None, None, True
+        for valor in nodo.values():
+            yield from _planes_mysql(valor)
+    elif isinstance(nodo, list):
+        for valor in nodo:
+            yield from _planes_mysql(valor)
+
+
+class ExplainConsultasTests(TestCase):
+    """
+    Regresión de planes: las consultas calientes de CxC deben resolverse con los índices de
+    0019_indices_cxc, sin recorrer la tabla completa ni ordenar en la base (filesort / temp b-tree).
+    Se valida en SQLite (pruebas locales) y MySQL (producción); otros motores se omiten.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contratos = crear_datos(estudiantes=6, cuotas=4)
+        cls.cuota_ids = list(Cuota.objects.values_list('id', flat=True))
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'mysql'):
+            self.skipTest(f'EXPLAIN no verificado para {connection.vendor}')
+
+    def assertPlanConIndice(self, qs, tabla, permitir_orden=False):
+        if connection.vendor == 'sqlite':
+            plan = qs.explain()
+            # "SCAN <tabla>" sin índice = recorrido completo; "USE TEMP B-TREE" = ordenamiento
+            if re.search(rf'SCAN {tabla}(?! USING)', plan):
+                self.fail(f'Recorrido completo de {tabla}:\n{plan}')
+            if not permitir_orden and 'USE TEMP B-TREE' in plan:
+                self.fail(f'Ordenamiento sin índice:\n{plan}')
+        else:
+            plan = qs.explain(format='JSON')
+            for nombre, acceso, filesort in _planes_mysql(json.loads(plan)):
+                if nombre == tabla and acceso == 'ALL':
+                    self.fail(f'Recorrido completo de {tabla}:\n{plan}')
+                if filesort and not permitir_orden:
+                    self.fail(f'Filesort:\n{plan}')
+
+    def test_ultimo_pago_por_cuota(self):
+        # services.refrescar_cuotas y el historial del modal
+        qs = (
+            Pago.objects.filter(cuota_id__in=self.cuota_ids[:10])
+            .order_by('cuota_id', '-fecha_pago', '-id')
+            .values('cuota_id', 'fecha_pago')
+        )
+        self.assertPlanConIndice(qs, Pago._meta.db_table)
+
+    def test_pago_por_medio(self):
+        # filtro "medio" del listado CxC
+        qs = Pago.objects.filter(cuota_id=self.cuota_ids[0], forma_pago='Nequi').values('id')
+        self.assertPlanConIndice(qs, Pago._meta.db_table)
+
+    def test_cuotas_vencidas(self):
+        # actualizar_cuotas: el lote se ordena por id (keyset), pero el filtro usa el índice
+        qs = (
+            Cuota.objects.filter(estado='Pendiente', fecha_vencimiento__lt=date.today(), id__gt=0)
+            .order_by('id').values_list('id', flat=True)[:500]
+        )
+        self.assertPlanConIndice(qs, Cuota._meta.db_table, permitir_orden=True)
+
+    def test_cuotas_de_contrato(self):
+        qs = Cuota.objects.filter(contrato=self.contratos[0]).order_by('fecha_vencimiento', 'numero')
+        self.assertPlanConIndice(qs, Cuota._meta.db_table)
+
+
+class HistorialAsyncTests(TestCase):
+    """Las vistas de vistas_async.py responden lo mismo que sus equivalentes sync."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contratos = crear_datos(estudiantes=4, cuotas=4)
+        cls.usuario = User.objects.create_user('cajero', password='clave')
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_historial_igual_al_sync(self):
+        await self.async_client.aforce_login(self.usuario)
+        cuota = await Cuota.objects.aget(contrato=self.contratos[0], numero=1)
+        r = await self.async_client.get(reverse('historial_pago_async'), {'cuota_id': cuota.id})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.json()['pagos']), 1)
+
+        r_sync = await self.async_client.get(reverse('aplicar_pago'), {'cuota_id': cuota.id})
+        self.assertEqual(r.json(), r_sync.json())
+        self.assertEqual(r['ETag'], r_sync['ETag'])
+        r = await self.async_client.get(reverse('historial_pago_async'), {'cuota_id': cuota.id},
+                                        headers={'if-none-match': r['ETag']})
+        self.assertEqual(r.status_code, 304)
+
+    async def test_lote_igual_al_sync(self):
+        await self.async_client.aforce_login(self.usuario)
+        ids = ','.join([str(i) async for i in Cuota.objects.values_list('id', flat=True)])
+        r = await self.async_client.get(reverse('historial_pagos_lote_async'), {'ids': ids})
+        r_sync = await self.async_client.get(reverse('historial_pagos_lote'), {'ids': ids})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(r.json()['historiales']), 16)
+        self.assertEqual(r.json(), r_sync.json())
+        r = await self.async_client.get(reverse('historial_pagos_lote_async'), {'ids': 'x'})
+        self.assertEqual(r.status_code, 400)
+
+    async def test_requiere_login(self):
+        r = await self.async_client.get(reverse('historial_pago_async'), {'cuota_id': 1})
+        self.assertEqual(r.status_code, 302)
+
+
+def verificar_invariantes(contrato_ids):
+    """Diferencias entre snapshots (cuota y contrato) y la suma real de pagos; [] si todo cuadra."""
+    errores = [f'cuota {d["cuota_id"]}: snapshot {d["guardado"]}, pagos {d["calculado"]}'
+               for d in diferencias_cuotas(contrato_ids)]
+    errores += [f'cuota {c.id}: pagado {c.valor_pagado} > valor {c.valor}'
+                for c in Cuota.objects.filter(contrato_id__in=contrato_ids, valor_pagado__gt=F('valor'))]
+    errores += [f'contrato {k}: agregados desactualizados' for k in contratos_descuadrados(contrato_ids)]
+    return errores
+
+
+class BloqueoContratoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contrato = crear_datos(estudiantes=1, cuotas=4)[0]
+        cls.usuario = User.objects.create_user('cajero', password='clave')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.usuario)
+
+    def test_version_obsoleta(self):
+        cuota = self.contrato.cuota_set.get(numero=2)
+        version = self.client.get(reverse('aplicar_pago'), {'cuota_id': cuota.id}).json()['version_contrato']
+        datos = {'cuota_id': cuota.id, 'valor_pagado': '1000', 'referencia': 'V-1', 'forma_pago': 'Nequi',
+                 'version_contrato': version}
+        r = self.client.post(reverse('aplicar_pago'), datos)
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual(r.json()['version_contrato'], version + 1)
+
+        # Segundo envío con la versión que ya no es la actual
+        r = self.client.post(reverse('aplicar_pago'), {**datos, 'referencia': 'V-2'})
+        self.assertEqual(r.status_code, 409)
+        self.assertEqual(r.json()['error_code'], 'version_obsoleta')
+        self.assertEqual(r.json()['version_contrato'], version + 1)
+        pago = Pago.objects.get(referencia='V-1')
+        r = self.client.post(reverse('eliminar_pago'), {'pago_id': pago.id, 'version_contrato': version})
+        self.assertEqual(r.status_code, 409)
+        r = self.client.post(reverse('eliminar_pago'), {'pago_id': pago.id, 'version_contrato': version + 1})
+        self.assertEqual(r.status_code, 200, r.content)
+
+    def test_transaccion_corta(self):
+        # Con el contrato bloqueado solo se escriben Pago, Cuota y Contrato; índice de
+        # búsqueda, versiones de cache y cartera quedan para después de confirmar
+        cuota = self.contrato.cuota_set.get(numero=2)
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(reverse('aplicar_pago'), {
+                'cuota_id': cuota.id, 'valor_pagado': '1000', 'referencia': 'T-1', 'forma_pago': 'Nequi',
+            })
+        self.assertEqual(r.status_code, 200, r.content)
+        sql = [q['sql'] for q in ctx.captured_queries]
+        inicio = next(i for i, q in enumerate(sql) if q.startswith('SAVEPOINT'))
+        fin = next(i for i, q in enumerate(sql) if q.startswith('RELEASE SAVEPOINT'))
+        bloqueado = sql[inicio + 1:fin]
+        # bloqueo, cuotas, INSERT pago, UPDATE cuota, contrato, 2 agregados, UPDATE contrato
+        self.assertEqual(len(bloqueado), 8, '\n'.join(bloqueado))
+        self.assertFalse([q for q in bloqueado if 'terminobusqueda' in q or 'resumencartera' in q])
+        self.assertTrue(TerminoBusqueda.objects.filter(cuota=cuota, termino='t1').exists())
+
+    def test_contrato_ocupado(self):
+        cuota = self.contrato.cuota_set.get(numero=2)
+        with mock.patch('gestion_clientes.views.bloquear_contratos', side_effect=ContratoOcupado):
+            r = self.client.post(reverse('aplicar_pago'), {
+                'cuota_id': cuota.id, 'valor_pagado': '1000', 'referencia': 'O-1', 'forma_pago': 'Nequi',
+            })
+        self.assertEqual(r.status_code, 409)
+        self.assertTrue(r.json()['reintentar'])
+        self.assertFalse(Pago.objects.filter(referencia='O-1').exists())
+
+    def test_integridad_detecta_descuadres(self):
+        self.assertEqual(verificar_invariantes([self.contrato.id]), [])
+        cuota = self.contrato.cuota_set.get(numero=1)
+        Cuota.objects.filter(id=cuota.id).update(valor_pagado=Decimal('90000'))
+        self.assertEqual(diferencias_cuotas([self.contrato.id]), [{
+            'cuota_id': cuota.id, 'contrato_id': self.contrato.id,
+            'guardado': '90000.00', 'calculado': '100000.00',
+        }])
+        Contrato.objects.filter(id=self.contrato.id).update(total_pagado=0)
+        self.assertEqual(contratos_descuadrados([self.contrato.id]), [self.contrato.id])
+
+        # Doble envío: misma referencia dos veces en la misma cuota
+        pago = Pago.objects.get(cuota=cuota)
+        pago.pk = None
+        pago.save()
+        self.assertEqual(referencias_repetidas([self.contrato.id]), [(cuota.id, pago.referencia, 2)])
+
+
+@skipUnlessDBFeature('has_select_for_update_nowait')
+class ConcurrenciaPagosTests(TransactionTestCase):
+    """
+    Estrés sobre UN contrato (solo en motores con FOR UPDATE NOWAIT, p. ej. MySQL 8): hilos que
+    aplican y eliminan pagos a la vez. Toda respuesta debe ser 200 o 409 (reintentable), sin
+    deadlocks ni errores 500, y los snapshots deben cuadrar con los pagos al final.
+    """
+    HILOS = 8
+    OPERACIONES = 15
+
+    def test_pagos_concurrentes_mismo_contrato(self):
+        contrato = crear_datos(estudiantes=1, cuotas=12)[0]
+        cuotas = list(contrato.cuota_set.order_by('numero').values_list('id', flat=True))
+        usuario = User.objects.create_user('cajero', password='clave')
+        clientes = []
+        for _ in range(self.HILOS):
+            cliente = Client()
+            cliente.force_login(usuario)
+            clientes.append(cliente)
+
+        estados, errores = [], []
+
+        def trabajar(n, cliente):
+            try:
+                for i in range(self.OPERACIONES):
+                    for _ in range(20):  # reintentos ante 409
+                        r = cliente.post(reverse('aplicar_pago'), {
+                            'cuota_id': cuotas[-1], 'valor_pagado': '1000', 'modo': 'auto',
+                            'referencia': f'H{n}-{i}', 'forma_pago': 'Nequi',
+                        })
+                        estados.append(r.status_code)
+                        if r.status_code != 409:
+                            break
+                        time.sleep(0.005)
+                    if i % 3 == 2:  # elimina uno de sus pagos
+                        pago = Pago.objects.filter(referencia__startswith=f'H{n}-').order_by('?').first()
+                        if pago:
+                            for _ in range(20):
+                                r = cliente.post(reverse('eliminar_pago'), {'pago_id': pago.id})
+                                estados.append(r.status_code)
+                                if r.status_code != 409:
+                                    break
+                                time.sleep(0.005)
+            except Exception as e:  # deadlock u otro error de base de datos
+                errores.append(repr(e))
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=trabajar, args=(n, c)) for n, c in enumerate(clientes)]
+        inicio = time.perf_counter()
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        segundos = time.perf_counter() - inicio
+
+        self.assertEqual(errores, [], f'{len(estados)} respuestas en {segundos:.2f}s')
+        self.assertEqual(set(estados) - {200, 404, 409}, set(), estados)  # 404: pago ya eliminado
+        exitosas = estados.count(200)
+        resumen = (f'{exitosas} operaciones en {segundos:.2f}s, '
+                   f'{estados.count(409)} conflictos 409, {len(errores)} errores')
+        self.assertGreater(exitosas, 0, resumen)
+        self.assertEqual(verificar_invariantes([contrato.id]), [], resumen)
+
+
+class VerificarSaldosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contratos = crear_datos(estudiantes=3, cuotas=4)
+        call_command('actualizar_cuotas', stdout=io.StringIO())  # estados vencidos al día
+
+    def verificar(self, *args):
+        salida = io.StringIO()
+        call_command('verificar_saldos', '--procesos', '1', '--tamano', '2', *args,
+                     stdout=salida, stderr=io.StringIO())
+        return json.loads(salida.getvalue())
+
+    def test_detecta_y_repara(self):
+        self.assertEqual(self.verificar()['contratos_afectados'], 0)
+        cuota = self.contratos[0].cuota_set.get(numero=1)
+        Cuota.objects.filter(id=cuota.id).update(valor_pagado=Decimal('1'), estado='Parcial')
+        Contrato.objects.filter(id=self.contratos[2].id).update(saldo=0)
+
+        reporte = self.verificar('--reparar')
+        self.assertEqual(reporte['rangos'], 2)
+        # proximo_vencimiento: el contrato ya no cuadra con la cuota alterada
+        self.assertEqual(reporte['por_campo'], {
+            'contrato.proximo_vencimiento': 1, 'contrato.saldo': 1, 'estado': 1, 'valor_pagado': 1,
+        })
+        self.assertEqual(reporte['reparados'], 2)
+        self.assertEqual(reporte['errores'], [])
+        self.assertEqual(verificar_invariantes([c.id for c in self.contratos]), [])
+        self.assertEqual(self.verificar()['contratos_afectados'], 0)
+
+    def test_admin_actualiza_snapshot(self):
+        admin = User.objects.create_superuser('admin', password='clave')
+        self.client.force_login(admin)
+        contrato = self.contratos[1]
+        pago = Pago.objects.get(contrato=contrato)
+        segunda = contrato.cuota_set.get(numero=2)
+
+        # Cambia valor y cuota: se recalculan la cuota anterior, la nueva y el contrato
+        r = self.client.post(reverse('admin:gestion_clientes_pago_change', args=[pago.id]), {
+            'contrato': contrato.id, 'cuota': segunda.id, 'fecha_pago': pago.fecha_pago.isoformat(),
+            'valor_pagado': '40000', 'forma_pago': 'Nequi', 'referencia': pago.referencia,
+        })
+        self.assertEqual(r.status_code, 302)
+        self.assertEqual(contrato.cuota_set.get(numero=1).valor_pagado, 0)
+        self.assertEqual(contrato.cuota_set.get(numero=2).estado, 'Parcial')
+        self.assertEqual(Contrato.objects.get(id=contrato.id).total_pagado, Decimal('40000'))
+        self.assertEqual(verificar_invariantes([contrato.id]), [])
+        # La búsqueda por la referencia encuentra la cuota nueva, no la anterior
+        self.assertEqual(
+            set(TerminoBusqueda.objects.filter(cuota__isnull=False, contrato=contrato).values_list('cuota_id', flat=True)),
+            {segunda.id},
+        )
+
+        r = self.client.post(reverse('admin:gestion_clientes_pago_delete', args=[pago.id]), {'post': 'yes'})
+        self.assertEqual(r.status_code, 302)
+        self.assertEqual(contrato.cuota_set.get(numero=2).valor_pagado, 0)
+        self.assertEqual(Contrato.objects.get(id=contrato.id).total_pagado, 0)
+        self.assertEqual(self.verificar()['contratos_afectados'], 0)
+
+    def test_agregados_al_crear_y_editar_contrato(self):
+        contrato = self.contratos[0]
+        nuevo = Contrato.objects.create(
+            estudiante=contrato.estudiante, acudiente=contrato.acudiente, fecha_inicio=date.today(),
+            valor_total=Decimal('250000'), numero_cuotas=1, estado='Activo',
+        )
+        self.assertEqual(Contrato.objects.get(id=nuevo.id).saldo, Decimal('250000'))
+
+        contrato = Contrato.objects.get(id=contrato.id)
+        contrato.valor_total = Decimal('500000')
+        contrato.save()
+        contrato.refresh_from_db()
+        self.assertEqual(contrato.saldo, Decimal('400000'))  # 500000 - la primera cuota pagada
+        self.assertEqual(verificar_invariantes([contrato.id]), [])
+
+
+class ActualizarCuotasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contratos = crear_datos(estudiantes=4, cuotas=4)
+
+    def actualizar(self, *args):
+        salida = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('actualizar_cuotas', *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_bloquea_contratos_y_sube_version(self):
+        # Mismo orden que las vistas de pago (Contrato y luego Cuota) y la versión cambia
+        versiones = dict(Contrato.objects.values_list('id', 'version'))
+        with mock.patch('gestion_clientes.management.commands.actualizar_cuotas.bloquear_contratos',
+                        wraps=bloquear_contratos) as bloquear:
+            self.actualizar('--batch-size', '3')
+        ids = {c.id for c in self.contratos}
+        self.assertEqual(set().union(*(set(llamada.args[0]) for llamada in bloquear.call_args_list)), ids)
+        self.assertTrue(all(llamada.kwargs == {'esperar': True} for llamada in bloquear.call_args_list))
+        for contrato in Contrato.objects.all():
+            self.assertEqual(contrato.version, versiones[contrato.id] + 1)
+            self.assertEqual(contrato.cuotas_vencidas, 1)  # la cuota 2 (la 1 está pagada)
+        self.assertEqual(verificar_invariantes(list(ids)), [])
+
+    def vencidas(self):
+        return set(Cuota.objects.filter(estado='Vencida').values_list('id', flat=True))
+
+    def test_incremental_y_completo(self):
+        hoy = date.today()
+        self.assertIn('Modo: completo', self.actualizar())  # sin marca: revisa todo
+        self.assertEqual(MarcaProceso.objects.get(nombre='actualizar_cuotas').ultima_fecha, hoy)
+        segundas = set(Cuota.objects.filter(numero=2).values_list('id', flat=True))
+        self.assertEqual(self.vencidas(), segundas)
+
+        # Marca de hace 45 días; una cuota pendiente vencida hace 50 (antes de la marca)
+        # y las de hace 30 (después) vuelven a 'Pendiente'
+        MarcaProceso.objects.filter(nombre='actualizar_cuotas').update(ultima_fecha=hoy - timedelta(days=45))
+        Cuota.objects.filter(id__in=segundas).update(estado='Pendiente')
+        anterior = Cuota.objects.get(contrato=self.contratos[0], numero=2)
+        Cuota.objects.filter(id=anterior.id).update(fecha_vencimiento=hoy - timedelta(days=50))
+
+        salida = self.actualizar()
+        self.assertIn(f'incremental desde {hoy - timedelta(days=45)}', salida)
+        self.assertIn('3 cuota(s) actualizada(s)', salida)
+        self.assertEqual(self.vencidas(), segundas - {anterior.id})
+
+        salida = self.actualizar('--completo')
+        self.assertIn('1 cuota(s) actualizada(s)', salida)
+        self.assertEqual(self.vencidas(), segundas)
+        self.assertEqual(verificar_invariantes([c.id for c in self.contratos]), [])
+
+    def test_sede_y_dry_run(self):
+        sede_id = self.contratos[0].estudiante.sede_id
+        de_la_sede = set(Cuota.objects.filter(numero=2, contrato__estudiante__sede_id=sede_id)
+                         .values_list('id', flat=True))
+
+        self.assertIn('2 cuota(s) se marcarían', self.actualizar('--dry-run', '--sede', str(sede_id)))
+        self.assertEqual(self.vencidas(), set())
+        self.assertFalse(MarcaProceso.objects.exists())
+
+        self.assertIn('2 cuota(s) actualizada(s)', self.actualizar('--sede', str(sede_id)))
+        self.assertEqual(self.vencidas(), de_la_sede)
+        # Marca propia de la sede: la corrida global sigue siendo completa
+        self.assertEqual(list(MarcaProceso.objects.values_list('nombre', flat=True)),
+                         [f'actualizar_cuotas:sede={sede_id}'])
+        self.assertIn('Modo: completo', self.actualizar())
+        self.assertEqual(len(self.vencidas()), 4)
+
+    def test_pago_eliminado_despues_de_la_marca(self):
+        # La cuota 1 (vencida hace 60 días) queda sin pagos después de la corrida: el
+        # incremental ya no la revisa, así que eliminar_pago debe dejarla 'Vencida'
+        self.actualizar()
+        usuario = User.objects.create_user('cajero', password='clave')
+        self.client.force_login(usuario)
+        pago = Pago.objects.get(contrato=self.contratos[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.client.post(reverse('eliminar_pago'), {'pago_id': pago.id})
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertIn('0 cuota(s) actualizada(s)', self.actualizar())
+        self.assertEqual(Cuota.objects.get(id=pago.cuota_id).estado, 'Vencida')
+        self.assertEqual(Contrato.objects.get(id=self.contratos[0].id).cuotas_vencidas, 2)
+
+
+class ImportacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # 3 contratos de 4 cuotas de 100.000 con la primera pagada: 300.000 de saldo cada uno
+        cls.contratos = crear_datos(estudiantes=3, cuotas=4, sedes=2)
+        cls.usuario = User.objects.create_user('cajero', password='clave')
+
+    def csv(self, filas):
+        salida = io.StringIO()
+        escritor = csv.writer(salida)
+        escritor.writerow(['documento', 'contrato', 'valor', 'fecha', 'forma_pago', 'referencia'])
+        escritor.writerows(filas)
+        return salida.getvalue()
+
+    def filas_extracto(self):
+        c0 = self.contratos[0]
+        return [
+            ['E0', '', '150.000', '10/01/2026', 'Nequi', 'IMP-1'],
+            ['', str(c0.id), '150000', '2026-01-05', 'Banco', 'IMP-2'],   # más antigua: va primero
+            ['E0', '', '1000', '2026-01-11', 'Nequi', 'IMP-3'],           # ya no queda saldo
+            ['E0', '', '5000', '2026-01-11', 'Nequi', f'R-{c0.id}'],      # referencia ya registrada
+            ['E1', '', '50000', '2026-01-10', 'Efectivo', 'IMP-4'],
+            ['X9', '', '50000', '2026-01-10', 'Nequi', 'IMP-5'],
+            ['E2', '', '150.5', '2026-01-10', 'Nequi', 'IMP-6'],
+        ]
+
+    def importar(self, filas, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return {r['fila']: r for r in importar_pagos(leer_csv(self.csv(filas)), **kwargs)}
+
+    def test_importar_por_contrato(self):
+        c0, c1, _ = self.contratos
+        versiones = dict(Contrato.objects.values_list('id', 'version'))
+        reporte = self.importar(self.filas_extracto())
+
+        self.assertEqual({k: r['ok'] for k, r in reporte.items()},
+                         {2: True, 3: True, 4: False, 5: False, 6: True, 7: False, 8: False})
+        self.assertIn('supera la capacidad', reporte[4]['error'])
+        self.assertIn('ya está registrada', reporte[5]['error'])
+        self.assertEqual(reporte[7]['error'], 'No hay contrato activo para el documento.')
+        self.assertEqual(reporte[8]['error'], 'Valor inválido.')
+        # Por fecha dentro del contrato, cuotas más antiguas primero y sin pasar el saldo de cada una
+        self.assertEqual([(d['numero'], d['aplicado']) for d in reporte[3]['distribucion']],
+                         [(2, '100000.00'), (3, '50000.00')])
+        self.assertEqual([(d['numero'], d['aplicado']) for d in reporte[2]['distribucion']],
+                         [(3, '50000.00'), (4, '100000.00')])
+
+        self.assertEqual(Pago.objects.filter(referencia__startswith='IMP-').count(), 5)
+        self.assertEqual(list(c0.cuota_set.order_by('numero').values_list('estado', 'valor_pagado')),
+                         [('Pagada', Decimal('100000'))] * 4)
+        self.assertEqual(c0.cuota_set.get(numero=4).ultimo_pago_referencia, 'IMP-1')
+        self.assertEqual(c1.cuota_set.get(numero=2).estado, 'Parcial')
+        contratos = Contrato.objects.in_bulk([c0.id, c1.id])
+        self.assertEqual((contratos[c0.id].saldo, contratos[c1.id].saldo), (Decimal('0'), Decimal('250000')))
+        self.assertEqual(contratos[c0.id].version, versiones[c0.id] + 1)  # un bloqueo y una escritura por contrato
+        self.assertEqual(verificar_invariantes([c.id for c in self.contratos]), [])
+
+        # El mismo extracto otra vez no duplica pagos
+        reporte = self.importar(self.filas_extracto())
+        self.assertEqual([k for k, r in reporte.items() if r['ok']], [])
+        self.assertEqual(Pago.objects.filter(referencia__startswith='IMP-').count(), 5)
+
+    def test_importar_dry_run(self):
+        antes = list(Cuota.objects.order_by('id').values_list('id', 'valor_pagado', 'estado'))
+        versiones = dict(Contrato.objects.values_list('id', 'version'))
+        reporte = self.importar(self.filas_extracto(), dry_run=True)
+        self.assertEqual(sum(r['ok'] for r in reporte.values()), 3)  # mismo cálculo que la corrida real
+        self.assertFalse(Pago.objects.filter(referencia__startswith='IMP-').exists())
+        self.assertEqual(list(Cuota.objects.order_by('id').values_list('id', 'valor_pagado', 'estado')), antes)
+        self.assertEqual(dict(Contrato.objects.values_list('id', 'version')), versiones)
+
+    def test_importar_por_sede(self):
+        c0, c1, _ = self.contratos  # sedes distintas
+        reporte = self.importar([
+            ['E0', '', '1000', '2026-01-10', 'Nequi', 'S-1'],
+            ['', str(c1.id), '1000', '2026-01-10', 'Nequi', 'S-2'],
+        ], sede_id=c0.estudiante.sede_id)
+        self.assertTrue(reporte[2]['ok'])
+        self.assertEqual(reporte[3]['error'], 'No tiene permisos sobre esta sede.')
+        self.assertEqual(list(Pago.objects.filter(referencia__startswith='S-').values_list('contrato_id', flat=True)),
+                         [c0.id])
+
+    def test_vista_importar(self):
+        self.client.force_login(self.usuario)
+        filas = [['E0', '', '150000', '2026-01-10', 'Nequi', 'V-1'], ['X9', '', '1000', '2026-01-10', 'Nequi', 'V-2']]
+
+        def subir(**datos):
+            archivo = SimpleUploadedFile('extracto.csv', self.csv(filas).encode('utf-8-sig'), 'text/csv')
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(reverse('importar_pagos'), {'archivo': archivo, **datos})
+
+        r = subir(dry_run='1')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual((r.context['aplicadas'], len(r.context['reporte'])), (1, 2))
+        self.assertFalse(Pago.objects.filter(referencia='V-1').exists())
+
+        r = subir()
+        self.assertEqual(r.context['aplicadas'], 1)
+        self.assertContains(r, 'No hay contrato activo para el documento.')
+        self.assertEqual(Pago.objects.filter(referencia='V-1').aggregate(t=Sum('valor_pagado'))['t'], Decimal('150000'))
+        self.assertEqual(Contrato.objects.get(id=self.contratos[0].id).saldo, Decimal('150000'))
+
+        r = self.client.post(reverse('importar_pagos'), {})
+        self.assertEqual(r.context['error'], 'Seleccione un archivo CSV.')
+
+    def test_parse_valor(self):
+        validos = {
+            '150000': '150000', '$ 150.000': '150000', '150,000': '150000', '1.500.000': '1500000',
+            '1.500,50': '1500.50', '1,500.50': '1500.50', '150000.00': '150000.00', '150,00': '150.00',
+        }
+        for texto, esperado in validos.items():
+            self.assertEqual(_parse_valor(texto), Decimal(esperado), texto)
+        for texto in ['150.5', '1,5', '12,34,567', '1.500.50', '1,500,50', '1.5000', '-5', 'abc', '']:
+            self.assertIsNone(_parse_valor(texto), texto)
+
+
+class CronogramasTests(PresupuestoConsultasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.contrato = crear_datos(estudiantes=1, cuotas=4, sedes=1)[0]
+
+    def test_valores_y_fechas(self):
+        self.assertEqual(valores_cuotas(Decimal('1000000'), 3), [Decimal('333333')] * 2 + [Decimal('333334')])
+        self.assertEqual(valores_cuotas(Decimal('1000'), 3, Decimal('334')), [Decimal('334')] * 2 + [Decimal('332')])
+        for pactada in ['600', '300', '100000']:  # supera el total o la última absorbe más que el redondeo
+            with self.assertRaises(ValidationError):
+                valores_cuotas(Decimal('1000'), 3, Decimal(pactada))
+        with self.assertRaises(ValidationError):
+            valores_cuotas(Decimal('1200000'), 6, Decimal('100000'))  # la última sería 700000
+        self.assertEqual(sumar_meses(date(2027, 1, 31), 1), date(2027, 2, 28))
+        self.assertEqual(sumar_meses(date(2027, 11, 30), 3), date(2028, 2, 29))
+
+    def test_crear_contratos_sin_llaves_de_bulk_insert(self):
+        # Como MySQL: bulk_create no devuelve los ids y se leen después
+        estudiante = self.contrato.estudiante
+        nuevos = [
+            Contrato(estudiante=estudiante, acudiente_id=estudiante.acudiente_id, fecha_inicio=date(2027, 1, 31),
+                     valor_total=Decimal('1000000'), numero_cuotas=3, estado='Activo'),
+            Contrato(estudiante=estudiante, acudiente_id=estudiante.acudiente_id, fecha_inicio=date(2027, 8, 1),
+                     valor_total=Decimal('500002'), valor_cuota_pactada=Decimal('125000'), numero_cuotas=4,
+                     estado='Activo'),
+        ]
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            with self.assertMaxConsultas(17):  # fijo por lote, no por contrato ni por cuota
+                crear_contratos(nuevos, hoy=date(2027, 1, 1))
+        primero, segundo = (Contrato.objects.get(id=c.id) for c in nuevos)
+        self.assertEqual(primero.saldo, Decimal('1000000'))
+        self.assertEqual(primero.proximo_vencimiento, date(2027, 1, 31))
+        self.assertEqual(
+            list(segundo.cuota_set.order_by('numero').values_list('valor', flat=True)),
+            [Decimal('125000')] * 3 + [Decimal('125002')],
+        )
+        self.assertEqual(verificar_invariantes([c.id for c in nuevos]), [])
+
+    def test_crear_contratos_con_insercion_concurrente(self):
+        # Otro proceso confirma un contrato del mismo estudiante y fecha entre el INSERT y la
+        # lectura de ids: no se puede saber cuál es el propio y se cancela el lote
+        estudiante = self.contrato.estudiante
+        datos = dict(estudiante=estudiante, acudiente_id=estudiante.acudiente_id, fecha_inicio=date(2027, 1, 31),
+                     valor_total=Decimal('300000'), numero_cuotas=3, estado='Activo')
+        bulk_create = Contrato.objects.bulk_create
+
+        def con_otro_proceso(objs, **kwargs):
+            creados = bulk_create(objs, **kwargs)
+            Contrato.objects.create(**datos)
+            return creados
+
+        antes = Contrato.objects.count()
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False), \
+                mock.patch.object(Contrato.objects, 'bulk_create', side_effect=con_otro_proceso):
+            with self.assertRaises(ValidationError):
+                crear_contratos([Contrato(**datos)], hoy=date(2027, 1, 1))
+        self.assertEqual(Contrato.objects.count(), antes)
+
+    def test_regenerar_conserva_cuotas_con_pagos(self):
+        # Cuota 1 pagada (crear_datos); nuevos términos: 1.000.000 en 3 cuotas, sin cuota pactada
+        Contrato.objects.filter(id=self.contrato.id).update(
+            valor_total=Decimal('1000000'), numero_cuotas=3, valor_cuota_pactada=0,
+        )
+        pagada = self.contrato.cuota_set.get(numero=1)
+        self.assertEqual(regenerar_cuotas([self.contrato.id], hoy=date.today()), {self.contrato.id: 2})
+        cuotas = list(self.contrato.cuota_set.order_by('numero'))
+        self.assertEqual(cuotas[0], pagada)
+        self.assertEqual([c.numero for c in cuotas], [1, 2, 3])
+        self.assertEqual([c.valor for c in cuotas[1:]], [Decimal('450000')] * 2)
+        self.assertEqual(Contrato.objects.get(id=self.contrato.id).saldo, Decimal('900000'))
+        self.assertEqual(verificar_invariantes([self.contrato.id]), [])
+
+        Contrato.objects.filter(id=self.contrato.id).update(valor_total=Decimal('50000'))
+        with self.assertRaises(ValidationError):  # lo pagado ya supera el nuevo valor
+            regenerar_cuotas([self.contrato.id], hoy=date.today())
+        self.assertEqual(self.contrato.cuota_set.count(), 3)
+
+
+    def test_regenerar_sin_consultas_por_cuota(self):
+        Contrato.objects.filter(id=self.contrato.id).update(valor_total=Decimal('1200000'), numero_cuotas=12)
+        with CaptureQueriesContext(connection) as ctx:
+            regenerar_cuotas([self.contrato.id], hoy=date.today())  # borra 3 cuotas sin pagos
+        with self.assertMaxConsultas(len(ctx)):  # borra 11: las mismas consultas
+            regenerar_cuotas([self.contrato.id], hoy=date.today())
+        self.assertEqual(self.contrato.cuota_set.count(), 12)
+        self.assertEqual(verificar_invariantes([self.contrato.id]), [])
+
+    def test_generar_bloquea_y_omite_contratos_con_cuotas(self):
+        estudiante = self.contrato.estudiante
+        nuevo = Contrato.objects.create(
+            estudiante=estudiante, acudiente_id=estudiante.acudiente_id, fecha_inicio=date(2027, 1, 31),
+            valor_total=Decimal('300000'), numero_cuotas=3, estado='Activo',
+        )
+        with mock.patch('gestion_clientes.cronogramas.bloquear_contratos', wraps=bloquear_contratos) as bloquear:
+            self.assertEqual(generar_cuotas([self.contrato, nuevo], hoy=date(2027, 1, 1)), 3)
+        bloquear.assert_called_once_with([self.contrato.id, nuevo.id], esperar=True)
+        self.assertEqual(generar_cuotas([nuevo], hoy=date(2027, 1, 1)), 0)  # ya tiene cuotas
+
+    def test_admin_contrato_ocupado(self):
+        admin = User.objects.create_superuser('admin', password='clave')
+        self.client.force_login(admin)
+        with mock.patch('gestion_clientes.cronogramas.bloquear_contratos', side_effect=ContratoOcupado):
+            r = self.client.post(reverse('admin:gestion_clientes_contrato_changelist'), {
+                'action': 'regenerar_cronograma', '_selected_action': [self.contrato.id],
+            }, follow=True)
+        self.assertEqual(r.status_code, 200)
+        self.assertContains(r, 'Otro proceso está modificando estos contratos')
+        self.assertEqual(self.contrato.cuota_set.count(), 4)
+
+
+class PerfilConsultasMiddlewareTests(TestCase):
+
+    @override_settings(PERFIL_CONSULTAS=True)
+    def test_encabezados(self):
+        usuario = User.objects.create_user('cajero', password='clave')
+        cliente = Client()  # carga el middleware con la configuración activa
+        cliente.force_login(usuario)
+        with self.assertLogs('gestion_clientes.consultas', level='INFO'):
+            r = cliente.get(reverse('listar_estudiantes'))
+        self.assertGreaterEqual(int(r['X-Consultas-SQL']), 1)
+        self.assertIn('X-Tiempo-SQL-ms', r)
+        self.assertEqual(r['X-Consultas-Repetidas'], '0')
+
+    def test_desactivado(self):
+        usuario = User.objects.create_user('cajero', password='clave')
+        self.client.force_login(usuario)
+        r = self.client.get(reverse('listar_estudiantes'))
+        self.assertNotIn('X-Consultas-SQL', r)
@@ -1,23 +1,39 @@
+import csv
+import tempfile
 from decimal import Decimal
 
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.db import transaction
 from django.db.models import (
-    Sum, F, DecimalField, Value, Q, Exists, OuterRef, Subquery,
+    F, Value, Q, Exists, OuterRef, Count, Prefetch, Sum,
     BooleanField, Case, When
 )
-from django.db.models.functions import Coalesce
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.timezone import now
 from django.views.decorators.http import require_POST
 
 from django.views.decorators.http import require_GET
 
-from .models import Estudiante, Contrato, Cuota, Pago, Nivel, Horario, Sede
+from . import cache_cxc, catalogos
+from .busqueda import filtrar_cuotas, filtrar_estudiantes
+from .cartera import tablero_cartera
+from .estados_cuenta import consultar_estados_cuenta, html_a_pdf, renderizar_html
+from .historial import etag_historial, historiales, version_de_cuota
+from .importacion import importar_pagos, leer_csv
+from .models import Acudiente, Estudiante, Contrato, Cuota, Pago, ResumenCartera
+from .paginacion import paginar_keyset
+from .services import (
+    ContratoOcupado, bloquear_contratos, guardar_pagos, preparar_pagos, refrescar_cuotas, saldo_de,
+    sincronizar_contratos,
+)
 
 
 
@@ -46,85 +62,196 @@ def login_view(request):
 
 @login_required
 def dashboard_view(request):
-    return render(request, 'dashboard.html')
+    # Cartera por edades precalculada (ResumenCartera); no consulta Cuota/Pago.
+    # Usuarios con sede: solo la suya, igual que listado_cxc
+    cartera = tablero_cartera(sede_id=getattr(request.user, 'sede_id', None))
+    return render(request, 'dashboard.html', {
+        'cartera': cartera,
+        'tablas_cartera': [
+            ('Por sede', cartera['por_sede']),
+            ('Por nivel', cartera['por_nivel']),
+            ('Por horario', cartera['por_horario']),
+        ],
+        'TRAMOS': ResumenCartera.TRAMOS,
+    })
+
+
+# Columnas de la tabla de estudiantes (only); nivel, horario y sede vienen de catalogos.py
+ESTUDIANTES_COLUMNAS = [
+    'id', 'nombre_completo', 'fecha_nacimiento', 'estado', 'observacion', 'valor_paquete_total',
+    'nivel_id', 'horario_id', 'sede_id', 'acudiente__nombre_completo',
+]
 
 
 @login_required
 def listar_estudiantes(request):
-    estudiantes = (
+    """
+    Listado de estudiantes paginado por cursor sobre id (?cursor=...), con filtros
+    sede, nivel, horario, estado y búsqueda por nombre o documento del estudiante o de su
+    acudiente (?q=, cada palabra por prefijo, como el listado CxC).
+    Solo trae las columnas que muestra la tabla; nivel, horario y sede salen de la cache
+    de catálogos, así el costo por página no crece con la cantidad de estudiantes.
+    """
+    sede_usuario_id = getattr(request.user, 'sede_id', None)
+
+    q_text     = (request.GET.get('q') or '').strip()
+    estado     = (request.GET.get('estado') or '').strip()
+    nivel_id   = (request.GET.get('nivel') or '').strip()
+    horario_id = (request.GET.get('horario') or '').strip()
+    sede_id    = (request.GET.get('sede') or '').strip() if not sede_usuario_id else ''  # solo globales
+
+    qs = (
         Estudiante.objects
-        .select_related('nivel', 'sede', 'acudiente', 'horario')
-        .order_by('id')  # Orden ascendente por ID
+        .select_related('acudiente')
+        .only(*ESTUDIANTES_COLUMNAS)
     )
-    return render(request, 'listar_estudiantes.html', {'estudiantes': estudiantes})
+    if sede_usuario_id:
+        qs = qs.filter(sede_id=sede_usuario_id)
+    elif sede_id.isdigit():
+        qs = qs.filter(sede_id=sede_id)
+    if estado:
+        qs = qs.filter(estado=estado)
+    if nivel_id.isdigit():
+        qs = qs.filter(nivel_id=nivel_id)
+    if horario_id.isdigit():
+        qs = qs.filter(horario_id=horario_id)
+    if q_text:
+        # Cada palabra por prefijo en el índice de búsqueda (sin LIKE '%...%'); ver busqueda.py
+        qs = filtrar_estudiantes(qs, q_text)
+
+    try:
+        per_page = int(request.GET.get('per_page', 50))
+    except ValueError:
+        per_page = 50
+    per_page = min(max(per_page, 10), 200)
+
+    pagina = paginar_keyset(qs, ['id'], request.GET.get('cursor') or '', per_page)
+    catalogos.adjuntar_catalogos(pagina.object_list)
+
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    return render(request, 'listar_estudiantes.html', {
+        'estudiantes': pagina.object_list,
+        'pagina': pagina,
+        'filtros_qs': params.urlencode(),
+        'q': q_text, 'estado': estado, 'nivel_id': nivel_id, 'horario_id': horario_id,
+        'sede_id': sede_id, 'per_page': per_page,
+        'niveles': catalogos.niveles(),
+        'horarios': catalogos.horarios(),
+        'sedes': catalogos.sedes() if not sede_usuario_id else [],
+        'ESTADOS': [e for e, _ in Estudiante.ESTADOS],
+    })
 
 
 @login_required
 def detalle_estudiante(request, id):
+    """
+    Ficha del estudiante con todos sus contratos (el más reciente primero), sus cuotas
+    con saldo y los totales por contrato. Siempre 3 consultas: estudiante, contratos
+    (totales agregados en la base) y cuotas de todos los contratos.
+    """
+    cuotas = Cuota.objects.annotate(saldo=F('valor') - F('valor_pagado')).order_by('fecha_vencimiento', 'numero')
+    contratos = (
+        Contrato.objects
+        .annotate(
+            cuotas_valor=Sum('cuota__valor', default=0),
+            cuotas_pagado=Sum('cuota__valor_pagado', default=0),
+            cuotas_saldo=Sum(F('cuota__valor') - F('cuota__valor_pagado'), default=0),
+            cuotas_pagadas=Count('cuota', filter=Q(cuota__estado='Pagada')),
+            cuotas_total=Count('cuota'),
+        )
+        .order_by('-id')
+    )
     estudiante = get_object_or_404(
-        Estudiante.objects.select_related('nivel', 'sede', 'acudiente', 'horario'),
+        Estudiante.objects
+        .select_related('nivel', 'sede', 'acudiente', 'horario')
+        .prefetch_related(
+            Prefetch('contrato_set', queryset=contratos, to_attr='contratos'),
+            Prefetch('contratos__cuota_set', queryset=cuotas, to_attr='cuotas'),
+        ),
         id=id
     )
-    contratos = Contrato.objects.filter(estudiante=estudiante).order_by('-id')
-    contrato_activo = contratos.first() if contratos.exists() else None
-    cuotas = contrato_activo.cuota_set.all() if contrato_activo else []
     return render(request, 'detalle_estudiante.html', {
         'estudiante': estudiante,
-        'contrato': contrato_activo,
-        'cuotas': cuotas,
+        'contratos': estudiante.contratos,
     })
 
 
 @login_required
-def listado_cxc(request):
+@require_GET
+def estado_cuenta(request, id):
     """
-    Listado de CUOTAS (una fila por cuota) con filtros y paginación.
-    - Muestra todas las cuotas (vencidas, pendientes, parciales y pagadas).
-    - Filtros: q, estado, nivel, horario, fv_desde/fv_hasta, medio, factura, referencia, con_pago, sede.
-    - Anota: total pagado por cuota, último pago (fecha/medio/factura/obs/referencia), SALDO y es_vencida_roja.
+    Estado de cuenta del acudiente: todos sus contratos con cuotas y pagos (cuatro consultas).
+    Usuarios con sede solo ven los contratos de su sede.
+    GET ?formato=html (por defecto, imprimible desde el navegador) | ?formato=pdf
     """
-    sede_usuario_id = getattr(request.user, 'sede_id', None)
     hoy = now().date()
+    acudiente = get_object_or_404(Acudiente.objects.only('id'), id=id)
+    sede_usuario_id = getattr(request.user, 'sede_id', None)
+    estados = consultar_estados_cuenta([acudiente.id], hoy, sede_id=sede_usuario_id)
+    if not estados:  # existe, pero sin contratos en la sede del usuario
+        return HttpResponse('No tiene permisos sobre esta sede.', status=403)
+    html = renderizar_html(estados, hoy)
 
-    # --------- Subqueries: último pago por cuota ---------
-    pagos_ordenados = Pago.objects.filter(cuota_id=OuterRef('pk')).order_by('-fecha_pago', '-id')
-    ultimo_pago_fecha      = Subquery(pagos_ordenados.values('fecha_pago')[:1])
-    ultimo_pago_medio      = Subquery(pagos_ordenados.values('forma_pago')[:1])
-    ultimo_pago_obs        = Subquery(pagos_ordenados.values('observacion')[:1])
-    ultimo_pago_factura    = Subquery(pagos_ordenados.values('numero_factura')[:1])
-    ultimo_pago_referencia = Subquery(pagos_ordenados.values('referencia')[:1])  # NUEVO
+    if request.GET.get('formato') == 'pdf':
+        try:
+            pdf = html_a_pdf(html)  # dependencia opcional
+        except ImportError:
+            return JsonResponse({'ok': False, 'error': 'PDF no disponible (falta weasyprint).'}, status=501)
+        resp = HttpResponse(pdf, content_type='application/pdf')
+        resp['Content-Disposition'] = f'inline; filename="estado_cuenta_{acudiente.id}_{hoy:%Y%m%d}.pdf"'
+        return resp
+    return HttpResponse(html)
+
+
+# Orden del listado CxC; la tupla es única (termina en id) para poder paginar por cursor
+CXC_ORDEN_KEYSET = ['contrato__estudiante__id', 'fecha_vencimiento', 'numero', 'id']
+
+
+def _filas_cxc(cuotas, hoy):
+    """
+    Estado de las filas del listado CxC para las cuotas dadas (ya actualizadas en memoria).
+    cxc.js lo usa para corregir solo esas filas después de aplicar o eliminar un pago.
+    """
+    filas = []
+    for c in cuotas:
+        medio = c.ultimo_pago_medio or ''
+        filas.append({
+            'cuota_id': c.id,
+            'valor': str(c.valor),
+            'valor_pagado': str(c.valor_pagado),
+            'saldo': str(saldo_de(c)),
+            'estado': c.estado,
+            'ultimo_pago_fecha': c.ultimo_pago_fecha.strftime('%Y-%m-%d') if c.ultimo_pago_fecha else '',
+            'ultimo_pago_medio': 'Banco' if medio == 'Transferencia' else medio,
+            'ultimo_pago_factura': c.ultimo_pago_factura or '',
+            'ultimo_pago_referencia': c.ultimo_pago_referencia or '',
+            'ultimo_pago_obs': c.ultimo_pago_obs or '',
+            'vencida_roja': c.fecha_vencimiento < hoy and c.valor > c.valor_pagado,
+        })
+    return filas
+
+
+def _filtrar_cxc(request, hoy):
+    """
+    Queryset de cuotas del CxC con seguridad por sede y los filtros del GET aplicados.
+    Lo comparten listado_cxc y exportar_cxc. Retorna (qs, filtros_activos).
+    """
+    sede_usuario_id = getattr(request.user, 'sede_id', None)
 
     # --------- Base queryset ---------
+    # Total pagado y último pago salen del snapshot mantenido en Cuota (ver services.py)
     qs = (
         Cuota.objects
-        .select_related(
-            'contrato__estudiante',
-            'contrato__estudiante__acudiente',
-            'contrato__estudiante__nivel',
-            'contrato__estudiante__horario',
-            'contrato__estudiante__sede',
-            'contrato',
-        )
-        .annotate(
-            pagado=Coalesce(
-                Sum('pagos__valor_pagado'),
-                Value(Decimal('0.00'), output_field=DecimalField())
-            ),
-            ultimo_pago_fecha=ultimo_pago_fecha,
-            ultimo_pago_medio=ultimo_pago_medio,
-            ultimo_pago_obs=ultimo_pago_obs,
-            ultimo_pago_factura=ultimo_pago_factura,
-            ultimo_pago_referencia=ultimo_pago_referencia,  # NUEVO
-        )
-        .annotate(saldo=F('valor') - F('pagado'))
+        .annotate(saldo=F('valor') - F('valor_pagado'))
         .annotate(
             es_vencida_roja=Case(
-                When(Q(fecha_vencimiento__lt=hoy) & Q(valor__gt=F('pagado')), then=Value(True)),
+                When(Q(fecha_vencimiento__lt=hoy) & Q(valor__gt=F('valor_pagado')), then=Value(True)),
                 default=Value(False),
                 output_field=BooleanField()
             )
         )
-        .order_by('contrato__estudiante__id', 'fecha_vencimiento', 'numero')
+        .order_by(*CXC_ORDEN_KEYSET)
     )
 
     # --------- Seguridad por sede ---------
@@ -144,19 +271,9 @@ def listado_cxc(request):
     con_pago   = (request.GET.get('con_pago') or '').strip()        # 'si' / 'no'
     sede_id    = (request.GET.get('sede') or '').strip() if not sede_usuario_id else ''  # solo globales
 
-    # Texto libre (incluye referencia)
+    # Texto libre (estudiante, acudiente, documentos, factura, referencia) vía índice de búsqueda
     if q_text:
-        filtros = (
-            Q(contrato__estudiante__nombre_completo__icontains=q_text) |
-            Q(contrato__estudiante__documento__icontains=q_text) |
-            Q(contrato__estudiante__acudiente__documento__icontains=q_text) |
-            Q(contrato__estudiante__acudiente__nombre_completo__icontains=q_text) |
-            Q(pagos__numero_factura__icontains=q_text) |
-            Q(pagos__referencia__icontains=q_text)  # NUEVO
-        )
-        if q_text.isdigit():
-            filtros |= Q(contrato_id=int(q_text))
-        qs = qs.filter(filtros).distinct()
+        qs = filtrar_cuotas(qs, q_text)
 
     # Estado de la cuota
     if estado:
@@ -193,18 +310,49 @@ def listado_cxc(request):
 
     # Con pago / sin pago
     if con_pago == 'si':
-        qs = qs.filter(pagado__gt=0)
+        qs = qs.filter(valor_pagado__gt=0)
     elif con_pago == 'no':
-        qs = qs.filter(pagado__lte=0)
+        qs = qs.filter(valor_pagado__lte=0)
 
     # Sede
     if sede_id:
         qs = qs.filter(contrato__estudiante__sede_id=sede_id)
 
-    # --------- Catálogos ---------
-    niveles  = Nivel.objects.all().order_by('nombre')
-    horarios = Horario.objects.all().order_by('descripcion')
-    sedes    = Sede.objects.all().order_by('nombre') if not sede_usuario_id else []
+    filtros = {
+        'q': q_text, 'estado': estado, 'nivel_id': nivel_id, 'horario_id': horario_id,
+        'fv_desde': fv_desde, 'fv_hasta': fv_hasta, 'medio': medio,
+        'factura': factura, 'referencia': referencia, 'con_pago': con_pago, 'sede_id': sede_id,
+    }
+    return qs, filtros
+
+
+@login_required
+def listado_cxc(request):
+    """
+    Listado de CUOTAS (una fila por cuota) con filtros y paginación.
+    - Muestra todas las cuotas (vencidas, pendientes, parciales y pagadas).
+    - Filtros: q, estado, nivel, horario, fv_desde/fv_hasta, medio, factura, referencia, con_pago, sede.
+    - Paginación por cursor (?cursor=...); ?contar=1 agrega el total exacto. ?page=N usa OFFSET (legado).
+    - Total pagado y último pago (fecha/medio/factura/obs/referencia) vienen del snapshot de Cuota.
+    - Anota: SALDO y es_vencida_roja.
+    - La tabla renderizada se guarda en cache por versión de datos de la sede (cache_cxc.py),
+      solo con cache compartida entre workers (settings.CXC_CACHE_PAGINAS).
+    """
+    sede_usuario_id = getattr(request.user, 'sede_id', None)
+    hoy = now().date()
+
+    qs, filtros = _filtrar_cxc(request, hoy)
+    # Nivel, horario y sede se toman de la cache de catálogos (ver adjuntar_catalogos abajo)
+    qs = qs.select_related(
+        'contrato__estudiante',
+        'contrato__estudiante__acudiente',
+        'contrato',
+    )
+
+    # --------- Catálogos (cache, sin consultas) ---------
+    niveles  = catalogos.niveles()
+    horarios = catalogos.horarios()
+    sedes    = catalogos.sedes() if not sede_usuario_id else []
 
     ESTADOS = ['Pendiente', 'Parcial', 'Vencida', 'Pagada']
     MEDIOS  = ['Banco', 'Nequi', 'Transferencia', 'Efectivo', 'Otro']
@@ -214,20 +362,60 @@ def listado_cxc(request):
         per_page = int(request.GET.get('per_page', 50))
     except ValueError:
         per_page = 50
-    page = request.GET.get('page', 1)
-
-    paginator = Paginator(qs, per_page)
-    page_obj = paginator.get_page(page)
+    per_page = min(max(per_page, 10), 200)
+
+    # Querystring de filtros (sin page/cursor) para armar los enlaces de navegación
+    params = request.GET.copy()
+    params.pop('page', None)
+    params.pop('cursor', None)
+    params.pop('contar', None)
+    filtros_qs = params.urlencode()
+
+    # --------- Tabla (cache por alcance + filtros + página, ver cache_cxc.py) ---------
+    clave = cache_cxc.clave_pagina(
+        sede_usuario_id or filtros['sede_id'],
+        filtros,
+        {
+            'per_page': per_page,
+            'page': request.GET.get('page') or '',
+            'cursor': request.GET.get('cursor') or '',
+            'contar': request.GET.get('contar') or '',
+        },
+        hoy,
+    )
+    tabla = cache_cxc.obtener(clave)
+    if tabla is None:
+        # Por defecto: cursor (keyset) sobre el orden del listado, sin COUNT ni OFFSET.
+        # ?page=N mantiene la paginación clásica para enlaces antiguos.
+        paginator = page_obj = pagina = None
+        total = None
+        if request.GET.get('page'):
+            paginator = Paginator(qs, per_page)
+            page_obj = paginator.get_page(request.GET.get('page'))
+            cuotas = page_obj.object_list
+        else:
+            pagina = paginar_keyset(qs, CXC_ORDEN_KEYSET, request.GET.get('cursor') or '', per_page)
+            cuotas = pagina.object_list
+            if request.GET.get('contar') == '1':  # total exacto solo bajo demanda
+                total = qs.count()
+        catalogos.adjuntar_catalogos([c.contrato.estudiante for c in cuotas])
+        tabla = render_to_string('listado_cxc_tabla.html', {
+            'cuotas': cuotas,
+            'page_obj': page_obj,
+            'paginator': paginator,
+            'pagina': pagina,
+            'total': total,
+            'filtros_qs': filtros_qs,
+            'per_page': per_page,
+        }, request=request)
+        cache_cxc.guardar(clave, tabla)
 
     context = {
-        'cuotas': page_obj.object_list,
-        'page_obj': page_obj,
-        'paginator': paginator,
+        'tabla': mark_safe(tabla),
+        'filtros_qs': filtros_qs,
 
         # filtros activos
-        'q': q_text, 'estado': estado, 'nivel_id': nivel_id, 'horario_id': horario_id,
-        'fv_desde': fv_desde, 'fv_hasta': fv_hasta, 'medio': medio,
-        'factura': factura, 'referencia': referencia, 'con_pago': con_pago, 'sede_id': sede_id,
+        **filtros,
         'per_page': per_page,
 
         # catálogos
@@ -238,17 +426,149 @@ def listado_cxc(request):
         'MEDIOS': MEDIOS,
 
         'hoy': hoy,  # para comparaciones en template si lo necesitas
+        'xlsx_max_filas': settings.CXC_XLSX_MAX_FILAS,
     }
     return render(request, 'listado_cxc.html', context)
 
 
+# Columnas de la exportación CxC: (encabezado, campo de .values())
+CXC_COLUMNAS_EXPORT = [
+    ('ID Est.', 'contrato__estudiante__id'),
+    ('Estudiante', 'contrato__estudiante__nombre_completo'),
+    ('Documento', 'contrato__estudiante__documento'),
+    ('Nombre Acudiente', 'contrato__estudiante__acudiente__nombre_completo'),
+    ('Nivel', 'contrato__estudiante__nivel__nombre'),
+    ('Horario', 'contrato__estudiante__horario__descripcion'),
+    ('Sede', 'contrato__estudiante__sede__nombre'),
+    ('Contrato', 'contrato_id'),
+    ('Factura', 'ultimo_pago_factura'),
+    ('Cuota #', 'numero'),
+    ('Valor Cuota', 'valor'),
+    ('Estado', 'estado'),
+    ('Vence', 'fecha_vencimiento'),
+    ('Pago', 'valor_pagado'),
+    ('Fecha Pago', 'ultimo_pago_fecha'),
+    ('Medio de Pago', 'ultimo_pago_medio'),
+    ('Referencia', 'ultimo_pago_referencia'),
+    ('Saldo Por Pagar', 'saldo'),
+    ('Observaciones', 'ultimo_pago_obs'),
+]
+CXC_LOTE_EXPORT = 2000
+
+
+def _filas_export_cxc(qs):
+    """
+    Recorre el queryset en lotes por cursor (keyset) y entrega listas de valores.
+    Cada lote es una consulta corta, así la memoria no crece con el total de filas
+    (el driver de MySQL trae el resultado completo de cada consulta al cliente).
+    """
+    campos = [c for _, c in CXC_COLUMNAS_EXPORT]
+    qs = qs.values(*campos, *[c for c in CXC_ORDEN_KEYSET if c not in campos])
+    cursor = ''
+    while True:
+        pagina = paginar_keyset(qs, CXC_ORDEN_KEYSET, cursor, CXC_LOTE_EXPORT)
+        for fila in pagina:
+            if fila['ultimo_pago_medio'] == 'Transferencia':
+                fila['ultimo_pago_medio'] = 'Banco'  # igual que en el listado
+            yield [fila[c] for c in campos]
+        if not pagina.has_next:
+            break
+        cursor = pagina.next_cursor
+
+
+class _Eco:
+    """Pseudo-buffer para csv.writer: retorna la línea en vez de guardarla."""
+    def write(self, value):
+        return value
+
+
+@login_required
+@require_GET
+def exportar_cxc(request):
+    """
+    Exporta el CxC con los MISMOS filtros de listado_cxc (sin paginar).
+    GET ?formato=csv (por defecto, en streaming, sin límite de filas)
+      | ?formato=xlsx (hasta settings.CXC_XLSX_MAX_FILAS; por encima responde 400 y pide CSV)
+    """
+    hoy = now().date()
+    qs, _ = _filtrar_cxc(request, hoy)
+    encabezados = [h for h, _ in CXC_COLUMNAS_EXPORT]
+    nombre = f'cxc_{hoy:%Y%m%d}'
+
+    if (request.GET.get('formato') or 'csv') == 'xlsx':
+        # El libro se arma completo antes de responder: acotado para no llegar al timeout
+        limite = settings.CXC_XLSX_MAX_FILAS
+        if qs.order_by()[:limite + 1].count() > limite:
+            return JsonResponse({
+                'ok': False,
+                'error': f'La exportación a Excel admite hasta {limite} filas: use CSV o agregue filtros.',
+            }, status=400)
+
+        try:
+            from openpyxl import Workbook  # dependencia opcional
+        except ImportError:
+            return JsonResponse({'ok': False, 'error': 'Exportación XLSX no disponible (falta openpyxl).'}, status=501)
+
+        # write_only escribe fila a fila a un archivo temporal (memoria constante)
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('CxC')
+        ws.append(encabezados)
+        for fila in _filas_export_cxc(qs):
+            ws.append(fila)
+        archivo = tempfile.TemporaryFile()
+        wb.save(archivo)
+        archivo.seek(0)
+        return FileResponse(archivo, as_attachment=True, filename=f'{nombre}.xlsx')
+
+    writer = csv.writer(_Eco())
+
+    def generar():
+        yield '\ufeff'  # BOM para que Excel reconozca UTF-8
+        yield writer.writerow(encabezados)
+        for fila in _filas_export_cxc(qs):
+            yield writer.writerow(fila)
+
+    response = StreamingHttpResponse(generar(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nombre}.csv"'
+    return response
+
+
+def _version_enviada(request):
+    """version_contrato del POST (la que el cliente vio en el historial) o None si no viene."""
+    valor = (request.POST.get('version_contrato') or '').strip()
+    return int(valor) if valor.isdigit() else None
+
+
+def _respuesta_ocupado():
+    return JsonResponse({
+        'ok': False,
+        'error': 'Otro usuario está registrando un movimiento en este contrato. Intente de nuevo.',
+        'error_code': 'contrato_ocupado',
+        'reintentar': True,
+    }, status=409)
+
+
+def _respuesta_version(version):
+    return JsonResponse({
+        'ok': False,
+        'error': 'Los pagos del contrato cambiaron mientras tenía abierto el historial. Revise y vuelva a intentar.',
+        'error_code': 'version_obsoleta',
+        'version_contrato': version,
+        'reintentar': True,
+    }, status=409)
+
+
 @login_required
 def aplicar_pago(request):
     """
     GET  => retorna historial de pagos de una cuota en JSON (para el modal) + previas con saldo.
             Parámetro requerido: ?cuota_id=<id>
+            Lleva ETag con la versión del contrato: si no cambió responde 304 con una sola consulta.
     POST => crea un Pago. Por defecto BLOQUEA si hay cuotas previas con saldo.
             Si se envía modo=auto, distribuye el pago primero en previas (más antiguas) y luego en la actual.
+            Retorna 'distribucion' y 'filas' (estado actualizado de cada cuota tocada, para el listado).
+            Bloquea solo el contrato (services.bloquear_contratos, NOWAIT): si está ocupado, o si
+            version_contrato (opcional) no es la actual, responde 409 con reintentar=True.
     """
     from django.utils.dateparse import parse_date  # import local
 
@@ -263,34 +583,6 @@ def aplicar_pago(request):
             return None, JsonResponse({'ok': False, 'error': 'No tiene permisos sobre esta sede.'}, status=403)
         return cuota, None
 
-    # --- Helper: QS de previas (mismo contrato, numero menor) con saldo usando aggregate ---
-    def previas_pendientes_for_get(cuota):
-        return (
-            Cuota.objects
-            .filter(contrato_id=cuota.contrato_id, numero__lt=cuota.numero)
-            .annotate(
-                pagado=Coalesce(
-                    Sum('pagos__valor_pagado'),
-                    Value(Decimal('0.00')),
-                    output_field=DecimalField(max_digits=12, decimal_places=2)
-                ),
-                saldo=F('valor') - F('pagado'),
-            )
-            .filter(saldo__gt=0)
-            .order_by('numero')
-        )
-
-    def serializar_previas(qs):
-        return [
-            {
-                'cuota_id': c.id,
-                'numero': c.numero,
-                'vence': c.fecha_vencimiento.strftime('%Y-%m-%d'),
-                'saldo': str(c.saldo),
-            }
-            for c in qs
-        ]
-
     # =========================
     # GET: historial de pagos
     # =========================
@@ -298,34 +590,36 @@ def aplicar_pago(request):
         cuota_id = (request.GET.get('cuota_id') or '').strip()
         if not cuota_id:
             return JsonResponse({'ok': False, 'error': 'Falta cuota_id.'}, status=400)
-
-        cuota, resp_error = obtener_cuota_segura(cuota_id)
-        if resp_error:
-            return resp_error
-
-        pagos_qs = (
-            Pago.objects
-            .filter(cuota_id=cuota.id)
-            .order_by('fecha_pago', 'id')
-            .values('id', 'fecha_pago', 'valor_pagado', 'forma_pago', 'numero_factura', 'referencia', 'observacion')
-        )
-
-        pagos = []
-        for p in pagos_qs:
-            medio = p['forma_pago'] or ''
-            medio = 'Banco' if medio == 'Transferencia' else medio
-            pagos.append({
-                'id': p['id'],
-                'fecha_pago': p['fecha_pago'].strftime('%Y-%m-%d'),
-                'valor_pagado': str(p['valor_pagado']),
-                'forma_pago': medio,
-                'numero_factura': p['numero_factura'] or '',
-                'referencia': p['referencia'] or '',
-                'observacion': p['observacion'] or '',
-            })
-
-        previas_qs = previas_pendientes_for_get(cuota)
-        return JsonResponse({'ok': True, 'pagos': pagos, 'previas_pendientes': serializar_previas(previas_qs)})
+        if not cuota_id.isdigit():
+            return JsonResponse({'ok': False, 'error': 'cuota_id inválido.'}, status=400)
+        cuota_id = int(cuota_id)
+
+        # Versión del contrato leída ANTES de los datos (una consulta por PK): si un pago entra
+        # en medio, la respuesta queda con la versión vieja y la próxima apertura se recalcula.
+        # Sale de la base y no de la cache: con cache por proceso otro worker no vería el cambio.
+        fila = version_de_cuota(cuota_id)
+        if fila is None:
+            return JsonResponse({'ok': False, 'error': 'Cuota no encontrada.'}, status=404)
+        etag = etag_historial(cuota_id, *fila)
+
+        # El navegador ya tiene esta versión: 304 sin consultar pagos ni cuotas
+        no_modificado = get_conditional_response(request, etag=etag)
+        if no_modificado is not None:
+            return no_modificado
+
+        datos = historiales([cuota_id], sede_id=getattr(request.user, 'sede_id', None)).get(cuota_id)
+        if datos is None:  # la cuota existe (ver arriba), así que es de otra sede
+            return JsonResponse({'ok': False, 'error': 'No tiene permisos sobre esta sede.'}, status=403)
+
+        resp = JsonResponse({
+            'ok': True,
+            'pagos': datos['pagos'],
+            'previas_pendientes': datos['previas_pendientes'],
+            'version_contrato': datos['version_contrato'],
+        })
+        resp['ETag'] = etag
+        patch_cache_control(resp, private=True, no_cache=True)  # revalidar siempre con ETag
+        return resp
 
     # ========================= #
     # POST: aplicar pago        #
@@ -381,117 +675,134 @@ def aplicar_pago(request):
     if not fecha_pago:
         fecha_pago = now().date()
 
-    with transaction.atomic():
-        # Bloquear cuota actual y previas
-        cuotas_locked = list(
-            Cuota.objects.select_for_update()
-            .filter(Q(id=cuota.id) | Q(contrato_id=cuota.contrato_id, numero__lt=cuota.numero))
-            .select_related('contrato')
-            .order_by('numero')
-        )
-        by_id = {c.id: c for c in cuotas_locked}
-        cuota = by_id[cuota.id]
-        previas_locked = [c for c in cuotas_locked if c.id != cuota.id]
-
-        def saldo_de(c: Cuota) -> Decimal:
-            return (c.valor or Decimal('0.00')) - (c.valor_pagado or Decimal('0.00'))
-
-        previas_con_saldo = [c for c in previas_locked if saldo_de(c) > 0]
-        saldo_actual = saldo_de(cuota)
-
-        # Si hay previas con saldo y no es modo auto, bloquear
-        if previas_con_saldo and modo != 'auto':
-            previas_json = [
-                {
-                    'cuota_id': c.id,
-                    'numero': c.numero,
-                    'vence': c.fecha_vencimiento.strftime('%Y-%m-%d'),
-                    'saldo': str(saldo_de(c))
-                }
-                for c in previas_con_saldo
-            ]
-            return JsonResponse({
-                'ok': False,
-                'error': 'Existen cuotas anteriores con saldo pendiente. Debe cubrirlas primero o usar distribución automática.',
-                'error_code': 'previas_pendientes',
-                'previas': previas_json,
-            }, status=400)
-
-        # En modo auto validar capacidad total (previas + actual)
-        if modo == 'auto':
-            capacidad_total = sum((saldo_de(c) for c in previas_con_saldo), Decimal('0.00')) + saldo_actual
-            if valor > capacidad_total:
-                return JsonResponse({
-                    'ok': False,
-                    'error': f'El valor ({valor}) supera la capacidad total disponible ({capacidad_total}).',
-                    'error_code': 'supera_capacidad',
-                    'capacidad_total': str(capacidad_total),
-                    'previas': [
-                        {
-                            'cuota_id': c.id,
-                            'numero': c.numero,
-                            'vence': c.fecha_vencimiento.strftime('%Y-%m-%d'),
-                            'saldo': str(saldo_de(c))
-                        }
-                        for c in previas_con_saldo
-                    ],
-                }, status=400)
-
-        # Helper: crear pago y actualizar cuota
-        def aplicar_a_cuota(c: Cuota, monto: Decimal) -> Decimal:
-            if monto <= 0:
-                return Decimal('0.00')
-            saldo_c = saldo_de(c)
-            aplicar = min(monto, saldo_c)
-            if aplicar <= 0:
-                return Decimal('0.00')
-
-            Pago.objects.create(
-                contrato=c.contrato,
-                cuota=c,
+    try:
+        with transaction.atomic():
+            return _aplicar_pago_bloqueado(request, cuota, valor, modo, dict(
                 fecha_pago=fecha_pago,
-                valor_pagado=aplicar,
                 forma_pago=forma_pago,
                 numero_factura=numero_factura,
                 referencia=referencia,
-                observacion=observacion
-            )
+                observacion=observacion,
+            ))
+    except ContratoOcupado:
+        return _respuesta_ocupado()
 
-            c.valor_pagado = (c.valor_pagado or Decimal('0.00')) + aplicar
-            if c.valor_pagado >= c.valor:
-                c.estado = 'Pagada'
-            elif c.valor_pagado > 0:
-                c.estado = 'Parcial'
-            else:
-                c.estado = 'Pendiente'
-            c.save(update_fields=['valor_pagado', 'estado'])
-            return aplicar
-
-        distribucion = []
-
-        if previas_con_saldo and modo == 'auto':
-            monto = valor
-            # Primero previas
-            for c_prev in previas_con_saldo:
-                aplicado = aplicar_a_cuota(c_prev, monto)
-                if aplicado > 0:
-                    distribucion.append({'cuota_id': c_prev.id, 'numero': c_prev.numero, 'aplicado': str(aplicado)})
-                    monto -= aplicado
-                if monto <= 0:
-                    break
-            # Remanente a la actual
-            if monto > 0:
-                aplicado = aplicar_a_cuota(cuota, monto)
-                if aplicado > 0:
-                    distribucion.append({'cuota_id': cuota.id, 'numero': cuota.numero, 'aplicado': str(aplicado)})
-        else:
-            # Flujo normal: tope en saldo de la actual
-            if valor > saldo_actual:
-                return JsonResponse({'ok': False, 'error': f'El valor supera el saldo de la cuota: {saldo_actual}.'}, status=400)
-            aplicado = aplicar_a_cuota(cuota, valor)
-            distribucion.append({'cuota_id': cuota.id, 'numero': cuota.numero, 'aplicado': str(aplicado)})
 
-    return JsonResponse({'ok': True, 'distribucion': distribucion})
+def _aplicar_pago_bloqueado(request, cuota, valor, modo, datos_pago):
+    """Parte de aplicar_pago POST que corre con el contrato bloqueado (dentro de atomic)."""
+    version = bloquear_contratos([cuota.contrato_id])[cuota.contrato_id]
+    enviada = _version_enviada(request)
+    if enviada is not None and enviada != version:
+        return _respuesta_version(version)
+
+    # Cuota actual y previas, leídas después de tomar el bloqueo del contrato
+    cuotas_leidas = list(
+        Cuota.objects
+        .filter(Q(id=cuota.id) | Q(contrato_id=cuota.contrato_id, numero__lt=cuota.numero))
+        .order_by('numero')
+    )
+    by_id = {c.id: c for c in cuotas_leidas}
+    cuota = by_id[cuota.id]
+    previas = [c for c in cuotas_leidas if c.id != cuota.id]
+
+    previas_con_saldo = [c for c in previas if saldo_de(c) > 0]
+    saldo_actual = saldo_de(cuota)
+
+    # Si hay previas con saldo y no es modo auto, bloquear
+    if previas_con_saldo and modo != 'auto':
+        previas_json = [
+            {
+                'cuota_id': c.id,
+                'numero': c.numero,
+                'vence': c.fecha_vencimiento.strftime('%Y-%m-%d'),
+                'saldo': str(saldo_de(c))
+            }
+            for c in previas_con_saldo
+        ]
+        return JsonResponse({
+            'ok': False,
+            'error': 'Existen cuotas anteriores con saldo pendiente. Debe cubrirlas primero o usar distribución automática.',
+            'error_code': 'previas_pendientes',
+            'previas': previas_json,
+        }, status=400)
+
+    # En modo auto validar capacidad total (previas + actual)
+    if modo == 'auto':
+        capacidad_total = sum((saldo_de(c) for c in previas_con_saldo), Decimal('0.00')) + saldo_actual
+        if valor > capacidad_total:
+            return JsonResponse({
+                'ok': False,
+                'error': f'El valor ({valor}) supera la capacidad total disponible ({capacidad_total}).',
+                'error_code': 'supera_capacidad',
+                'capacidad_total': str(capacidad_total),
+                'previas': [
+                    {
+                        'cuota_id': c.id,
+                        'numero': c.numero,
+                        'vence': c.fecha_vencimiento.strftime('%Y-%m-%d'),
+                        'saldo': str(saldo_de(c))
+                    }
+                    for c in previas_con_saldo
+                ],
+            }, status=400)
+
+    # Distribución calculada en memoria; luego un INSERT y un UPDATE en bloque
+    # (antes: un create() + un save() por cuota mientras seguían bloqueadas)
+    if previas_con_saldo and modo == 'auto':
+        # Primero previas (más antiguas), remanente a la actual
+        pagos = preparar_pagos(previas_con_saldo + [cuota], valor, **datos_pago)
+    else:
+        # Flujo normal: tope en saldo de la actual
+        if valor > saldo_actual:
+            return JsonResponse({'ok': False, 'error': f'El valor supera el saldo de la cuota: {saldo_actual}.'}, status=400)
+        pagos = preparar_pagos([cuota], valor, **datos_pago)
+
+    guardar_pagos(pagos)
+    distribucion = [
+        {'cuota_id': p.cuota.id, 'numero': p.cuota.numero, 'aplicado': str(p.valor_pagado)}
+        for p in pagos
+    ]
+    tocadas = list({p.cuota.id: p.cuota for p in pagos}.values())
+    return JsonResponse({
+        'ok': True,
+        'distribucion': distribucion,
+        'filas': _filas_cxc(tocadas, now().date()),
+        'version_contrato': version + 1,  # sincronizar_contratos la subió
+    })
+
+
+# Máximo de cuotas por consulta de historial en lote (= per_page máximo del listado)
+HISTORIAL_LOTE_MAX = 200
+
+
+@login_required
+@require_GET
+def historial_pagos_lote(request):
+    """
+    Historiales de varias cuotas en una respuesta (cxc.js los precarga para la página actual).
+    GET: ?ids=1,2,3 (hasta HISTORIAL_LOTE_MAX). Retorna {'ok', 'historiales': {cuota_id: {...}}}
+    con el mismo formato que aplicar_pago GET; se omiten las cuotas de otras sedes.
+    """
+    crudos = [i.strip() for i in (request.GET.get('ids') or '').split(',') if i.strip()]
+    if not crudos:
+        return JsonResponse({'ok': False, 'error': 'Falta ids.'}, status=400)
+    if not all(i.isdigit() for i in crudos):
+        return JsonResponse({'ok': False, 'error': 'ids inválidos.'}, status=400)
+    if len(crudos) > HISTORIAL_LOTE_MAX:
+        return JsonResponse({'ok': False, 'error': f'Máximo {HISTORIAL_LOTE_MAX} cuotas por consulta.'}, status=400)
+
+    datos = historiales(crudos, sede_id=getattr(request.user, 'sede_id', None))
+    return JsonResponse({
+        'ok': True,
+        'historiales': {
+            str(cuota_id): {
+                'pagos': d['pagos'],
+                'previas_pendientes': d['previas_pendientes'],
+                'version_contrato': d['version_contrato'],
+            }
+            for cuota_id, d in datos.items()
+        },
+    })
 
 
 @login_required
@@ -499,7 +810,9 @@ def aplicar_pago(request):
 def eliminar_pago(request):
     """
     Elimina un pago por su ID y actualiza la cuota (valor_pagado y estado).
-    POST: pago_id
+    POST: pago_id (+ version_contrato opcional, como en aplicar_pago)
+    Retorna 'filas' con el estado actualizado de la cuota para el listado CxC.
+    Mismo bloqueo que aplicar_pago (el contrato, NOWAIT); conflictos -> 409.
     """
     pago_id = (request.POST.get('pago_id') or '').strip()
     if not pago_id:
@@ -511,37 +824,66 @@ def eliminar_pago(request):
         pk=pago_id
     )
 
-    # Si el pago no está asociado a cuota
-    if pago.cuota_id is None:
-        pago.delete()
-        return JsonResponse({'ok': True})
+    if pago.cuota_id is not None:
+        sede_usuario_id = getattr(request.user, 'sede_id', None)
+        if sede_usuario_id and pago.cuota.contrato.estudiante.sede_id != sede_usuario_id:
+            return JsonResponse({'ok': False, 'error': 'No tiene permisos sobre esta sede.'}, status=403)
 
-    sede_usuario_id = getattr(request.user, 'sede_id', None)
-    if sede_usuario_id and pago.cuota.contrato.estudiante.sede_id != sede_usuario_id:
-        return JsonResponse({'ok': False, 'error': 'No tiene permisos sobre esta sede.'}, status=403)
-
-    with transaction.atomic():
-        # Bloquear la cuota y eliminar el pago
-        cuota = Cuota.objects.select_for_update().get(pk=pago.cuota_id)
-        pago.delete()
-
-        # Recalcular total pagado y estado
-        nuevo_pagado = cuota.pagos.aggregate(
-            total=Coalesce(
-                Sum('valor_pagado'),
-                Value(Decimal('0.00')),
-                output_field=DecimalField(max_digits=12, decimal_places=2)
-            )
-        )['total'] or Decimal('0.00')
+    try:
+        with transaction.atomic():
+            version = bloquear_contratos([pago.contrato_id])[pago.contrato_id]
+            enviada = _version_enviada(request)
+            if enviada is not None and enviada != version:
+                return _respuesta_version(version)
+            borrados, _ = Pago.objects.filter(pk=pago.pk).delete()
+            if not borrados:  # otro usuario lo eliminó antes de tomar el bloqueo
+                return JsonResponse({'ok': False, 'error': 'El pago ya fue eliminado.'}, status=404)
+
+            # Si el pago no está asociado a cuota
+            if pago.cuota_id is None:
+                sincronizar_contratos([pago.contrato_id])
+                return JsonResponse({'ok': True, 'filas': [], 'version_contrato': version + 1})
+
+            # Recalcular total pagado, estado y snapshot del último pago. Con hoy: si queda sin
+            # pagos y ya venció vuelve a 'Vencida' (actualizar_cuotas incremental no la revisaría)
+            hoy = now().date()
+            cuota = Cuota.objects.get(pk=pago.cuota_id)
+            refrescar_cuotas([cuota], hoy=hoy)
+            sincronizar_contratos([cuota.contrato_id])
+    except ContratoOcupado:
+        return _respuesta_ocupado()
+
+    return JsonResponse({'ok': True, 'filas': _filas_cxc([cuota], hoy), 'version_contrato': version + 1})
 
-        cuota.valor_pagado = nuevo_pagado
-        if nuevo_pagado >= cuota.valor:
-            cuota.estado = 'Pagada'
-        elif nuevo_pagado > 0:
-            cuota.estado = 'Parcial'
-        else:
-            # No forzamos 'Vencida' aquí; otra rutina puede marcar por fecha
-            cuota.estado = 'Pendiente'
-        cuota.save(update_fields=['valor_pagado', 'estado'])
 
-    return JsonResponse({'ok': True})
+@login_required
+def importar_pagos_view(request):
+    """
+    GET  => formulario para subir el CSV del extracto.
+    POST => aplica los pagos en bloque (ver importacion.py) y muestra el reporte por fila.
+            Con dry_run=1 solo valida y calcula la distribución.
+    """
+    contexto = {'reporte': None}
+    if request.method == 'POST':
+        archivo = request.FILES.get('archivo')
+        if not archivo:
+            contexto['error'] = 'Seleccione un archivo CSV.'
+        else:
+            try:
+                texto = archivo.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                texto = None
+                contexto['error'] = 'El archivo debe estar en UTF-8.'
+            if texto is not None:
+                dry_run = request.POST.get('dry_run') == '1'
+                reporte = importar_pagos(
+                    leer_csv(texto),
+                    sede_id=getattr(request.user, 'sede_id', None),
+                    dry_run=dry_run,
+                )
+                contexto.update({
+                    'reporte': reporte,
+                    'dry_run': dry_run,
+                    'aplicadas': sum(1 for r in reporte if r['ok']),
+                })
+    return render(request, 'importar_pagos.html', contexto)
@@ -0,0 +1,83 @@
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_GET
+
+from .historial import ahistoriales, aversion_de_cuota, etag_historial
+from .views import HISTORIAL_LOTE_MAX
+
+# Versiones async de los endpoints JSON de solo lectura (historial de pagos del modal CxC).
+# Mismas respuestas que aplicar_pago GET e historial_pagos_lote, pero sin ocupar un hilo
+# mientras esperan a MySQL: bajo ASGI (ver erp_sen/asgi.py) un proceso atiende
+# muchas de estas peticiones a la vez. Bajo WSGI también funcionan, sin esa ganancia.
+# Usuario con request.auser(); login_required acepta vistas async desde Django 5.1.
+
+
+async def _sede_usuario(request):
+    usuario = await request.auser()
+    return getattr(usuario, 'sede_id', None)
+
+
+@login_required
+@require_GET
+async def historial_pago(request):
+    """
+    Igual que aplicar_pago GET: historial de pagos de una cuota + previas con saldo.
+    GET: ?cuota_id=<id>. ETag con la versión del contrato; 304 con una sola consulta.
+    """
+    cuota_id = (request.GET.get('cuota_id') or '').strip()
+    if not cuota_id:
+        return JsonResponse({'ok': False, 'error': 'Falta cuota_id.'}, status=400)
+    if not cuota_id.isdigit():
+        return JsonResponse({'ok': False, 'error': 'cuota_id inválido.'}, status=400)
+    cuota_id = int(cuota_id)
+
+    # Versión del contrato leída antes de los datos (ver aplicar_pago)
+    fila = await aversion_de_cuota(cuota_id)
+    if fila is None:
+        return JsonResponse({'ok': False, 'error': 'Cuota no encontrada.'}, status=404)
+    etag = etag_historial(cuota_id, *fila)
+
+    no_modificado = get_conditional_response(request, etag=etag)
+    if no_modificado is not None:
+        return no_modificado
+
+    datos = (await ahistoriales([cuota_id], sede_id=await _sede_usuario(request))).get(cuota_id)
+    if datos is None:  # la cuota existe (ver arriba), así que es de otra sede
+        return JsonResponse({'ok': False, 'error': 'No tiene permisos sobre esta sede.'}, status=403)
+
+    resp = JsonResponse({
+        'ok': True,
+        'pagos': datos['pagos'],
+        'previas_pendientes': datos['previas_pendientes'],
+        'version_contrato': datos['version_contrato'],
+    })
+    resp['ETag'] = etag
+    patch_cache_control(resp, private=True, no_cache=True)
+    return resp
+
+
+@login_required
+@require_GET
+async def historial_pagos_lote(request):
+    """Igual que views.historial_pagos_lote: GET ?ids=1,2,3 (hasta HISTORIAL_LOTE_MAX)."""
+    crudos = [i.strip() for i in (request.GET.get('ids') or '').split(',') if i.strip()]
+    if not crudos:
+        return JsonResponse({'ok': False, 'error': 'Falta ids.'}, status=400)
+    if not all(i.isdigit() for i in crudos):
+        return JsonResponse({'ok': False, 'error': 'ids inválidos.'}, status=400)
+    if len(crudos) > HISTORIAL_LOTE_MAX:
+        return JsonResponse({'ok': False, 'error': f'Máximo {HISTORIAL_LOTE_MAX} cuotas por consulta.'}, status=400)
+
+    datos = await ahistoriales(crudos, sede_id=await _sede_usuario(request))
+    return JsonResponse({
+        'ok': True,
+        'historiales': {
+            str(cuota_id): {
+                'pagos': d['pagos'],
+                'previas_pendientes': d['previas_pendientes'],
+                'version_contrato': d['version_contrato'],
+            }
+            for cuota_id, d in datos.items()
+        },
+    })